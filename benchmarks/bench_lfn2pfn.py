@@ -0,0 +1,75 @@
+"""Microbenchmark of Lfn2PfnMapper.parse
+
+Compares trying each mapping in turn (as the parser did before the mappings were compiled),
+the prefix-indexed matcher, and the matcher with the memo of recent results.
+
+    python -m benchmarks.bench_lfn2pfn [--rules N] [--paths N] [--xml storage.xml]
+"""
+import argparse
+import random
+import timeit
+
+from cephsumserver.backend.lfn2pfn import Lfn2PfnMapper
+
+VOS = ['atlas', 'cms', 'lhcb', 'dune', 'lsst', 'na62', 'skao', 'mice', 't2k', 'snoplus',
+       'ilc', 'pheno', 'cta', 'lz', 'hyperk', 'dteam', 'ops', 'gridpp', 'enmr', 'solid']
+
+
+def synthetic_xml(n_rules):
+    """Return a storage.xml string with about n_rules direct mappings, in the style of a multi-VO site"""
+    rules = []
+    for i in range(n_rules // 3 + 1):
+        vo = VOS[i % len(VOS)] + ('' if i < len(VOS) else str(i))
+        rules.append(f'<lfn-to-pfn protocol="direct" path-match="/+{vo}/disk/(.*)" result="{vo}disk:$1"/>')
+        rules.append(f'<lfn-to-pfn protocol="direct" path-match="/+{vo}/tape/(.*)/(.*)" result="{vo}tape:$1/$2"/>')
+        rules.append(f'<lfn-to-pfn protocol="direct" path-match="^/eos/{vo}/(.*)" result="{vo}:$1"/>')
+    rules.append('<lfn-to-pfn protocol="direct" path-match="/*(store/.*)" result="cms:/$1"/>')
+    return '<storage-mapping>' + ''.join(rules) + '</storage-mapping>'
+
+
+def synthetic_paths(mapper, n_paths):
+    """Return paths matching the rules of the mapper, spread over the rules"""
+    paths = []
+    for i in range(n_paths):
+        pattern = random.choice(mapper.mappings)[0].pattern
+        path = pattern.lstrip('^').replace('/+', '/').replace('/*', '/')
+        path = path.replace('(store/.*)', 'store/(.*)')
+        paths.append(path.replace('(.*)', f'f{i}', 1).replace('(.*)', 'd'))
+    return paths
+
+
+def sequential(mapper):
+    """Return a copy of mapper that tries each mapping in turn, without the memo"""
+    copy = Lfn2PfnMapper(memo_size=0)
+    copy.mappings = mapper.mappings
+    copy._matcher.candidates = lambda pathname: range(len(copy._matcher.rules))
+    return copy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, default=60, help='Number of synthetic mappings')
+    parser.add_argument('--paths', type=int, default=2000, help='Number of distinct paths parsed')
+    parser.add_argument('--xml', default=None, help='Use the mappings from this storage.xml instead')
+    args = parser.parse_args()
+
+    if args.xml:
+        mapper = Lfn2PfnMapper.from_file(args.xml)
+    else:
+        mapper = Lfn2PfnMapper.from_string(synthetic_xml(args.rules))
+    paths = synthetic_paths(mapper, args.paths)
+
+    indexed = Lfn2PfnMapper(memo_size=0)
+    indexed.mappings = mapper.mappings
+    variants = [('sequential', sequential(mapper)), ('indexed', indexed), ('indexed+memo', mapper)]
+
+    for name, m in variants:
+        assert [m.parse(p) for p in paths] == [variants[0][1].parse(p) for p in paths]
+    print(f'{len(mapper.mappings)} mappings, {len(paths)} paths')
+    for name, m in variants:
+        t = min(timeit.repeat(lambda: [m.parse(p) for p in paths], number=5, repeat=3)) / (5 * len(paths))
+        print(f'{name:15s} {t*1e6:8.2f} us/parse')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Benchmark suite, run against the in-memory rados stand-in, so no Ceph cluster is needed.
+
+Measures cks_from_file over a range of file sizes and read modes, cks_from_metadata, XrdCks.from_binary,
+Lfn2PfnMapper.parse, and end-to-end requests through the threaded server, reporting MB/s or
+requests/s with p50/p99 latencies. Results are written as json, to compare across versions:
+
+    python -m benchmarks.suite --output results-0.9.2.json
+    python -m benchmarks.suite --sizes 4K,1M,1G,16G --only file
+    python -m benchmarks.suite --output new.json --compare results-0.9.2.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import sys
+import threading
+import time
+
+from cephsumserver.backend import memrados
+# must be installed before the modules using rados are imported
+memrados.install(force=True)
+
+import cephsumserver
+from cephsumserver.backend import cephtools, radospool, XrdCks
+from cephsumserver.backend.lfn2pfn import Lfn2PfnMapper
+from cephsumserver.common.requestmanager import ExecutionEngine
+from cephsumserver.server import auth, message, reqserver
+from cephsumserver.workers import cksum, handler, stat
+
+from .bench_lfn2pfn import synthetic_xml, synthetic_paths
+
+POOL = 'bench'
+OBJECT_SIZE = 64*1024**2
+AUTHKEY = b'benchmark'
+
+log = logging.getLogger('benchmarks')
+
+_UNITS = {'K':1024, 'M':1024**2, 'G':1024**3}
+
+
+def parse_size(text: str) -> int:
+    """Convert e.g. 4K, 64M or 16G into bytes"""
+    text = text.strip().upper().rstrip('B')
+    if text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+def format_size(size: int) -> str:
+    for unit in ('G', 'M', 'K'):
+        if size >= _UNITS[unit] and size % _UNITS[unit] == 0:
+            return f'{size // _UNITS[unit]}{unit}'
+    return str(size)
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarise(name, params, latencies, total_seconds, nbytes=None):
+    """Return the result dict of a benchmark from its per-operation latencies, in seconds"""
+    result = {'name':name, 'params':params, 'n':len(latencies),
+              'mean_ms':round(1000 * statistics.mean(latencies), 4),
+              'p50_ms':round(1000 * percentile(latencies, 0.5), 4),
+              'p99_ms':round(1000 * percentile(latencies, 0.99), 4),
+              'ops_per_s':round(len(latencies) / total_seconds, 2)}
+    if nbytes is not None:
+        result['mb_per_s'] = round(nbytes * len(latencies) / total_seconds / 1e6, 2)
+    log.info(f"{name} {params}: " + ', '.join(f'{k} {v}' for k, v in result.items()
+                                                  if k not in ('name', 'params')))
+    return result
+
+def timed_calls(fn, repeat, min_seconds=0.):
+    """Call fn repeat times, or more until min_seconds have passed; return (latencies, total seconds)"""
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < repeat or time.perf_counter() - start < min_seconds:
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start
+
+
+def bench_file(sizes, repeat, readsize):
+    """cks_from_file for each size, with sequential, read-ahead and parallel reads"""
+    cluster = memrados.Rados()
+    cluster.connect()
+    ioctx = cluster.open_ioctx(POOL)
+    modes = [('sequential', 1, 0), ('readahead2', 1, 2), ('parallel4', 4, 0)]
+    results = []
+    for size in sizes:
+        path = f'file_{format_size(size)}'
+        memrados.STORE.write_striped(POOL, path, size=size, object_size=OBJECT_SIZE)
+        expected = memrados.STORE.striped_adler32(size, OBJECT_SIZE)
+        for mode, max_inflight, readahead in modes:
+            def run():
+                cks = cephtools.cks_from_file(ioctx, path, readsize, max_inflight, readahead)
+                if cks.get_cksum_as_hex() != expected:
+                    raise RuntimeError(f"Wrong checksum for {path}: {cks.get_cksum_as_hex()}, expected {expected}")
+            # fewer repeats of the large files
+            n = max(1, min(repeat, int(repeat * 64*1024**2 / max(size, 1))))
+            latencies, total = timed_calls(run, n)
+            results.append(summarise('cks_from_file', {'size':format_size(size), 'mode':mode,
+                                                       'readsize':format_size(readsize)}, latencies, total, size))
+        for index in range(max(1, -(-size // OBJECT_SIZE))):
+            memrados.STORE.remove(POOL, f'{path}.{index:016x}')
+    return results
+
+
+def bench_metadata(repeat):
+    """cks_from_metadata and XrdCks.from_binary"""
+    cluster = memrados.Rados()
+    cluster.connect()
+    ioctx = cluster.open_ioctx(POOL)
+    binary = XrdCks.XrdCks('adler32', int(time.time()), 10, '0a0b0c0d').to_binary()
+    memrados.STORE.write_striped(POOL, 'metadata', size=1024, xattrs={'XrdCks.adler32':binary})
+    results = []
+    latencies, total = timed_calls(lambda: cephtools.cks_from_metadata(ioctx, 'metadata', 'XrdCks.adler32'),
+                                   repeat, 1.)
+    results.append(summarise('cks_from_metadata', {}, latencies, total))
+    latencies, total = timed_calls(lambda: XrdCks.XrdCks.from_binary(binary), repeat, 1.)
+    results.append(summarise('XrdCks.from_binary', {}, latencies, total))
+    return results
+
+
+def bench_lfn2pfn(repeat):
+    """Lfn2PfnMapper.parse of distinct paths, without and with the memo"""
+    results = []
+    for memo_size in (0, 10000):
+        mapper = Lfn2PfnMapper.from_string(synthetic_xml(60), memo_size=memo_size)
+        paths = synthetic_paths(mapper, 2000)
+        position = [0]
+        def run():
+            mapper.parse(paths[position[0] % len(paths)])
+            position[0] += 1
+        latencies, total = timed_calls(run, max(repeat, 2*len(paths)), 1.)
+        results.append(summarise('Lfn2PfnMapper.parse', {'rules':len(mapper.mappings), 'memo':memo_size},
+                                 latencies, total))
+    return results
+
+
+class _Client:
+    """A v2 session with the server"""
+
+    def __init__(self, address):
+        self._sock = socket.create_connection(address)
+        auth.answer_challenge(self._sock, AUTHKEY)
+        self._first = True
+
+    def request(self, msg):
+        msg = dict(msg)
+        if self._first:
+            msg['ver'] = 'v2'
+            self._first = False
+        message.send(self._sock, msg)
+        while True:
+            reply = message.recv(self._sock)
+            if reply.get('msg') == 'response':
+                return reply
+
+    def close(self):
+        if not self._first:
+            message.send(self._sock, None)
+            message.recv(self._sock)
+        self._sock.close()
+
+
+def bench_server(requests, concurrency, file_size):
+    """Requests per second through the threaded server, from concurrent v2 sessions"""
+    server = reqserver.ThreadedTCPServer(('localhost', 0), reqserver.ThreadedTCPRequestHandler, authkey=AUTHKEY)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    address = server.server_address[:2]
+
+    binary = XrdCks.XrdCks('adler32', int(time.time()), 10, '0a0b0c0d').to_binary()
+    memrados.STORE.write_striped(POOL, 'server_meta', size=1024, xattrs={'XrdCks.adler32':binary})
+    # a file per session, as concurrent requests for the same file are coalesced
+    for session in range(concurrency):
+        memrados.STORE.write_striped(POOL, f'server_file{session}', size=file_size, object_size=OBJECT_SIZE)
+    cases = [('stat', {'msg':'stat', 'path':f'{POOL}:server_meta'}),
+             ('cksum_metadata', {'msg':'cksum', 'path':f'{POOL}:server_meta', 'action':'metaonly', 'algtype':'adler32'}),
+             ('cksum_file', {'msg':'cksum', 'path':f'{POOL}:server_file{{session}}', 'action':'fileonly', 'algtype':'adler32'})]
+    results = []
+    try:
+        for name, msg in cases:
+            latencies = []
+            lock = threading.Lock()
+            failures = []
+            # time the requests once all sessions are connected
+            connected = threading.Barrier(concurrency + 1)
+            def session(index, n):
+                request = dict(msg, path=msg['path'].format(session=index))
+                try:
+                    client = _Client(address)
+                finally:
+                    connected.wait()
+                try:
+                    for _ in range(n):
+                        t0 = time.perf_counter()
+                        reply = client.request(request)
+                        elapsed = time.perf_counter() - t0
+                        if reply.get('status') != 0:
+                            failures.append(reply)
+                        with lock:
+                            latencies.append(elapsed)
+                finally:
+                    client.close()
+            n = requests if name != 'cksum_file' else max(concurrency, requests // 20)
+            threads = [threading.Thread(target=session, args=(i, n // concurrency)) for i in range(concurrency)]
+            for t in threads:
+                t.start()
+            connected.wait()
+            start = time.perf_counter()
+            for t in threads:
+                t.join()
+            total = time.perf_counter() - start
+            if failures:
+                raise RuntimeError(f"Server benchmark {name} failed: {failures[0]}")
+            results.append(summarise(f'server.{name}', {'concurrency':concurrency,
+                                     'size':format_size(file_size) if name == 'cksum_file' else None},
+                                     latencies, total, file_size if name == 'cksum_file' else None))
+    finally:
+        server.shutdown()
+        server.socket.close()
+    return results
+
+
+def compare(results, baseline_file):
+    """Print the change of each result against the baseline run, matched by name and params"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    previous = {(r['name'], json.dumps(r['params'], sort_keys=True)):r for r in baseline['results']}
+    print(f"Compared with {baseline_file} (version {baseline.get('version')}):")
+    for result in results:
+        old = previous.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+        if old is None:
+            continue
+        metric = 'mb_per_s' if 'mb_per_s' in result else 'ops_per_s'
+        ratio = result[metric] / old[metric] if old[metric] else float('inf')
+        p99 = result['p99_ms'] / old['p99_ms'] if old['p99_ms'] else float('inf')
+        print(f"  {result['name']:24s} {json.dumps(result['params'], sort_keys=True):60s} "
+              f"{metric} x{ratio:.2f}  p99 x{p99:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='4K,1M,64M,1G', help='Comma separated file sizes, e.g. 4K,1M,1G,16G')
+    parser.add_argument('--readsize', default='64M', help='Read size for the file checksums')
+    parser.add_argument('--repeat', type=int, default=20, help='Repeats of each measurement (fewer for large files)')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per server benchmark')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client sessions in the server benchmark')
+    parser.add_argument('--only', default='file,metadata,lfn2pfn,server', help='Comma separated benchmarks to run')
+    parser.add_argument('--output', default=None, help='Write the results as json to this file; else to stdout')
+    parser.add_argument('--compare', default=None, help='Json results of an earlier run to compare with')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log each result as it completes')
+    args = parser.parse_args()
+
+    # the server and actions log each request, so only show warnings from them
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    log.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    memrados.STORE.create_pool(POOL)
+    radospool.RadosPool.create(max_size=4, lfn2pfn=None, readsize=parse_size(args.readsize), health_interval=0)
+    ExecutionEngine.create({ExecutionEngine.FAST:16, ExecutionEngine.SLOW:4})
+    handler.register_workers({'stat':stat.Stat, 'cksum':cksum.Cksum})
+
+    only = [x.strip() for x in args.only.split(',')]
+    results = []
+    if 'file' in only:
+        results += bench_file([parse_size(s) for s in args.sizes.split(',')], args.repeat, parse_size(args.readsize))
+    if 'metadata' in only:
+        results += bench_metadata(args.repeat)
+    if 'lfn2pfn' in only:
+        results += bench_lfn2pfn(args.repeat)
+    if 'server' in only:
+        results += bench_server(args.requests, args.concurrency, 64*1024**2)
+
+    report = {'suite':'cephsumserver', 'version':cephsumserver.__version__,
+              'python':platform.python_version(), 'machine':platform.machine(), 'cpus':os.cpu_count(),
+              'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'results':results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
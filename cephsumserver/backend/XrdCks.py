@@ -1,6 +1,8 @@
 import struct,sys, logging
 import datetime
 
+from .digests import ALGORITHMS
+
 # Checksum object; as specified in: https://github.com/xrootd/xrootd/blob/master/src/XrdCks/XrdCksData.hh 
 
 # class XrdCksData
@@ -22,6 +24,9 @@ import datetime
 # char      Value[ValuSize];      // The binary checksum value
 # 92 bytes total ? 
 
+# algorithms whose checksums can be held
+SUPPORTED_ALGORITHMS = ALGORITHMS
+
 class XrdCks :
 
     # how the XrdCks is represented in binary
@@ -44,14 +49,15 @@ class XrdCks :
         self.read_format = None
         self.source_type = None
         self.total_size_bytes = None
+        self.stripe_manifest = None
         self.verify() 
 
     def verify(self):
         """
         Perform basic validity checks on stored checksum values. Raise excpetion if fails.
         """
-        if self.name not in ['adler32']:
-            raise NotImplementedError("Only adler32 enabled.",self.name)
+        if self.name not in SUPPORTED_ALGORITHMS:
+            raise NotImplementedError(f"Only {', '.join(SUPPORTED_ALGORITHMS)} enabled.",self.name)
 
         if len(self.name) > (self._NameSize -1):
             raise ValueError("Name has too many characters: ", len(self.name)) 
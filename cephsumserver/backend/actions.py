@@ -2,34 +2,78 @@ import logging,argparse
 import sys, os,re
 from datetime import datetime
 import functools
+import random
 
-import rados
-from ..backend import XrdCks,cephtools
+from ..backend import XrdCks
+from ..backend.manifest import MANIFEST_XATTR
+from ..common.cache import ChecksumCache
 
 
-def get_from_metatdata(ioctx, path, xattr_name = "XrdCks.adler32"):
+def _cache_lookup(backend, path, xattr_name):
+    """Resolve the metadata of a path and look it up in the checksum cache, if enabled.
+
+    Returns tuple of (cache, metadata, cached checksum), where cache is None if not enabled.
+    metadata includes the stat if the cache is enabled, and is None if the path does not exist.
+    """
+    ckscache = ChecksumCache.cache()
+    try:
+        metadata = backend.metadata(path, with_stat=ckscache is not None)
+    except backend.NotFound:
+        return ckscache, None, None
+    if ckscache is None:
+        return None, metadata, None
+    xrdcks = ckscache.get(backend.name, path, xattr_name, metadata.mtime, metadata.total_size())
+    if xrdcks is not None:
+        logging.debug(f'Path:{path}; checksum from cache')
+    return ckscache, metadata, xrdcks
+
+def _cache_store(ckscache, backend, metadata, xattr_name, xrdcks):
+    """Store the checksum for the file in the state given by metadata, if caching is enabled"""
+    if ckscache is not None:
+        ckscache.put(backend.name, metadata.path, xattr_name, metadata.mtime, metadata.total_size(), xrdcks)
+
+
+def get_from_metatdata(backend, path, xattr_name = "XrdCks.adler32"):
     """Try to get checksum info from metadata only.
     """
-    xrdcks = cephtools.cks_from_metadata(ioctx,path,xattr_name)
+    ckscache, metadata, xrdcks = _cache_lookup(backend, path, xattr_name)
+    if metadata is None:
+        logging.debug("No chunk found for %s", path)
+        return None
+    if xrdcks is not None and xrdcks.source_type == 'file':
+        # cached from a file read, but not stored in the metadata
+        xrdcks = None
+    if xrdcks is None:
+        xrdcks = backend.cks_from_metadata(path,xattr_name,metadata=metadata)
+        _cache_store(ckscache, backend, metadata, xattr_name, xrdcks)
     logging.info(xrdcks)
     return xrdcks  # returns None if not existing
 
-def get_from_file(ioctx, path, readsize):
+def get_from_file(backend, path, readsize, max_inflight=1, readahead=0):
     """Try to get checksum info from file only.
     """
-    xrdcks = cephtools.cks_from_file(ioctx,path,readsize)
+    xrdcks = backend.cks_from_file(path,readsize,max_inflight,readahead)
     logging.info(xrdcks)
     return xrdcks  # returns None if not existing
 
-def get_checksum(ioctx, path, readsize, xattr_name = "XrdCks.adler32"):
+def get_checksum(backend, path, readsize, xattr_name = "XrdCks.adler32", max_inflight=1, readahead=0):
     """Try to get checksum info from metadata; else use file.
     No data is writen to metadata, and no comparison is performed
     """
     source = 'metadata'
-    xrdcks = get_from_metatdata(ioctx, path, xattr_name)
+    ckscache, metadata, xrdcks = _cache_lookup(backend, path, xattr_name)
+    if metadata is None:
+        logging.warning(f'Path:{path}; not found')
+        return None
+    if xrdcks is not None:
+        source = 'cache'
+    else:
+        xrdcks = backend.cks_from_metadata(path, xattr_name, metadata=metadata)
     if xrdcks is None:
-        xrdcks = get_from_file(ioctx, path,readsize)
+        xrdcks = backend.cks_from_file(path,readsize,max_inflight,readahead,metadata=metadata)
         source = 'file'
+    if source != 'cache':
+        _cache_store(ckscache, backend, metadata, xattr_name, xrdcks)
     if xrdcks is None:
         logging.warning(f'Path:{path}; No existing or could not be computed')
         return None
@@ -38,23 +82,42 @@ def get_checksum(ioctx, path, readsize, xattr_name = "XrdCks.adler32"):
 
 
 
-def inget(ioctx, path, readsize, xattr_name = "XrdCks.adler32",rewriteto_littleendian=True):
+def inget(backend, path, readsize, xattr_name = "XrdCks.adler32",rewriteto_littleendian=True, max_inflight=1, readahead=0,
+          write_manifest=False):
     """Return a checksum; if in metadata, just return that. If no metadata, obtain from file and store metadata.
     If rewriteto_littleendian and metadata was stored in big endian; write it back as little endian
+    If write_manifest, also store the per-stripe checksum manifest when computed from file.
     """
     source = 'metadata'
-    xrdcks = get_from_metatdata(ioctx, path, xattr_name)
+    ckscache, metadata, xrdcks = _cache_lookup(backend, path, xattr_name)
+    if metadata is None:
+        logging.warning(f"No checksum possible for {path}; not found")
+        return None
+    cached_from_file = None
+    if xrdcks is not None:
+        if xrdcks.source_type != 'file':
+            logging.info(f'Path:{path}; From:cache; Checksum:{xrdcks.get_cksum_as_hex()}')
+            return xrdcks
+        # computed from the unchanged file by an earlier request, but not yet stored in metadata
+        cached_from_file = xrdcks
+    xrdcks = backend.cks_from_metadata(path, xattr_name, metadata=metadata)
+    logging.info(xrdcks)
+    rewritten = False
 
     if rewriteto_littleendian and xrdcks is not None and xrdcks.read_format == 'big':
         logging.debug(f'Rewriting to little endian {path}')
         cks_binary = xrdcks.to_binary()
         logging.debug(cks_binary)
-        cephtools.cks_write_metadata(ioctx, path, xattr_name, cks_binary, force_overwrite=True)
+        backend.cks_write_metadata(path, xattr_name, cks_binary, force_overwrite=True)
+        rewritten = True
 
 
     if xrdcks is None:
         source = 'file'
-        xrdcks = cephtools.cks_from_file(ioctx, path,readsize)
+        if cached_from_file is not None:
+            xrdcks = cached_from_file
+        else:
+            xrdcks = backend.cks_from_file(path,readsize,max_inflight,readahead,metadata=metadata)
         if xrdcks is None:
             logging.warning(f"No checksum possible for {path} from file")
             return None
@@ -62,7 +125,18 @@ def inget(ioctx, path, readsize, xattr_name = "XrdCks.adler32",rewriteto_littlee
 
         cks_binary = xrdcks.to_binary()
         logging.debug(cks_binary)
-        cephtools.cks_write_metadata(ioctx, path, xattr_name, cks_binary, force_overwrite=False)
+        backend.cks_write_metadata(path, xattr_name, cks_binary, force_overwrite=False)
+        if write_manifest and xrdcks.stripe_manifest is not None:
+            logging.debug(f'Writing stripe manifest {path}: {xrdcks.stripe_manifest}')
+            backend.cks_write_metadata(path, MANIFEST_XATTR, xrdcks.stripe_manifest.to_binary(), force_overwrite=True)
+        rewritten = True
+
+    if ckscache is not None:
+        # writing the metadata changes the object, so only cache entries from an unmodified file
+        if rewritten:
+            ckscache.invalidate(backend.name, path)
+        else:
+            _cache_store(ckscache, backend, metadata, xattr_name, xrdcks)
 
     cks_hex = xrdcks.get_cksum_as_hex() if xrdcks is not None else "None"
     logging.info(f'Path:{path}; From:{source}; Checksum:{cks_hex}')
@@ -70,24 +144,172 @@ def inget(ioctx, path, readsize, xattr_name = "XrdCks.adler32",rewriteto_littlee
     return xrdcks 
 
 
-def verify(ioctx, path, readsize, xattr_name = "XrdCks.adler32", force_fileread=False):
+def verify(backend, path, readsize, xattr_name = "XrdCks.adler32", force_fileread=False, max_inflight=1, readahead=0):
     """compare the stored checksum against the file-computed value.
     If no stored metadata, still compute file (if requested), but compare as false.
     """
 
-    xrdcks_stored = cephtools.cks_from_metadata(ioctx, path, xattr_name)
+    try:
+        metadata = backend.metadata(path)
+    except backend.NotFound:
+        logging.warning(f"{path} not found")
+        return None
+    xrdcks_stored = backend.cks_from_metadata(path, xattr_name, metadata=metadata)
     if xrdcks_stored is None:
         logging.debug(f'{path} has no stored metadata')
 
     if xrdcks_stored is None and not force_fileread:
         xrdcks_file = None
     else:
-        xrdcks_file = cephtools.cks_from_file(ioctx, path,readsize)
+        xrdcks_file = backend.cks_from_file(path,readsize,max_inflight,readahead,metadata=metadata)
 
     if xrdcks_stored is None:
         matching = False
     else:
         matching = xrdcks_stored.get_cksum_as_binary() == xrdcks_file.get_cksum_as_binary()
 
+    # with a stored manifest, also report which stripes differ
+    manifest = backend.manifest_from_metadata(path, metadata)
+    if manifest is not None and xrdcks_file is not None and xrdcks_file.stripe_manifest is not None \
+            and manifest.matches_layout(xrdcks_file.stripe_manifest.object_size, xrdcks_file.total_size_bytes):
+        file_stripes = dict(enumerate(xrdcks_file.stripe_manifest.stripe_checksums))
+        bad_stripes = manifest.mismatched_stripes(file_stripes)
+        if len(bad_stripes) > 0:
+            logging.warning(f'{path}; Mismatched stripes: {bad_stripes}')
+
     logging.info (f'{path}; Matched  : {matching}, Metadata : {"None" if xrdcks_stored is None else xrdcks_stored}, File: {"None" if xrdcks_file   is None else xrdcks_file}'  )
-    return xrdcks_stored if matching else None 
+    return xrdcks_stored if matching else None
+
+
+def verify_stripes(backend, path, readsize, stripes=None, sample=None, max_inflight=1):
+    """Compare stripes of the file against the stored per-stripe checksum manifest.
+
+    stripes is an optional (first, last) inclusive range of stripe indices, 
+    sample an optional number of stripes to check, chosen at random (within the range, if given).
+    If neither, all stripes are checked.
+    Returns tuple of (checked stripe indices, mismatched stripe indices).
+    Raises ValueError if no valid manifest is stored for the current layout.
+    """
+    try:
+        metadata = backend.metadata(path)
+    except backend.NotFound:
+        raise ValueError(f"{path} not found")
+    manifest = backend.manifest_from_metadata(path, metadata)
+    if manifest is None:
+        raise ValueError(f"No stripe manifest stored for {path}")
+    rados_object_size, total_size, num_stripes, last_stripe_size = metadata.striper()
+    if not manifest.matches_layout(rados_object_size, total_size):
+        raise ValueError(f"Stripe manifest for {path} does not match the current layout")
+
+    first, last = (0, manifest.num_stripes - 1) if stripes is None else stripes
+    if first < 0 or last >= manifest.num_stripes or first > last:
+        raise ValueError(f"Stripe range {first}-{last} not valid for {manifest.num_stripes} stripes")
+    candidates = list(range(first, last+1))
+    if sample is not None and sample < len(candidates):
+        candidates = sorted(random.sample(candidates, sample))
+
+    bad_stripes = backend.verify_stripes(path, manifest, candidates, readsize, max_inflight)
+    logging.info(f'{path}; Stripes checked: {len(candidates)}, Mismatched stripes: {bad_stripes}')
+    return candidates, bad_stripes
+
+
+### Several checksum algorithms at once; each function returns a dict of XrdCks by algorithm, or None
+
+def _stored_checksums(backend, path, algs, metadata):
+    """Return dict of the checksum stored for each of algs, by algorithm; None where not stored"""
+    return {alg:backend.cks_from_metadata(path, f'XrdCks.{alg}', metadata=metadata) for alg in algs}
+
+def get_from_metadata_multi(backend, path, algs):
+    """Get the checksums of algs from metadata only; None if any of them is not stored.
+    """
+    try:
+        metadata = backend.metadata(path)
+    except backend.NotFound:
+        logging.debug("No file found for %s", path)
+        return None
+    stored = _stored_checksums(backend, path, algs, metadata)
+    if any(xrdcks is None for xrdcks in stored.values()):
+        return None
+    return stored
+
+def get_from_file_multi(backend, path, algs, readsize, max_inflight=1, readahead=0):
+    """Compute the checksums of algs from file only, in a single read.
+    """
+    checksums = backend.cks_from_file_multi(path, algs, readsize, max_inflight, readahead)
+    logging.info(checksums)
+    return checksums
+
+def get_checksum_multi(backend, path, algs, readsize, max_inflight=1, readahead=0):
+    """Get the checksums of algs from metadata; those not stored are computed from file, in a single read.
+    No data is writen to metadata, and no comparison is performed
+    """
+    try:
+        metadata = backend.metadata(path, with_stat=True)
+    except backend.NotFound:
+        logging.warning(f'Path:{path}; not found')
+        return None
+    checksums = _stored_checksums(backend, path, algs, metadata)
+    missing = [alg for alg in algs if checksums[alg] is None]
+    if missing:
+        computed = backend.cks_from_file_multi(path, missing, readsize, max_inflight, readahead, metadata=metadata)
+        if computed is None:
+            logging.warning(f'Path:{path}; No existing or could not be computed')
+            return None
+        checksums.update(computed)
+    logging.info(f'Path:{path}; From file:{missing}; Checksums:{ {alg:x.get_cksum_as_hex() for alg, x in checksums.items()} }')
+    return checksums
+
+def inget_multi(backend, path, algs, readsize, max_inflight=1, readahead=0, rewriteto_littleendian=True):
+    """Return the checksums of algs; those in metadata are returned as is, and those not are computed 
+    from file, in a single read, and all stored in a single write-back.
+    If rewriteto_littleendian, stored checksums in big endian are written back as little endian.
+    """
+    try:
+        metadata = backend.metadata(path, with_stat=True)
+    except backend.NotFound:
+        logging.warning(f"No checksum possible for {path}; not found")
+        return None
+    checksums = _stored_checksums(backend, path, algs, metadata)
+    rewrite = {}
+    if rewriteto_littleendian:
+        rewrite = {alg:xrdcks for alg, xrdcks in checksums.items() if xrdcks is not None and xrdcks.read_format == 'big'}
+    missing = [alg for alg in algs if checksums[alg] is None]
+    computed = {}
+    if missing:
+        computed = backend.cks_from_file_multi(path, missing, readsize, max_inflight, readahead, metadata=metadata)
+        if computed is None:
+            logging.warning(f"No checksum possible for {path} from file")
+            return None
+        checksums.update(computed)
+
+    if rewrite:
+        logging.debug(f'Rewriting to little endian {path}: {list(rewrite)}')
+        backend.cks_write_metadata_multi(path, rewrite, force_overwrite=True)
+    if computed:
+        backend.cks_write_metadata_multi(path, computed, force_overwrite=False)
+    ckscache = ChecksumCache.cache()
+    if ckscache is not None and (rewrite or computed):
+        ckscache.invalidate(backend.name, path)
+
+    logging.info(f'Path:{path}; From file:{missing}; Checksums:{ {alg:x.get_cksum_as_hex() for alg, x in checksums.items()} }')
+    return checksums
+
+def verify_multi(backend, path, algs, readsize, max_inflight=1, readahead=0):
+    """Compare the stored checksums of algs against those computed from file, in a single read.
+    Returns the stored checksums if all are stored and match, else None.
+    """
+    try:
+        metadata = backend.metadata(path, with_stat=True)
+    except backend.NotFound:
+        logging.warning(f"{path} not found")
+        return None
+    stored = _stored_checksums(backend, path, algs, metadata)
+    if any(xrdcks is None for xrdcks in stored.values()):
+        logging.info(f'{path}; no stored metadata for {[alg for alg, x in stored.items() if x is None]}')
+        return None
+    computed = backend.cks_from_file_multi(path, algs, readsize, max_inflight, readahead, metadata=metadata)
+    if computed is None:
+        return None
+    mismatched = [alg for alg in algs if stored[alg].get_cksum_as_binary() != computed[alg].get_cksum_as_binary()]
+    logging.info(f'{path}; Matched  : {not mismatched}, Mismatched: {mismatched}, Metadata : {stored}, File: {computed}')
+    return stored if not mismatched else None
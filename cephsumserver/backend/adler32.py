@@ -3,6 +3,8 @@ import logging
 import struct 
 # 
 
+BASE = 65521 # largest prime smaller than 65536, as used by zlib
+
 
 class adler32():
     def __init__(self,name='adler32'):
@@ -29,6 +31,53 @@ class adler32():
         return a32_int
 
 
+    @staticmethod
+    def adler32_combine(adler1, adler2, len2):
+        """Combine two adler32 int values into the value of the concatenated data.
+
+        adler1 is the checksum of the first block, adler2 that of the second block,
+        which is len2 bytes long. Follows the adler32_combine function of zlib.
+        """
+        rem = len2 % BASE
+        sum1 = adler1 & 0xffff
+        sum2 = (rem * sum1) % BASE
+        sum1 += (adler2 & 0xffff) + BASE - 1
+        sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + BASE - rem
+        if sum1 >= BASE:
+            sum1 -= BASE
+        if sum1 >= BASE:
+            sum1 -= BASE
+        if sum2 >= (BASE << 1):
+            sum2 -= (BASE << 1)
+        if sum2 >= BASE:
+            sum2 -= BASE
+        return sum1 | (sum2 << 16)
+
+    def combine_checksums(self, parts):
+        """Combine the checksums of consecutive blocks of data into the value of the whole.
+
+        Final value is converted to hex string, stored internally and returned, as per calc_checksum.
+
+    Parameters:
+        parts: ordered iterable of (adler32 int value, length in bytes) for each block
+
+    Returns:
+        Checksum: adler32 value in lowercase hex 
+        """
+        value  = 1 # initilising value
+        bytes_read = 0
+        counter = 0
+        for part_value, part_length in parts:
+            value = self.adler32_combine(value, part_value, part_length)
+            bytes_read += part_length
+            counter += 1
+
+        self.value      = self.adler32_inttohex(value)
+        self.bytes_read = bytes_read
+        self.number_buffers = counter
+
+        return self.value
+
     def calc_checksum(self,buffer):
         """Read in data and calculate the checksum.
 
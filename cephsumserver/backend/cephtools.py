@@ -1,13 +1,25 @@
+from collections import deque, namedtuple
 from datetime import date, datetime, timedelta
+import errno
+import queue
+import struct
 import time
 import logging,argparse,math
+import zlib
 
 from ..backend import XrdCks,adler32
+from ..backend.manifest import StripeManifest, MANIFEST_XATTR
+from ..common import metrics, trace
+from ..common.membudget import read_buffers
+from .storage import FileMetadata, new_file_checksum
 import rados
 
 chunk0=f'.{0:016x}' # Chunks are 16 digit hex valued
 nZeros=16
 
+# A single read of a byte range within one of the stripe objects of a file
+StripeRead = namedtuple("StripeRead", "index oid offset length")
+
 
 ### Object based operations 
 
@@ -38,15 +50,51 @@ def get_chunks(ioctx,path, stripe_count=None):
             #logging.debug(oid)
             yield oid
         except rados.ObjectNotFound:
-            raise StopIteration
+            return
         counter += 1
         if stripe_count is not None and counter == stripe_count:
             # read all required chunks; stop
-            raise StopIteration
+            return
+
+
+class _AioRead:
+    """A single asynchronous read request; wait() blocks until the data is available"""
+
+    def __init__(self, ioctx, oid, length, offset):
+        self.oid = oid
+        self.length = length
+        self.offset = offset
+        self._data = None
+        self._completion = ioctx.aio_read(oid, length, offset, self._oncomplete)
+
+    def _oncomplete(self, completion, data_read):
+        self._data = data_read
+
+    def wait(self):
+        """Return the bytes read, or raise the error of the read"""
+        self._completion.wait_for_complete_and_cb()
+        retval = self._completion.get_return_value()
+        if retval == -errno.ENOENT:
+            raise rados.ObjectNotFound(f"Object {self.oid} not found")
+        if retval < 0:
+            raise IOError(f"Error {retval} reading {self.oid}")
+        return self._data
 
-def read_oid_bytes(ioctx,oid,stripe_size_bytes=None, readsize=64*1024*1024):
+    def drain(self):
+        """Wait for the read to finish and discard the data"""
+        self._completion.wait_for_complete_and_cb()
+        self._data = None
+
+
+def read_oid_bytes(ioctx,oid,stripe_size_bytes=None, readsize=64*1024*1024, readahead=0):
     """Yield the bytes in a file, grouped by readsize and offset
+
+    If readahead is 2 or more, use the read-ahead pipeline holding at most readahead buffers.
     """
+    if readahead > 1:
+        yield from _read_oid_bytes_ahead(ioctx, oid, stripe_size_bytes, readsize, readahead)
+        return
+
     offset = 0
     # read at most readsize bytes, and stripe_size_bytes if defined
     read_length = readsize if stripe_size_bytes is None else min(readsize,stripe_size_bytes)
@@ -62,7 +110,7 @@ def read_oid_bytes(ioctx,oid,stripe_size_bytes=None, readsize=64*1024*1024):
         offset = offset + actual_length #TODO actual or expected length to add to offset
         if actual_length == 0:
             # end of chunk
-            raise StopIteration
+            return
 
         # yield buffer here, as something to give back
         yield buf
@@ -70,29 +118,222 @@ def read_oid_bytes(ioctx,oid,stripe_size_bytes=None, readsize=64*1024*1024):
         #must assume we read and of the file, and read a remainder bytes in the last chunk; so we stop
         if actual_length < read_length:
             #FIXME - is the abover acertian always true?
-            raise StopIteration
+            return
 
         # if we know we've read all data in the chunk, stop aleady
         if stripe_size_bytes is not None and offset >= stripe_size_bytes:
             # assumed end of chunk, or we fell of the end?
-            raise StopIteration
-            
+            return
+
 
+def _read_oid_bytes_ahead(ioctx, oid, stripe_size_bytes, readsize, depth):
+    """Read-ahead version of read_oid_bytes.
 
+    While the caller processes the current buffer, the next depth-1 reads are already 
+    in flight, so at most depth*readsize bytes are held for the request.
+    """
+    read_length = readsize if stripe_size_bytes is None else min(readsize,stripe_size_bytes)
+    pending = deque()
+    next_offset = 0
+
+    def fill():
+        nonlocal next_offset
+        while len(pending) < depth - 1:
+            if stripe_size_bytes is not None and next_offset >= stripe_size_bytes:
+                break
+            pending.append(_AioRead(ioctx, oid, read_length, next_offset))
+            next_offset += read_length
+
+    try:
+        fill()
+        while pending:
+            buf = pending.popleft().wait()
+            actual_length = len(buf)
+            if actual_length == 0:
+                # end of chunk
+                return
+            if actual_length < read_length:
+                # last part of the chunk; anything still in flight is past the end
+                yield buf
+                return
+            fill()
+            yield buf
+    finally:
+        # let any outstanding reads complete, so their buffers are released before we return
+        for aio in pending:
+            aio.drain()
+
+
+def plan_stripe_reads(path, total_size, rados_object_size, readsize):
+    """Return the ordered list of StripeRead ranges needed to cover total_size bytes.
+
+    The plan is built from the striper layout alone, so no per-stripe stat is needed.
+    Each stripe is split into reads of at most readsize bytes.
+    """
+    reads = []
+    for index in range(math.ceil(total_size/rados_object_size)):
+        oid = path+f'.{index:016x}'
+        stripe_length = min(rados_object_size, total_size - index*rados_object_size)
+        offset = 0
+        while offset < stripe_length:
+            length = min(readsize, stripe_length - offset)
+            reads.append(StripeRead(index, oid, offset, length))
+            offset += length
+    return reads
+
+
+def read_planned_bytes(ioctx, reads, readahead=0):
+    """Yield the bytes for each StripeRead in reads, in order.
+
+    Reading stops at the first missing stripe or short read, as the file cannot then match
+    the planned size; the caller is expected to check the total bytes read.
+    If readahead is 2 or more, the next readahead-1 reads are kept in flight (across stripes) 
+    while the current buffer is consumed.
+    """
+    if readahead > 1:
+        yield from _read_planned_bytes_ahead(ioctx, reads, readahead)
+        return
+
+    for read in reads:
+        try:
+            buf = ioctx.read(read.oid, read.length, read.offset)
+        except rados.ObjectNotFound:
+            logging.warning(f"Stripe {read.oid} not found")
+            return
+        if len(buf) > 0:
+            yield buf
+        if len(buf) < read.length:
+            logging.warning(f"Short read of {len(buf)} bytes from {read.oid} at {read.offset}; expected {read.length}")
+            return
+
+
+def _read_planned_bytes_ahead(ioctx, reads, depth):
+    """Read-ahead version of read_planned_bytes, holding at most depth buffers"""
+    pending = deque()
+    next_position = 0
+
+    def fill():
+        nonlocal next_position
+        while len(pending) < depth - 1 and next_position < len(reads):
+            read = reads[next_position]
+            pending.append(_AioRead(ioctx, read.oid, read.length, read.offset))
+            next_position += 1
 
-def read_file_btyes(ioctx, path, stripe_size_bytes=None, number_of_stripes=None,readsize=64*1024*1024):
+    try:
+        fill()
+        while pending:
+            aio = pending.popleft()
+            try:
+                buf = aio.wait()
+            except rados.ObjectNotFound:
+                logging.warning(f"Stripe {aio.oid} not found")
+                return
+            if len(buf) < aio.length:
+                logging.warning(f"Short read of {len(buf)} bytes from {aio.oid} at {aio.offset}; expected {aio.length}")
+                if len(buf) > 0:
+                    yield buf
+                return
+            fill()
+            yield buf
+    finally:
+        # let any outstanding reads complete, so their buffers are released before we return
+        for aio in pending:
+            aio.drain()
+
+
+def read_file_btyes(ioctx, path, stripe_size_bytes=None, number_of_stripes=None,readsize=64*1024*1024, readahead=0, total_size=None):
     """Yield all bytes in a file, looping over chunks, and then bytes with the file.
 
+    if stripe_size_bytes and total_size are given, the reads are planned from the layout, 
+    without probing each chunk; otherwise each chunk is stat'ed in turn, as follows:
     if stripe_size_bytes is None, will use READSIZE and read each stripe for all data.
     if stripe_size_bytes is given, will assume each chunk is the given size.
+    if readahead is 2 or more, the next readahead-1 reads are kept in flight while the 
+    current buffer is consumed; memory use is bounded by readsize*readahead.
     """
+    if stripe_size_bytes is not None and total_size is not None:
+        yield from read_planned_bytes(ioctx, plan_stripe_reads(path, total_size, stripe_size_bytes, readsize), readahead)
+        return
+
     for oid in get_chunks(ioctx, path, number_of_stripes):
-        for buffer in read_oid_bytes(ioctx, oid, stripe_size_bytes, readsize=readsize):
+        for buffer in read_oid_bytes(ioctx, oid, stripe_size_bytes, readsize=readsize, readahead=readahead):
             yield buffer
-    # Sanity stop statement at end.
-    raise StopIteration
 
 
+def read_stripes_parallel(ioctx, reads, max_inflight=4):
+    """Yield (position, buffer) for each of the StripeRead in reads, in order of completion.
+
+    At most max_inflight asynchronous reads are outstanding at any time, 
+    so at most max_inflight*readsize bytes are held in memory.
+    A missing stripe object yields an empty buffer; the caller is expected to check the total bytes read.
+    If a read fails, or the caller stops early, the reads still in flight are waited for before returning,
+    so no read completes into a buffer after the caller has released it.
+    """
+    completed = queue.Queue()
+
+    def issue(position):
+        read = reads[position]
+        def oncomplete(completion, data_read):
+            completed.put( (position, completion.get_return_value(), data_read) )
+        ioctx.aio_read(read.oid, read.length, read.offset, oncomplete)
+
+    next_position = 0
+    inflight = 0
+    try:
+        while next_position < len(reads) or inflight > 0:
+            while inflight < max_inflight and next_position < len(reads):
+                issue(next_position)
+                next_position += 1
+                inflight += 1
+
+            position, retval, buf = completed.get()
+            inflight -= 1
+            if retval == -errno.ENOENT:
+                logging.debug(f"Stripe {reads[position].oid} not found")
+                buf = b''
+            elif retval < 0:
+                raise IOError(f"Error {retval} reading {reads[position].oid}")
+            yield position, buf
+    finally:
+        # let any outstanding reads complete, and discard their data
+        while inflight > 0:
+            completed.get()
+            inflight -= 1
+
+
+def checksum_stripes_parallel(ioctx, reads, max_inflight=4):
+    """Compute the adler32 of each StripeRead, reading up to max_inflight of them concurrently.
+
+    Returns a list, in the order of reads, of (adler32 int value, bytes read) tuples,
+    to be merged with adler32.combine_checksums.
+    """
+    parts = [None] * len(reads)
+    for position, buf in trace.timed(read_stripes_parallel(ioctx, reads, max_inflight), 'read'):
+        parts[position] = (zlib.adler32(buf), len(buf))
+    return parts
+
+
+def checksum_stripes_sequential(ioctx, reads, readahead=0):
+    """Compute the adler32 of each StripeRead, reading them in order.
+
+    Returns a list of (adler32 int value, bytes read) tuples, as per checksum_stripes_parallel.
+    If a stripe is missing or short, the list ends at that read.
+    """
+    return [(zlib.adler32(buf), len(buf)) for buf in trace.timed(read_planned_bytes(ioctx, reads, readahead), 'read')]
+
+
+def combine_stripe_checksums(reads, parts):
+    """Combine the per-read checksum parts into a checksum for each stripe.
+
+    Returns dict of stripe index to (adler32 int value, bytes read); reads without a part are skipped.
+    """
+    stripes = {}
+    for read, part in zip(reads, parts):
+        if part is None:
+            continue
+        value, length = stripes.get(read.index, (1, 0))
+        stripes[read.index] = (adler32.adler32.adler32_combine(value, part[0], part[1]), length + part[1])
+    return stripes
 
 
 def stat(ioctx, path):
@@ -101,7 +342,8 @@ def stat(ioctx, path):
 
     global chunk0
     oid = path + chunk0
-    size, timestamp = ioctx.stat(oid)
+    with trace.phase('stat'):
+        size, timestamp = ioctx.stat(oid)
     logging.debug(f"Stat {oid}: {size}, {timestamp}")
     return size, timestamp
 
@@ -113,7 +355,8 @@ def retrieve_xattr(ioctx,path,xattr_name='XrdCks.adler32'):
     global chunk0
     oid = path + chunk0
     try:
-        cks = ioctx.get_xattr(oid,xattr_name)
+        with trace.phase('xattrs'):
+            cks = ioctx.get_xattr(oid,xattr_name)
         #decoded_checksum = decode_binary_to_hex(cks[32:36])
         #logging.debug("Retrieved metadata oid/checksum %s %s %s", xattr_name, oid, decoded_checksum)
         #return decoded_checksum
@@ -156,43 +399,101 @@ def write_xattr(ioctx,path,xattr_name, xattr_value, force=False):
     return True
 
 
-def get_striper_xattrs(ioctx,path):
+class PathMetadata(FileMetadata):
+    """Metadata of a striped file, as held on its first chunk.
+
+    Holds all xattrs of chunk0 and, if requested, its stat (size and mtime of chunk0).
     """
-        Returns tuple of striper based metadata.
-        If not existing, None values are used for each element.
 
-        Note, total size can be smaller than the object size, if only one (partly filled) stripe.
+    def total_size(self):
+        """Return the size of the file, from the striper metadata, or None if not set"""
+        return self.striper()[1]
+
+    def striper(self):
+        """Return tuple of striper based metadata, as per get_striper_xattrs."""
+        rados_object_size = self.xattr("striper.layout.object_size")
+        total_size        = self.xattr("striper.size")
+        rados_object_size = int(rados_object_size) if rados_object_size is not None else None
+        total_size        = int(total_size) if total_size is not None else None
+
+        if rados_object_size is None or total_size is None:
+            num_stripes = None
+            last_stripe_size = None
+        else:
+            num_stripes=math.ceil(total_size/rados_object_size) 
+            last_stripe_size=total_size % rados_object_size
+
+        return rados_object_size, total_size, num_stripes, last_stripe_size
+
+    def __str__(self):
+        return f'PathMetadata: {self.path}; size chunk0: {self.size}; xattrs: {list(self.xattrs.keys())}'
+
+
+def resolve_metadata(ioctx, path, with_stat=False):
+    """Fetch all metadata needed for a path in one round trip.
+
+    All xattrs of chunk0 are retrieved in a single get_xattrs listing.
+    If with_stat, an asynchronous stat of chunk0 is issued alongside it.
+    Raises rados.ObjectNotFound if the file does not exist.
     """
-    rados_object_size=int(retrieve_xattr(ioctx, path, "striper.layout.object_size"))
-    total_size       =int(retrieve_xattr(ioctx, path, "striper.size"))
-    
-    if rados_object_size is None or total_size is None:
-        num_stripes = None
-        last_stripe_size = None
-    else:
-        num_stripes=math.ceil(total_size/rados_object_size) 
-        last_stripe_size=total_size % rados_object_size
+    global chunk0
+    oid = path + chunk0
 
-    return rados_object_size, total_size, num_stripes, last_stripe_size
+    stat_completion = None
+    stat_result = {}
+    if with_stat:
+        def oncomplete(completion, size, mtime):
+            stat_result['size'] = size
+            stat_result['mtime'] = mtime
+        stat_completion = ioctx.aio_stat(oid, oncomplete)
 
+    try:
+        with trace.phase('xattrs'):
+            xattrs = dict(ioctx.get_xattrs(oid))
+    finally:
+        if stat_completion is not None:
+            with trace.phase('stat'):
+                stat_completion.wait_for_complete_and_cb()
 
+    if stat_completion is not None and stat_completion.get_return_value() < 0:
+        raise rados.ObjectNotFound(f"Stat failed for {oid}")
 
+    metadata = PathMetadata(path, xattrs, stat_result.get('size'), stat_result.get('mtime'))
+    logging.debug(metadata)
+    return metadata
 
 
-def cks_from_metadata(ioctx, path, xattr_name):
+def get_striper_xattrs(ioctx,path):
+    """
+        Returns tuple of striper based metadata.
+        If not existing, None values are used for each element.
+
+        Note, total size can be smaller than the object size, if only one (partly filled) stripe.
+    """
+    return resolve_metadata(ioctx, path).striper()
+
+
+def cks_from_metadata(ioctx, path, xattr_name, metadata=None):
     """Get checksum from metadata only. Returns None or checksum object
-    Raise error if not existing"""
+    Raise error if not existing
 
-    try:
-        val = retrieve_xattr(ioctx, path, xattr_name)
-    except rados.NoData:
-        # file exists, but no metadata
-        return None 
+    metadata, if given, is a PathMetadata already resolved for the path; 
+    otherwise it is fetched in a single operation.
+    """
+
+    if metadata is None:
+        try:
+            metadata = resolve_metadata(ioctx, path)
+        except rados.ObjectNotFound:
+            logging.debug("No chunk found: %s", path + chunk0)
+            return None
+    val = metadata.xattr(xattr_name)
     if val is None: # no metadata
+        logging.debug("No metadata stored for %s %s",xattr_name, path)
         return None
 
     # obtain the striper info, if existing:
-    rados_object_size, total_size, num_stripes, last_stripe_size = get_striper_xattrs(ioctx,path)
+    rados_object_size, total_size, num_stripes, last_stripe_size = metadata.striper()
     logging.debug(f'Striper: Object size:{rados_object_size}, Total size:{total_size}, Num Stripes:{num_stripes}, Last Stripe size:{last_stripe_size}') 
 
     cks = XrdCks.XrdCks.from_binary(val)
@@ -206,23 +507,34 @@ def cks_write_metadata(ioctx, path, xattr_name, xattr_value, force_overwrite=Fal
     """
 
     try:
-        write_xattr(ioctx,path,xattr_name, xattr_value, force_overwrite)
+        with trace.phase('writeback'):
+            write_xattr(ioctx,path,xattr_name, xattr_value, force_overwrite)
     except Exception as e:
         raise e
     return True
 
 
 
-def cks_from_file(ioctx, path, readsize):
+def cks_from_file(ioctx, path, readsize, max_inflight=1, readahead=0, metadata=None):
     """Calculate checksum from path. Returns None or checksum object
-    Raise error if not existing"""
+    Raise error if not existing
 
-    # stat the file for timestamp
+    If max_inflight > 1, and the striper layout is known, the stripes are read with up to 
+    max_inflight asynchronous reads in parallel and the per-read checksums combined.
+    Otherwise the stripes are read in sequence, with readahead buffers (if 2 or more) for read-ahead.
+    metadata, if given, is a PathMetadata already resolved for the path.
+    """
+
+    # stat the file for timestamp, together with the xattrs
     try:
-        size, mtime = stat(ioctx,path)
+        if metadata is None:
+            metadata = resolve_metadata(ioctx, path, with_stat=True)
+        elif metadata.mtime is None:
+            metadata.size, metadata.mtime = stat(ioctx,path)
     except rados.ObjectNotFound:
         logging.warning(f"File {path} not found")
         return None
+    size, mtime = metadata.size, metadata.mtime
     fmtime = datetime(mtime.tm_year, mtime.tm_mon, mtime.tm_mday ,mtime.tm_hour ,mtime.tm_min ,mtime.tm_sec ) 
     if mtime.tm_isdst:
         fmtime = fmtime - timedelta(hours=1)
@@ -230,34 +542,100 @@ def cks_from_file(ioctx, path, readsize):
     logging.debug(f'Size chunk0: {size}, fmtime: {fmtime}') 
 
     # obtain the striper info, if existing; otherwise values will be None
-    rados_object_size, total_size, num_stripes, last_stripe_size = get_striper_xattrs(ioctx,path)
+    rados_object_size, total_size, num_stripes, last_stripe_size = metadata.striper()
     logging.debug(f'Striper: Object size:{rados_object_size}, Total size:{total_size}, Num Stripes:{num_stripes}, Last Stripe size:{last_stripe_size}') 
 
 
+    stripe_checksums = None
+    # the number of read buffers held at once, to reserve from the memory budget
+    depth = max_inflight if (num_stripes is not None and max_inflight > 1) else max(1, readahead)
+    started = time.monotonic()
+    current_trace = trace.current()
+    read_before = current_trace.duration('read') if current_trace is not None else 0.
+    stripes_read = 0
     try:
         cks_alg = adler32.adler32('adler32')
-        cks_hex = cks_alg.calc_checksum( read_file_btyes(ioctx, path, rados_object_size, num_stripes,readsize) )
+        with read_buffers(readsize, depth) as readsize:
+            # waiting for the memory budget
+            waited = time.monotonic() - started
+            if num_stripes is not None:
+                # layout known; checksum each planned read, and combine per stripe and for the whole file
+                reads = plan_stripe_reads(path, total_size, rados_object_size, readsize)
+                if max_inflight > 1:
+                    parts = checksum_stripes_parallel(ioctx, reads, max_inflight)
+                else:
+                    parts = checksum_stripes_sequential(ioctx, reads, readahead)
+                cks_hex = cks_alg.combine_checksums( parts )
+                stripes = combine_stripe_checksums(reads, parts)
+                # the stripes any bytes were read from; fewer than num_stripes if the read stopped short
+                stripes_read = sum(1 for value, length in stripes.values() if length > 0)
+                stripe_checksums = [stripes[index][0] for index in sorted(stripes)]
+            else:
+                cks_hex = cks_alg.calc_checksum( trace.timed(read_file_btyes(ioctx, path, rados_object_size, num_stripes,readsize,readahead,total_size), 'read') )
+                stripes_read = math.ceil(cks_alg.bytes_read / rados_object_size) if rados_object_size else cks_alg.number_buffers
         bytes_read = cks_alg.bytes_read
     except Exception as e:
         raise e
-
+    elapsed = time.monotonic() - started
+    metrics.checksum_done(bytes_read, elapsed - waited)
+    if current_trace is not None:
+        # the time not spent waiting for the budget or reads was spent computing the checksum
+        current_trace.add('budget', waited)
+        current_trace.add('adler32', elapsed - waited - (current_trace.duration('read') - read_before))
+        current_trace.record_read(bytes_read, stripes_read)
+
+    if total_size is None:
+        # no striper metadata; the chunks were probed until the first missing one, so may be incomplete
+        logging.error(f"No striper size metadata for {path}; unable to verify {bytes_read} bytes read")
+        raise IOError(f"Mismatch in bytes read: {path}, {bytes_read}, {total_size}")
     if bytes_read != total_size:
         logging.error(f"Mismatch in bytes read {bytes_read} and striped total size metadata {total_size}")
         raise IOError(f"Mismatch in bytes read: {path}, {bytes_read}, {total_size}")
     
-    # get current time 
-    #now   = datetime.now()
-    mnow  = time.localtime()
-    now = datetime(mnow.tm_year, mnow.tm_mon, mnow.tm_mday ,mnow.tm_hour ,mnow.tm_min ,mnow.tm_sec ) 
-    if mtime.tm_isdst:
-        now = now - timedelta(hours=1)
+    cks = new_file_checksum(cks_hex, mtime, total_size)
+    if stripe_checksums is not None:
+        cks.stripe_manifest = StripeManifest(rados_object_size, total_size, stripe_checksums)
+    return cks
 
-    delta = now - fmtime
 
-    fmtime_asint = int(fmtime.timestamp())
-    cstime_asint = int(delta.total_seconds())
+def manifest_from_metadata(ioctx, path, metadata=None):
+    """Get the per-stripe checksum manifest, if stored. Returns None or StripeManifest"""
+    if metadata is None:
+        try:
+            metadata = resolve_metadata(ioctx, path)
+        except rados.ObjectNotFound:
+            return None
+    val = metadata.xattr(MANIFEST_XATTR)
+    if val is None:
+        return None
+    try:
+        return StripeManifest.from_binary(val)
+    except (ValueError, struct.error):
+        logging.warning(f"Invalid stripe manifest stored for {path}", exc_info=True)
+        return None
 
-    cks = XrdCks.XrdCks('adler32', fmtime_asint, cstime_asint, cks_hex)
-    cks.source_type = 'file'
-    cks.total_size_bytes = total_size
-    return cks
+
+def verify_stripes(ioctx, path, manifest, stripes, readsize, max_inflight=1):
+    """Check the given stripe indices of a file against the manifest.
+
+    Stripes are read with up to max_inflight reads in parallel; a missing or short stripe fails.
+    Returns the sorted list of stripe indices that do not match.
+    """
+    wanted = set(stripes)
+    max_inflight = max(1, max_inflight)
+    with read_buffers(readsize, max_inflight) as readsize:
+        reads = [read for read in plan_stripe_reads(path, manifest.total_size, manifest.object_size, readsize) 
+                 if read.index in wanted]
+        parts = checksum_stripes_parallel(ioctx, reads, max_inflight)
+    nbytes = sum(length for value, length in parts)
+    computed = combine_stripe_checksums(reads, parts)
+    metrics.RADOS_READ_BYTES.inc(nbytes)
+    trace.record_read(nbytes, sum(1 for value, length in computed.values() if length > 0))
+
+    bad = set(index for index in wanted if index not in computed)
+    for index, (value, length) in computed.items():
+        expected_length = min(manifest.object_size, manifest.total_size - index*manifest.object_size)
+        if length != expected_length:
+            bad.add(index)
+    bad.update(manifest.mismatched_stripes({index:value for index, (value, length) in computed.items()}))
+    return sorted(bad)
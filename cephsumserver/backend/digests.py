@@ -0,0 +1,124 @@
+"""Single pass computation of several checksum algorithms over the same data.
+
+MultiDigest feeds each buffer read from a file to every requested algorithm, so a file is read
+once however many checksums are wanted. With more than one algorithm, each buffer is hashed by the
+algorithms in parallel threads, as zlib, hashlib and crc32c release the GIL on large buffers.
+
+crc32c needs the optional crc32c module (pip install crc32c); without it, it is not available.
+"""
+import hashlib
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+try:
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+# the algorithms known, in the order their checksums are reported
+ALGORITHMS = ('adler32', 'crc32c', 'md5', 'sha256')
+# buffers smaller than this are hashed in the calling thread
+PARALLEL_MIN_BYTES = 1024**2
+
+_executor = None
+_executor_lock = Lock()
+
+
+class _Adler32:
+    def __init__(self):
+        self.value = 1
+
+    def update(self, buf):
+        self.value = zlib.adler32(buf, self.value)
+
+    def hexdigest(self):
+        return f'{self.value:08x}'
+
+
+class _Crc32c:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, buf):
+        self.value = _crc32c.crc32c(buf, self.value)
+
+    def hexdigest(self):
+        return f'{self.value:08x}'
+
+
+def available():
+    """Return the tuple of algorithms that can be computed"""
+    return tuple(alg for alg in ALGORITHMS if alg != 'crc32c' or _crc32c is not None)
+
+def parse_algorithms(algtype):
+    """Convert a comma separated string, or list, of algorithm names into a list without duplicates.
+
+    Raises ValueError for an algorithm that is not available.
+    """
+    names = algtype.split(',') if isinstance(algtype, str) else list(algtype)
+    algs = []
+    for name in names:
+        name = str(name).strip().lower()
+        if not name or name in algs:
+            continue
+        if name not in available():
+            raise ValueError(f"Checksum algorithm {name} not supported" +
+                             (" (needs the crc32c module)" if name == 'crc32c' else ''))
+        algs.append(name)
+    if not algs:
+        raise ValueError("No checksum algorithm given")
+    return algs
+
+def new(alg: str):
+    """Return a new hash object for alg, with update(buf) and hexdigest()"""
+    if alg == 'adler32':
+        return _Adler32()
+    if alg == 'crc32c':
+        if _crc32c is None:
+            raise ValueError("crc32c needs the crc32c module")
+        return _Crc32c()
+    if alg in ('md5', 'sha256'):
+        return hashlib.new(alg)
+    raise ValueError(f"Checksum algorithm {alg} not supported")
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=len(ALGORITHMS), thread_name_prefix='digest')
+        return _executor
+
+
+class MultiDigest:
+    """Several checksums of the same data, computed in one pass"""
+
+    def __init__(self, algs, parallel: bool = True):
+        self.algs = list(algs)
+        self._hashes = [new(alg) for alg in self.algs]
+        self._parallel = parallel and len(self._hashes) > 1
+        self.bytes_read = 0
+        self.number_buffers = 0
+
+    def update(self, buf):
+        """Feed the buffer to each algorithm; returns once all have consumed it, so it may then be reused"""
+        if self._parallel and len(buf) >= PARALLEL_MIN_BYTES:
+            futures = [_pool().submit(h.update, buf) for h in self._hashes[1:]]
+            self._hashes[0].update(buf)
+            for future in futures:
+                future.result()
+        else:
+            for h in self._hashes:
+                h.update(buf)
+        self.bytes_read += len(buf)
+        self.number_buffers += 1
+
+    def calc_checksums(self, buffers):
+        """Feed each buffer of the iterable in turn; returns the dict of hex digests, by algorithm"""
+        for buf in buffers:
+            self.update(buf)
+        return self.hexdigests()
+
+    def hexdigests(self):
+        return {alg:h.hexdigest() for alg, h in zip(self.algs, self._hashes)}
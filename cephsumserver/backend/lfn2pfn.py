@@ -3,6 +3,14 @@ import xml.dom.minidom
 
 import os,logging,re
 
+from collections import OrderedDict
+from threading import Lock
+
+_NOMINAL = re.compile("^/*([a-zA-Z0-9_-]+):(.*)")
+_CMS     = re.compile("^/*(store.*)")
+# characters with a special meaning in a regex, ending its literal prefix
+_SPECIAL = set('.^$*+?{}[]\\|()')
+
 def convert_path(path, xmlfile=None):
     """
     Convert  provided path (LFN) to pool and oid (PFN), using xmlfile for mapping if provided
@@ -24,13 +32,11 @@ def naive_ral_split_path(input_path):
 
     Check for a CMS style path, else assume follows pool:oid logic
     """
-    nominal = re.compile("^/*([a-zA-Z0-9_-]+):(.*)")
-    cms     = re.compile("^/*(store.*)")
-    m = cms.match(input_path)
+    m = _CMS.match(input_path)
     if m is not None:
         return 'cms', m.group(1)
 
-    m = nominal.match(input_path)
+    m = _NOMINAL.match(input_path)
     if m is not None:
         return m.group(1), m.group(2)
     
@@ -38,6 +44,114 @@ def naive_ral_split_path(input_path):
     raise ValueError("Path not valid / or Not Implemented %s", input_path)
 
 
+def literal_prefix(pattern: str) -> str:
+    """Return literal text that, after its leading slashes, any path matched by the regex pattern must start with.
+
+    Conservative; returns '' for anything not trivially understood (e.g. alternation or inline flags).
+    """
+    if '|' in pattern or pattern.startswith('(?'):
+        return ''
+    i = 1 if pattern.startswith('^') else 0
+    # the leading slashes, escaped or not, however many are allowed
+    while pattern.startswith(('/', '\\/'), i):
+        i += 1 if pattern[i] == '/' else 2
+        if pattern.startswith(('+', '*', '?'), i):
+            i += 1
+    prefix = []
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= len(pattern) or pattern[i+1].isalnum():
+                # a character class, anchor or back reference
+                break
+            c = pattern[i+1]
+            i += 2
+        elif c in _SPECIAL:
+            break
+        else:
+            i += 1
+        if i < len(pattern) and pattern[i] in '*?{':
+            # the last character is optional, or repeated an unknown number of times
+            break
+        prefix.append(c)
+        if i < len(pattern) and pattern[i] == '+':
+            break
+    return ''.join(prefix)
+
+
+class _Rule:
+    """A compiled lfn-to-pfn mapping; its regex, and the result template split into text and group numbers"""
+
+    def __init__(self, pattern, result: str):
+        self.pattern = pattern
+        # the placeholders are $1, $2, ... up to the first number missing from the result;
+        # trying the lowest number first, as replacing them in turn would, e.g. $12 is $1 followed by 2
+        n_placeholders = 0
+        while "${}".format(n_placeholders + 1) in result:
+            n_placeholders += 1
+        self.missing_group = pattern.groups + 1 if n_placeholders > pattern.groups else None
+        self.parts = []
+        if n_placeholders == 0:
+            self.parts.append(result)
+            return
+        placeholders = re.compile(r'\$({})'.format('|'.join(str(i) for i in range(1, n_placeholders + 1))))
+        for i, part in enumerate(placeholders.split(result)):
+            if i % 2 == 0:
+                if part:
+                    self.parts.append(part)
+            else:
+                self.parts.append(int(part))
+
+    def substitute(self, match) -> str:
+        """Return the result for the match of the pattern"""
+        if self.missing_group is not None:
+            raise RuntimeError(f"Only {self.pattern.groups} available, but trying to replace ${self.missing_group}")
+        return ''.join(part if isinstance(part, str) else match.group(part) for part in self.parts)
+
+
+class _Matcher:
+    """Finds the first matching rule for a path, only trying the rules whose literal prefix the path starts with.
+
+    The rules are indexed by the length, then text, of their literal prefix; rules without one are always tried.
+    """
+
+    def __init__(self, mappings):
+        self.rules = [_Rule(pattern, result) for pattern, result in mappings]
+        self.unprefixed = []
+        self.index = {}
+        for i, rule in enumerate(self.rules):
+            # the prefix is only known for the text of the pattern, as is, e.g. not if matching ignores case
+            prefix = literal_prefix(rule.pattern.pattern) if not rule.pattern.flags & (re.I | re.X) else ''
+            if prefix:
+                self.index.setdefault(len(prefix), {}).setdefault(prefix, []).append(i)
+            else:
+                self.unprefixed.append(i)
+        self.lengths = sorted(self.index)
+
+    def candidates(self, pathname):
+        """Return the indices of the rules that might match pathname, in order"""
+        stripped = pathname.lstrip('/')
+        found = None
+        for length in self.lengths:
+            if length > len(stripped):
+                break
+            matching = self.index[length].get(stripped[:length])
+            if matching is not None:
+                found = matching if found is None else found + matching
+        if found is None:
+            return self.unprefixed
+        return sorted(found + self.unprefixed)
+
+    def map(self, pathname):
+        """Return the path converted by the first matching rule, or None if no rule matches"""
+        rules = self.rules
+        for i in self.candidates(pathname):
+            rule = rules[i]
+            match = rule.pattern.match(pathname)
+            if match is not None:
+                return rule.substitute(match)
+        return None
+
 
 class Lfn2PfnMapper:
     """
@@ -56,17 +170,44 @@ class Lfn2PfnMapper:
     This splits the (converted) path into pool name, oid name
     
     Parse method returns a tuple of pool and path
+
+    Pools are rados pools, unless another backend is set for them with a pool-backend element, e.g.
+    <pool-backend pool="cephfs" backend="posix" root="/mnt/cephfs"/>
+    where the other attributes are the settings of the backend; see backend(pool).
+
+    The mappings are compiled on first use, or assignment; call compile() if the list is modified in place.
+    The results for the most recent memo_size paths are kept, and returned without parsing again.
     """
-    def __init__(self):
+    def __init__(self, memo_size: int = 10000):
         """
         Trivial init script. Use the classmethods to init from some xml source
         """
-        self.mappings = []
+        self._mappings = []
+        self._matcher = None
         self.source = None
+        # backend settings, by pool name, of the pools that are not rados pools
+        self.backends = {}
         
-        self.nominal = re.compile("^/*([a-zA-Z0-9_-]+):(.*)")
-        
-        pass
+        self.nominal = _NOMINAL
+
+        self._memo_size = memo_size
+        self._memo = OrderedDict()
+        self._memo_lock = Lock()
+
+    @property
+    def mappings(self):
+        return self._mappings
+
+    @mappings.setter
+    def mappings(self, mappings):
+        self._mappings = mappings
+        self.compile()
+
+    def compile(self):
+        """Build the matcher for the current mappings, and forget any memoized results"""
+        self._matcher = _Matcher(self._mappings)
+        with self._memo_lock:
+            self._memo.clear()
 
     @staticmethod
     def _build_mappers(dom_collection):
@@ -86,10 +227,27 @@ class Lfn2PfnMapper:
             mappers.append((pattern,result))
         return mappers
 
+    @staticmethod
+    def _build_backends(dom_collection):
+        """
+        Converts the pool-backend rows in the xml to a dict of the settings of each pool, by pool name.
+        """
+        backends = {}
+        for col in dom_collection.getElementsByTagName('pool-backend'):
+            settings = {name:value for name, value in col.attributes.items() if name != 'pool'}
+            if not col.getAttribute('pool') or not settings.get('backend'):
+                raise ValueError(f"pool-backend needs pool and backend attributes: {col.toxml()}")
+            if settings['backend'] == 'posix' and not settings.get('root'):
+                raise ValueError(f"posix backend of pool {col.getAttribute('pool')} needs a root")
+            backends[col.getAttribute('pool')] = settings
+        return backends
 
+    def backend(self, pool):
+        """Return the dict of the backend settings of the pool, with at least its 'backend' name"""
+        return self.backends.get(pool, {'backend':'rados'})
     
     @classmethod
-    def from_file(cls,xmlfile):
+    def from_file(cls,xmlfile, memo_size: int = 10000):
         """
         Instantiate an object based on an xml file
         """
@@ -100,13 +258,14 @@ class Lfn2PfnMapper:
         collection = DOMTree.documentElement
         mappers = Lfn2PfnMapper._build_mappers(collection)
         
-        converter = cls()
+        converter = cls(memo_size)
         converter.mappings = mappers
+        converter.backends = Lfn2PfnMapper._build_backends(collection)
         converter.source = xmlfile
         return converter
     
     @classmethod
-    def from_string(cls,xmlstring):
+    def from_string(cls,xmlstring, memo_size: int = 10000):
         """
         Instantiate an object based on an xml string
         """
@@ -115,8 +274,9 @@ class Lfn2PfnMapper:
         collection = DOMTree.documentElement
         mappers = Lfn2PfnMapper._build_mappers(collection)
         
-        converter = cls()
+        converter = cls(memo_size)
         converter.mappings = mappers
+        converter.backends = Lfn2PfnMapper._build_backends(collection)
         converter.source = 'string'
         return converter
 
@@ -138,28 +298,17 @@ class Lfn2PfnMapper:
         ---------
         ValueError: pathname is not convertable
         """
-        for mapper in self.mappings:
-            match = mapper[0].match(pathname)
-            #logging.debug(f'{mapper[0]}, {match}, {pathname}')
-            if match is None:
-                continue
-            # replace occurences of $1, $2, etc. with their matching regex group
-            # e.g.: newpath = mapper[1].replace('$1',match.group(1))
-            # First extract the whole path
-            newpath = mapper[1]
-            placeholder_group = 1
-            n_groups = len(match.groups())
-            # Now loop over each $x and replace
-            while True:
-                placeholder = "${}".format(placeholder_group)
-                if not placeholder in newpath:
-                    break
-                if placeholder_group > n_groups:
-                    raise RuntimeError(f"Only {n_groups} available, but trying to replace {placeholder}")
-                newpath = newpath.replace(placeholder, match.group(placeholder_group))
-                placeholder_group += 1
-            break
-        else:
+        if self._memo_size > 0:
+            with self._memo_lock:
+                result = self._memo.get(pathname)
+                if result is not None:
+                    self._memo.move_to_end(pathname)
+                    return result
+
+        if self._matcher is None:
+            self.compile()
+        newpath = self._matcher.map(pathname)
+        if newpath is None:
             # no match found in mappings, so just try with pathname
             logging.debug('No mapping matched; trying nominal')
             newpath = pathname
@@ -168,10 +317,17 @@ class Lfn2PfnMapper:
         if fmatch is None:
             raise ValueError(f'Could not convert lfn-2-pfn for {pathname}')
         pool, oid = fmatch.group(1), fmatch.group(2)
+
+        if self._memo_size > 0:
+            with self._memo_lock:
+                self._memo[pathname] = (pool, oid)
+                if len(self._memo) > self._memo_size:
+                    self._memo.popitem(last=False)
         return pool,oid
 
 
     def __str__(self):
-        return f'Lfn2PfnMapper: from {self.source},  mappings: {[x[0].pattern for x in self.mappings]}' 
+        backends = ''.join(f', {pool}: {settings}' for pool, settings in self.backends.items())
+        return f'Lfn2PfnMapper: from {self.source},  mappings: {[x[0].pattern for x in self.mappings]}{backends}' 
             
        
\ No newline at end of file
@@ -0,0 +1,63 @@
+import struct, logging
+
+# Per-stripe checksum manifest, stored as an xattr on chunk0 next to the XrdCks.adler32 value.
+# Binary layout (little endian):
+#   char[4]  magic        b'CSMF'
+#   uchar    version
+#   char[3]  padding
+#   uint64   object_size  striper.layout.object_size used when computed
+#   uint64   total_size   striper.size used when computed
+#   uint32   num_stripes
+#   uint32   adler32 value of each stripe, num_stripes times
+
+MANIFEST_XATTR = 'cephsum.adler32.stripes'
+
+
+class StripeManifest:
+
+    _MAGIC = b'CSMF'
+    _VERSION = 1
+    _header = struct.Struct('<4sB3xQQI')
+
+    def __init__(self, object_size: int, total_size: int, stripe_checksums: list):
+        self.object_size = object_size
+        self.total_size = total_size
+        self.stripe_checksums = list(stripe_checksums)
+
+    @property
+    def num_stripes(self):
+        return len(self.stripe_checksums)
+
+    @classmethod
+    def from_binary(cls, input_bytes: bytes) -> object:
+        """Create the manifest from the binary xattr value. Raise ValueError if not a valid manifest."""
+        if len(input_bytes) < cls._header.size:
+            raise ValueError("Stripe manifest too short")
+        magic, version, object_size, total_size, num_stripes = cls._header.unpack_from(input_bytes)
+        if magic != cls._MAGIC or version != cls._VERSION:
+            raise ValueError(f"Not a supported stripe manifest: {magic}, {version}")
+        values = struct.unpack_from(f'<{num_stripes}I', input_bytes, cls._header.size)
+        return cls(object_size, total_size, values)
+
+    def to_binary(self):
+        return self._header.pack(self._MAGIC, self._VERSION, self.object_size, 
+                                 self.total_size, self.num_stripes) + \
+               struct.pack(f'<{self.num_stripes}I', *self.stripe_checksums)
+
+    def matches_layout(self, object_size, total_size):
+        """True if the manifest was computed for the given striper layout"""
+        return self.object_size == object_size and self.total_size == total_size
+
+    def mismatched_stripes(self, stripe_checksums: dict):
+        """Return the sorted stripe indices whose checksum differs from the manifest.
+
+        stripe_checksums maps stripe index to the adler32 int value computed from the file.
+        """
+        bad = [index for index, value in stripe_checksums.items() 
+               if index >= self.num_stripes or self.stripe_checksums[index] != value]
+        if len(bad) > 0:
+            logging.debug(f"Stripe checksum mismatch for stripes {bad}")
+        return sorted(bad)
+
+    def __str__(self):
+        return f'StripeManifest: {self.num_stripes} stripes; object size {self.object_size}; total size {self.total_size}'
@@ -0,0 +1,322 @@
+"""In-memory stand-in for the rados module, for benchmarks and running without a Ceph cluster.
+
+Implements the parts of the python-rados API used by the server: Rados (connect, open_ioctx,
+get_cluster_stats, shutdown) and Ioctx (stat, read, aio_read, aio_stat, get_xattr, get_xattrs,
+set_xattr, rm_xattr), with the same exception types and asynchronous completion callbacks.
+
+Objects are kept in a process wide Store, STORE, shared by all clients. An object holds either real bytes,
+or only a size: the content of such synthetic objects is a repeating pattern generated as it is read,
+so striped files of tens of GB need no memory. write_striped creates a file as the rados striper
+would lay it out, with the striper xattrs on its first object.
+
+install() registers this module as rados; it must be called before the cephsumserver modules using
+rados are imported.
+"""
+import errno
+import sys
+import threading
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .adler32 import adler32
+
+
+class Error(Exception):
+    pass
+
+class ObjectNotFound(Error):
+    pass
+
+class NoData(Error):
+    pass
+
+class TimedOut(Error):
+    pass
+
+class ConnectionShutdown(Error):
+    pass
+
+class RadosStateError(Error):
+    pass
+
+
+# period of the content of synthetic objects
+PATTERN_SIZE = 1024**2
+_PATTERN = (bytes(range(251)) * (PATTERN_SIZE // 251 + 1))[:PATTERN_SIZE]
+_DOUBLE_PATTERN = memoryview(_PATTERN * 2)
+
+
+def pattern_bytes(offset: int, length: int) -> bytes:
+    """Return length bytes of the synthetic content, from offset"""
+    start = offset % PATTERN_SIZE
+    if length <= PATTERN_SIZE:
+        return bytes(_DOUBLE_PATTERN[start:start+length])
+    periods, remainder = divmod(length, PATTERN_SIZE)
+    period = _DOUBLE_PATTERN[start:start+PATTERN_SIZE]
+    return b''.join([period] * periods + [_DOUBLE_PATTERN[start:start+remainder]])
+
+
+def pattern_adler32(length: int) -> int:
+    """Return the adler32 int value of the first length bytes of the synthetic content"""
+    periods, remainder = divmod(length, PATTERN_SIZE)
+    period_value = zlib.adler32(_PATTERN)
+    value = 1
+    # combine by doubling, as the number of periods may be large
+    block_value, block_length = period_value, PATTERN_SIZE
+    while periods:
+        if periods & 1:
+            value = adler32.adler32_combine(value, block_value, block_length)
+        block_value = adler32.adler32_combine(block_value, block_value, block_length)
+        block_length *= 2
+        periods >>= 1
+    return adler32.adler32_combine(value, zlib.adler32(_PATTERN[:remainder]), remainder)
+
+
+class _Object:
+    """A rados object: its data, or just its size if synthetic, its xattrs and mtime"""
+
+    def __init__(self, data=None, size=0, xattrs=None, mtime=None):
+        self.data = bytes(data) if data is not None else None
+        self.size = len(self.data) if self.data is not None else size
+        self.xattrs = dict(xattrs) if xattrs else {}
+        self.mtime = mtime if mtime is not None else time.time()
+
+    def read(self, length, offset):
+        length = max(0, min(length, self.size - offset))
+        if self.data is not None:
+            return self.data[offset:offset+length]
+        return pattern_bytes(offset, length)
+
+
+class Store:
+    """The pools, and their objects, of the in-memory cluster"""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def create_pool(self, pool: str):
+        with self._lock:
+            return self._pools.setdefault(pool, {})
+
+    def pool(self, pool: str):
+        """Return the dict of objects of the pool; raises ObjectNotFound if it does not exist"""
+        objects = self._pools.get(pool)
+        if objects is None:
+            raise ObjectNotFound(f"error opening pool '{pool}'")
+        return objects
+
+    def put(self, pool: str, oid: str, data=None, size=0, xattrs=None, mtime=None):
+        """Create, or replace, an object; with data, or synthetic content of size bytes"""
+        self.create_pool(pool)[oid] = _Object(data, size, xattrs, mtime)
+
+    def remove(self, pool: str, oid: str):
+        self.pool(pool).pop(oid, None)
+
+    def write_striped(self, pool: str, path: str, size: int = None, data=None, object_size: int = 64*1024**2,
+                      xattrs: dict = None, mtime=None):
+        """Create a striped file of data, or synthetic content of size bytes, as the rados striper lays it out.
+
+        The file is split into objects path.<16 hex digit index> of object_size bytes; the first holds
+        the striper layout and size xattrs, and any further xattrs given.
+        """
+        if data is not None:
+            size = len(data)
+        chunk0_xattrs = {'striper.layout.object_size':str(object_size).encode(),
+                         'striper.layout.stripe_unit':str(object_size).encode(),
+                         'striper.layout.stripe_count':b'1',
+                         'striper.size':str(size).encode()}
+        chunk0_xattrs.update(xattrs or {})
+        n_objects = max(1, -(-size // object_size))
+        for index in range(n_objects):
+            length = max(0, min(object_size, size - index*object_size))
+            part = data[index*object_size:index*object_size+length] if data is not None else None
+            self.put(pool, f'{path}.{index:016x}', part, length, chunk0_xattrs if index == 0 else None, mtime)
+
+    def striped_adler32(self, size: int, object_size: int = 64*1024**2) -> str:
+        """Return the adler32, as hex, of a synthetic striped file created by write_striped"""
+        value = 1
+        for index in range(max(1, -(-size // object_size))):
+            length = max(0, min(object_size, size - index*object_size))
+            value = adler32.adler32_combine(value, pattern_adler32(length), length)
+        return adler32.adler32_inttohex(value)
+
+    def clear(self):
+        with self._lock:
+            self._pools = {}
+
+
+STORE = Store()
+
+
+class Completion:
+    """Completion of an asynchronous operation"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._retval = None
+
+    def _complete(self, retval):
+        self._retval = retval
+        self._done.set()
+
+    def wait_for_complete_and_cb(self):
+        self._done.wait()
+
+    def wait_for_complete(self):
+        self._done.wait()
+
+    def is_complete(self):
+        return self._done.is_set()
+
+    def get_return_value(self):
+        return self._retval
+
+
+class Ioctx:
+    """An open pool of the in-memory cluster"""
+
+    def __init__(self, cluster, name: str, objects: dict):
+        self._cluster = cluster
+        self.name = name
+        self._objects = objects
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self._closed = True
+
+    def _object(self, oid):
+        if self._closed:
+            raise RadosStateError("ioctx is closed")
+        obj = self._objects.get(oid)
+        if obj is None:
+            raise ObjectNotFound(f"Failed to find object {oid}")
+        return obj
+
+    def stat(self, oid):
+        """Return tuple of (size, mtime as time.struct_time)"""
+        obj = self._object(oid)
+        return obj.size, time.localtime(obj.mtime)
+
+    def read(self, oid, length=8192, offset=0):
+        return self._object(oid).read(length, offset)
+
+    def _aio(self, fn, oncomplete, failed):
+        """Run fn in the threads of the client, then oncomplete(completion, *result) with the tuple it returns;
+        if it raises, with the failed tuple instead, and the return value set to -errno"""
+        completion = Completion()
+        def run():
+            try:
+                result, retval = fn(), 0
+            except ObjectNotFound:
+                result, retval = failed, -errno.ENOENT
+            except TimedOut:
+                result, retval = failed, -errno.ETIMEDOUT
+            except Error:
+                result, retval = failed, -errno.EIO
+            completion._retval = retval
+            try:
+                if oncomplete is not None:
+                    oncomplete(completion, *result)
+            finally:
+                completion._complete(retval)
+        self._cluster._submit(run)
+        return completion
+
+    def aio_read(self, oid, length, offset, oncomplete=None):
+        return self._aio(lambda: (self.read(oid, length, offset),), oncomplete, (b'',))
+
+    def aio_stat(self, oid, oncomplete=None):
+        return self._aio(lambda: self.stat(oid), oncomplete, (None, None))
+
+    def get_xattr(self, oid, xattr_name):
+        value = self._object(oid).xattrs.get(xattr_name)
+        if value is None:
+            raise NoData(f"Failed to get xattr {xattr_name}")
+        return value
+
+    def get_xattrs(self, oid):
+        return iter(list(self._object(oid).xattrs.items()))
+
+    def set_xattr(self, oid, xattr_name, xattr_value):
+        if self._closed:
+            raise RadosStateError("ioctx is closed")
+        obj = self._objects.get(oid)
+        if obj is None:
+            # as a write operation, this creates the object
+            obj = self._objects.setdefault(oid, _Object())
+        obj.xattrs[xattr_name] = bytes(xattr_value)
+        return True
+
+    def rm_xattr(self, oid, xattr_name):
+        if self._object(oid).xattrs.pop(xattr_name, None) is None:
+            raise NoData(f"Failed to delete key {xattr_name}")
+        return True
+
+
+class Rados:
+    """A client of the in-memory cluster, STORE; the arguments are accepted as for rados.Rados, and ignored"""
+
+    # threads running the asynchronous operations of each client
+    AIO_THREADS = 8
+
+    def __init__(self, rados_id=None, name=None, clustername=None, conf_defaults=None, conffile=None,
+                 conf=None, flags=0, context=None, store=None):
+        self.name = name
+        self.state = 'configuring'
+        self._store = store if store is not None else STORE
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def connect(self, timeout=0):
+        self.state = 'connected'
+
+    def shutdown(self):
+        self.state = 'shutdown'
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _require_connected(self):
+        if self.state != 'connected':
+            raise RadosStateError(f"You cannot perform that operation on a Rados object in state {self.state}.")
+
+    def _submit(self, fn):
+        self._require_connected()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.AIO_THREADS)
+            self._executor.submit(fn)
+
+    def get_cluster_stats(self):
+        self._require_connected()
+        return {'kb':0, 'kb_used':0, 'kb_avail':0, 'num_objects':0}
+
+    def open_ioctx(self, ioctx_name):
+        self._require_connected()
+        return Ioctx(self, ioctx_name, self._store.pool(ioctx_name))
+
+
+def install(force=False):
+    """Register this module as the rados module, unless the real one can be imported (or if force).
+
+    Returns the rados module in use.
+    """
+    if not force:
+        try:
+            import rados
+            return rados
+        except ImportError:
+            pass
+    sys.modules['rados'] = sys.modules[__name__]
+    return sys.modules[__name__]
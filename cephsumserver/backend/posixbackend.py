@@ -0,0 +1,138 @@
+"""Backend for files on a POSIX filesystem, e.g. a CephFS mount.
+
+The files of a pool are those under its root directory. Files are checksummed from a memory map,
+each buffer being a view of the mapped pages rather than a copy; files that cannot be mapped are
+read into a single reused buffer. xattrs are kept in the user namespace (user.XrdCks.adler32),
+as the xrootd posix storage does.
+"""
+import errno
+import logging
+import mmap
+import os
+import time
+
+from ..common import trace
+from .storage import Backend, FileMetadata
+
+# prefix of the xattrs in the user namespace
+XATTR_PREFIX = 'user.'
+# errors meaning the filesystem does not support xattrs
+_NO_XATTRS = (errno.ENOTSUP, getattr(errno, 'EOPNOTSUPP', errno.ENOTSUP))
+
+
+class PosixBackend(Backend):
+    kind = 'posix'
+    NotFound = FileNotFoundError
+
+    def __init__(self, name: str, root: str):
+        super().__init__(name)
+        self.root = os.path.abspath(root)
+
+    def _fullpath(self, path: str) -> str:
+        """Return the path of the file under the root; raises ValueError if it would be outside of it"""
+        fullpath = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if os.path.commonpath([self.root, fullpath]) != self.root:
+            raise ValueError(f"Path {path} is outside of the root of pool {self.name}")
+        return fullpath
+
+    def stat(self, path):
+        with trace.phase('stat'):
+            st = os.stat(self._fullpath(path))
+        return st.st_size, time.localtime(st.st_mtime)
+
+    def read_stream(self, path, readsize, readahead=0):
+        with open(self._fullpath(path), 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                logging.debug(f"Cannot mmap {path}; reading into a buffer")
+                mapped = None
+            if mapped is None:
+                yield from self._read_into(f, readsize)
+                return
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(mapped), readsize):
+                    yield view[offset:offset+readsize]
+            finally:
+                view.release()
+                try:
+                    mapped.close()
+                except BufferError:
+                    # the consumer still holds the last buffer; unmapped once it is released
+                    pass
+
+    @staticmethod
+    def _read_into(f, readsize):
+        """Yield views of a single buffer, refilled with readinto"""
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(readsize)
+        view = memoryview(buffer)
+        while True:
+            nbytes = f.readinto(buffer)
+            if not nbytes:
+                return
+            yield view[:nbytes]
+
+    def get_xattr(self, path, xattr_name):
+        try:
+            with trace.phase('xattrs'):
+                return os.getxattr(self._fullpath(path), XATTR_PREFIX + xattr_name)
+        except FileNotFoundError:
+            logging.debug("No file found: %s", path)
+        except OSError as e:
+            if e.errno not in (errno.ENODATA,) + _NO_XATTRS:
+                raise
+            logging.debug("No metadata stored for %s %s",xattr_name, path)
+        return None
+
+    def set_xattr(self, path, xattr_name, xattr_value, force=False):
+        flags = 0 if force else os.XATTR_CREATE
+        try:
+            os.setxattr(self._fullpath(path), XATTR_PREFIX + xattr_name, xattr_value, flags)
+        except FileExistsError:
+            logging.info(f'{path}: Xattr existing {xattr_name} and force not set')
+            raise ValueError(f"Xattr {xattr_name} already existing for {path}")
+        except Exception as e:
+            logging.error(f"Error setting new metadata: {path}", exc_info=True)
+            raise e
+        return True
+
+    def _xattrs(self, fullpath):
+        """Return dict of the xattrs of the user namespace, without the prefix"""
+        try:
+            names = os.listxattr(fullpath)
+        except OSError as e:
+            if e.errno in _NO_XATTRS:
+                return {}
+            raise
+        xattrs = {}
+        for name in names:
+            if name.startswith(XATTR_PREFIX):
+                try:
+                    xattrs[name[len(XATTR_PREFIX):]] = os.getxattr(fullpath, name)
+                except OSError as e:
+                    # removed since listed
+                    if e.errno != errno.ENODATA:
+                        raise
+        return xattrs
+
+    def metadata(self, path, with_stat=False):
+        fullpath = self._fullpath(path)
+        # the stat is needed anyway, to know the file exists
+        with trace.phase('stat'):
+            st = os.stat(fullpath)
+        with trace.phase('xattrs'):
+            xattrs = self._xattrs(fullpath)
+        metadata = FileMetadata(path, xattrs, st.st_size, time.localtime(st.st_mtime))
+        logging.debug(metadata)
+        return metadata
+
+    def __str__(self):
+        return f'PosixBackend: {self.name} at {self.root}'
@@ -0,0 +1,71 @@
+"""Functions run in the child processes of the ProcessEngine.
+
+Each child holds its own rados client, connected by init_worker when the process starts,
+and keeps an IoCtx open for each pool it has served.
+Jobs are small descriptors (pool, path, action name and its arguments, and the backend settings
+of the pool), and the result of the action, e.g. an XrdCks, is returned to the server process.
+"""
+import logging
+import os
+
+import rados
+
+from ..backend import actions, storage
+from ..backend.radosbackend import RadosBackend
+
+_cluster = None
+# open IoCtx handles of this process, by pool name
+_ioctxs = {}
+
+
+class JobError(Exception):
+    """An exception raised by a job, converted to something that can cross the process boundary.
+
+    args are the name of the original exception type, and its message.
+    """
+    @property
+    def kind(self):
+        return self.args[0]
+
+    def __str__(self):
+        return self.args[1]
+
+
+def init_worker(config_pars: dict, loglevel=logging.INFO):
+    """Connect the rados client of this child process"""
+    global _cluster
+    logging.basicConfig(level=loglevel,
+                        format='CEPHSUMSERVE-%(asctime)s-%(process)d-%(levelname)s-%(message)s')
+    _cluster = rados.Rados(conffile = config_pars['conffile'],
+                           conf = dict (keyring = config_pars['keyring']),
+                           name = config_pars['name'])
+    _cluster.connect()
+    logging.debug(f"Worker process {os.getpid()} connected a rados client to cluster")
+
+
+def _ioctx(pool: str):
+    """Return the open IoCtx for pool, opening it on first use"""
+    ioctx = _ioctxs.get(pool)
+    if ioctx is None:
+        ioctx = _ioctxs[pool] = _cluster.open_ioctx(pool)
+    return ioctx
+
+
+def _backend(pool: str, spec: dict = None):
+    """Return the storage backend of pool, from its backend settings; a rados pool if None"""
+    if spec is not None and spec.get('backend', 'rados') != 'rados':
+        return storage.create(pool, spec)
+    return RadosBackend(_ioctx(pool))
+
+
+def run_action(pool: str, path: str, action: str, args: tuple = (), kwargs: dict = None, spec: dict = None):
+    """Run actions.<action>(backend, path, *args, **kwargs) on the given pool, returning its result.
+
+    spec is the dict of the backend settings of the pool, as from RadosPool.backend_spec.
+    """
+    try:
+        return getattr(actions, action)(_backend(pool, spec), path, *args, **(kwargs or {}))
+    except Exception as e:
+        # rados exceptions may not survive pickling; pass on just their type and message
+        logging.debug(f"Job {action} for {pool} {path} failed: {e}")
+        raise JobError(type(e).__name__, str(e)) from None
@@ -0,0 +1,42 @@
+"""Backend for the striped files of a rados pool, as written by the rados striper; see cephtools."""
+import rados
+
+from ..backend import cephtools
+from .storage import Backend
+
+
+class RadosBackend(Backend):
+    kind = 'rados'
+    NotFound = rados.ObjectNotFound
+
+    def __init__(self, ioctx):
+        super().__init__(ioctx.name)
+        self.ioctx = ioctx
+
+    def stat(self, path):
+        """Return tuple of (total size of the stripes, mtime of the first stripe)"""
+        metadata = cephtools.resolve_metadata(self.ioctx, path, with_stat=True)
+        return metadata.total_size(), metadata.mtime
+
+    def read_stream(self, path, readsize, readahead=0):
+        rados_object_size, total_size, num_stripes, last_stripe_size = cephtools.resolve_metadata(self.ioctx, path).striper()
+        yield from cephtools.read_file_btyes(self.ioctx, path, rados_object_size, num_stripes, readsize, readahead, total_size)
+
+    def get_xattr(self, path, xattr_name):
+        return cephtools.retrieve_xattr(self.ioctx, path, xattr_name)
+
+    def set_xattr(self, path, xattr_name, xattr_value, force=False):
+        return cephtools.write_xattr(self.ioctx, path, xattr_name, xattr_value, force)
+
+    def metadata(self, path, with_stat=False):
+        return cephtools.resolve_metadata(self.ioctx, path, with_stat)
+
+    def cks_from_file(self, path, readsize, max_inflight=1, readahead=0, metadata=None):
+        # reads the stripes in parallel, and records the per-stripe checksums for the manifest
+        return cephtools.cks_from_file(self.ioctx, path, readsize, max_inflight, readahead, metadata)
+
+    def manifest_from_metadata(self, path, metadata=None):
+        return cephtools.manifest_from_metadata(self.ioctx, path, metadata)
+
+    def verify_stripes(self, path, manifest, stripes, readsize, max_inflight=1):
+        return cephtools.verify_stripes(self.ioctx, path, manifest, stripes, readsize, max_inflight)
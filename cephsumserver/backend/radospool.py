@@ -1,30 +1,226 @@
 import logging
 import math
+import time
 
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
-from threading import Lock
+from threading import Event, Lock, Thread
 
 import rados
 
+from . import storage
 from .lfn2pfn import Lfn2PfnMapper, naive_ral_split_path
+from .radosbackend import RadosBackend
+from ..common import trace
+
+# errors indicating a problem with the rados client itself, rather than the request
+_CLIENT_ERRORS = tuple(e for e in (getattr(rados, name, None) for name in 
+                        ('TimedOut', 'ConnectionShutdown', 'RadosStateError')) if e is not None)
+
+
+class _CachedIoctx:
+    """An open IoCtx of a rados client, shared by the operations on its pool"""
+
+    def __init__(self, ioctx):
+        self.ioctx = ioctx
+        self.users = 0
+        self.last_used = time.monotonic()
+        # set when its client is retired while in use; closed when the last user releases it
+        self.closing = False
+
+
+class _PooledClient:
+    """A connected rados client in the pool, with its load and health counters"""
+
+    def __init__(self, client_id: int, cluster):
+        self.id = client_id
+        self.cluster = cluster
+        self.healthy = True
+        self.inflight = 0
+        self.checkouts = 0
+        self.ops = 0
+        self.op_time = 0.
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_used = time.monotonic()
+        # open IoCtx handles of this client, by pool name
+        self.ioctxs = {}
+        # start times of the rados calls in flight; these complete in the threads of librados too
+        self._starts = {}
+        self._op_lock = Lock()
+        # set once removed from the pool; the client is shut down when its last checkout is returned
+        self.retired = False
+        self.closed = False
+
+    def checkout(self):
+        self.inflight += 1
+        self.checkouts += 1
+        self.last_used = time.monotonic()
+
+    def checkin(self, failed=False):
+        self.inflight -= 1
+        self.last_used = time.monotonic()
+        if failed:
+            self.errors += 1
+            self.consecutive_errors += 1
+        else:
+            self.consecutive_errors = 0
+
+    def op_started(self):
+        """Record the start of a rados call; returns the token to pass to op_done"""
+        token = object()
+        with self._op_lock:
+            self._starts[token] = time.monotonic()
+        return token
+
+    def op_done(self, token):
+        with self._op_lock:
+            start = self._starts.pop(token, None)
+            if start is None:
+                return
+            self.ops += 1
+            self.op_time += time.monotonic() - start
+
+    def oldest_op(self):
+        """Seconds the longest running rados call has been in flight; 0 if none"""
+        with self._op_lock:
+            if not self._starts:
+                return 0.
+            return time.monotonic() - min(self._starts.values())
+
+    def retire(self):
+        """Mark the client as removed from the pool, and its IoCtx handles in use to be closed once released.
+
+        Returns tuple of (list of the IoCtx entries not in use, to close now, and True if the client 
+        has no checkouts, so can be closed now). Called with the pool lock held.
+        """
+        self.retired = True
+        idle = []
+        for pool, entry in list(self.ioctxs.items()):
+            if entry.users == 0:
+                del self.ioctxs[pool]
+                idle.append(entry)
+            else:
+                entry.closing = True
+        return idle, self.closable()
+
+    def closable(self):
+        """True, once, when the retired client has no checkouts left, so should be closed; called with the pool lock held"""
+        if not self.retired or self.closed or self.inflight > 0:
+            return False
+        self.closed = True
+        return True
+
+    def close(self):
+        """Close the open IoCtx handles, and shut down the client; only once no checkout is using it"""
+        for entry in self.ioctxs.values():
+            try:
+                entry.ioctx.close()
+            except Exception as e:
+                logging.debug(f"Failed to close ioctx of rados client {self.id}: {e}")
+        self.ioctxs = {}
+        self.cluster.shutdown()
+
+    def stats(self):
+        with self._op_lock:
+            mean_ms = 1000. * self.op_time / self.ops if self.ops > 0 else 0.
+        return {'inflight':self.inflight, 'checkouts':self.checkouts, 'ops':self.ops, 
+                'mean_op_ms':round(mean_ms, 3), 'errors':self.errors, 'healthy':self.healthy,
+                'ioctxs':len(self.ioctxs)}
+
+
+class _TimedIoctx:
+    """An IoCtx of a pooled client, timing each rados call on it, so calls stuck for too long are found.
+
+    Asynchronous reads and stats are timed until their completion. Other attributes are those of the IoCtx.
+    """
+
+    def __init__(self, ioctx, client: _PooledClient):
+        self._ioctx = ioctx
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._ioctx, name)
+
+    def _timed(self, fn, *args):
+        token = self._client.op_started()
+        try:
+            return fn(*args)
+        finally:
+            self._client.op_done(token)
+
+    def _timed_aio(self, fn, oncomplete, *args):
+        token = self._client.op_started()
+        def done(completion, *result):
+            self._client.op_done(token)
+            if oncomplete is not None:
+                oncomplete(completion, *result)
+        try:
+            return fn(*args, oncomplete=done)
+        except Exception:
+            self._client.op_done(token)
+            raise
+
+    def stat(self, oid):
+        return self._timed(self._ioctx.stat, oid)
+
+    def read(self, oid, length=8192, offset=0):
+        return self._timed(self._ioctx.read, oid, length, offset)
+
+    def get_xattr(self, oid, xattr_name):
+        return self._timed(self._ioctx.get_xattr, oid, xattr_name)
+
+    def get_xattrs(self, oid):
+        return self._timed(self._ioctx.get_xattrs, oid)
+
+    def set_xattr(self, oid, xattr_name, xattr_value):
+        return self._timed(self._ioctx.set_xattr, oid, xattr_name, xattr_value)
+
+    def rm_xattr(self, oid, xattr_name):
+        return self._timed(self._ioctx.rm_xattr, oid, xattr_name)
+
+    def aio_read(self, oid, length, offset, oncomplete=None):
+        return self._timed_aio(self._ioctx.aio_read, oncomplete, oid, length, offset)
+
+    def aio_stat(self, oid, oncomplete=None):
+        return self._timed_aio(self._ioctx.aio_stat, oncomplete, oid)
+
 
 class RadosPool:
+    """Pool of connected rados clients, shared by all requests.
+
+    The pool starts with min_size clients, and grows up to max_size when all clients are busy;
+    clients above min_size are closed after being idle for idle_timeout seconds.
+    Each checkout is given the healthy client with the fewest operations in flight.
+    A background thread health-checks the idle clients every health_interval seconds, and replaces any
+    that fail, hang, have a single rados call (e.g. a stat, or the read of one object) stuck for longer 
+    than op_timeout, or fail repeatedly in requests.
+    Each client keeps its IoCtx handles open between requests, one per pool; handles unused for 
+    ioctx_idle_timeout seconds are closed by the health check, and all are closed with their client.
+    A client removed from the pool (replaced, or idle) is only shut down, and its handles closed, 
+    once the requests using it have returned it.
+    """
     _instance = None
-    _max_size = 0
-    _lfn2pfn = None
-    _resources = list()
-    # _resource_generator: callable = None
-    _index = 0
-    _gen_lock = Lock()
 
-    _readsize = 64*1024**2
+    # consecutive client errors (e.g. timeouts) before a client is replaced
+    MAX_CONSECUTIVE_ERRORS = 3
+    # seconds to wait for the health check of a client
+    HEALTH_CHECK_TIMEOUT = 10
 
     def __init__(self, max_size: int = 5, 
                        lfn2pfn: Lfn2PfnMapper = None,
                        readsize = 64*1024**2, 
+                       parallel_reads: int = 1,
+                       readahead: int = 0,
+                       stripe_manifest: bool = False,
                        conffile: str = '/etc/ceph/ceph.conf',
                        keyring: str = '/etc/ceph/ceph.client.xrootd.keyring',
-                       name: str = 'client.xrootd'):
+                       name: str = 'client.xrootd',
+                       min_size: int = 1,
+                       health_interval: float = 30,
+                       idle_timeout: float = 300,
+                       op_timeout: float = 300,
+                       ioctx_idle_timeout: float = 60):
         """Singleton class creation.
 
         Is not expected to be called directly, but rather by the create method
@@ -32,18 +228,40 @@ class RadosPool:
         if RadosPool._instance is not None:
             raise NotImplementedError('Singleton; use create method to instantiate')
         RadosPool._instance = self
-        self._max_size = max_size
+        self._max_size = max(1, max_size)
+        self._min_size = min(max(1, min_size), self._max_size)
+        self._health_interval = health_interval
+        self._idle_timeout = idle_timeout
+        self._op_timeout = op_timeout
+        self._ioctx_idle_timeout = ioctx_idle_timeout
 
         self._lfn2pfn = lfn2pfn
+        self._readsize = readsize
+        self._parallel_reads = max(1, parallel_reads)
+        self._readahead = max(0, readahead)
+        self._stripe_manifest = stripe_manifest
 
         self._conffile = conffile
         self._keyring = keyring
         self._name = name
-        #generate all the instances here
-        # would be better to do this on demand ... 
-        for _ in range(self._max_size):
+
+        self._resources = []
+        self._gen_lock = Lock()
+        self._connecting = 0
+        self._next_id = 0
+        self._replaced = 0
+        self._ioctx_hits = 0
+        self._ioctx_opens = 0
+        self._stop = Event()
+
+        for _ in range(self._min_size):
             self.add_instance()
-        logging.info(f"Created pool with {len(self._resources)} rados clients")
+        logging.info(f"Created pool with {len(self._resources)} rados clients; min {self._min_size}, max {self._max_size}")
+
+        self._health_thread = None
+        if self._health_interval > 0:
+            self._health_thread = Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
 
     @classmethod
     def pool(cls):
@@ -55,47 +273,76 @@ class RadosPool:
 
 
     @classmethod
-    def create(cls, max_size, lfn2pfn, readsize, config_pars: dict = None):
+    def create(cls, max_size, lfn2pfn, readsize, config_pars: dict = None, parallel_reads: int = 1, readahead: int = 0,
+               stripe_manifest: bool = False, min_size: int = 1, health_interval: float = 30, 
+               idle_timeout: float = 300, op_timeout: float = 300, ioctx_idle_timeout: float = 60):
         """Method to create the singleton object; only should be called once"""
 
         if cls._instance is not None:
             raise NotImplementedError('Error, pool already created')
             
-        if cls._instance is None:
-            if config_pars is not None:
-                pool = cls(max_size, 
-                    lfn2pfn = lfn2pfn,
-                    readsize = readsize,
-                    conffile = config_pars['conffile'],
-                    keyring = config_pars['keyring'],
-                    name = config_pars['name'],
-                    )
-            else:
-                pool = cls(max_size, lfn2pfn)
-        return pool
+        if config_pars is None:
+            config_pars = {}
+        return cls(max_size, 
+                   lfn2pfn = lfn2pfn,
+                   readsize = readsize,
+                   parallel_reads = parallel_reads,
+                   readahead = readahead,
+                   stripe_manifest = stripe_manifest,
+                   min_size = min_size,
+                   health_interval = health_interval,
+                   idle_timeout = idle_timeout,
+                   op_timeout = op_timeout,
+                   ioctx_idle_timeout = ioctx_idle_timeout,
+                   **config_pars)
+
+    def _connect(self):
+        """Return a new, connected, rados client"""
+        try:
+            cluster = rados.Rados(conffile = self._conffile, 
+                                  conf = dict (keyring = self._keyring), 
+                                  name=self._name)
+            cluster.connect()
+            logging.debug("Connected a rados client to cluster")
+        except Exception as e:
+            # Log and re-raise the exception for now
+            logging.error(f'Could not connect to cluster',exc_info=True)
+            raise e
+        return cluster
 
     def add_instance(self):
         """Add a new instance of rados client into the pool.
 
-        Checks if this operation would not exceed the max pool size.
-        A lock is used here to ensure that condition is not violated
+        Checks if this operation would not exceed the max pool size; 
+        the connection is made outside the lock, so checkouts continue meanwhile.
+        Returns the new client, or None if the pool is full.
         """
         with self._gen_lock:
-            if len(self._resources) >= self._max_size:
-                logging.warning("Already reached max instances in the pool")
-                return
+            if len(self._resources) + self._connecting >= self._max_size:
+                logging.debug("Already reached max instances in the pool")
+                return None
+            self._connecting += 1
+        try:
+            cluster = self._connect()
+        finally:
+            with self._gen_lock:
+                self._connecting -= 1
+        with self._gen_lock:
+            client = _PooledClient(self._next_id, cluster)
+            self._next_id += 1
+            self._resources.append(client)
+        return client
 
+    def _grow(self):
+        """Add a client in the background"""
+        def run():
             try:
-                cluster = rados.Rados(conffile = self._conffile, 
-                                      conf = dict (keyring = self._keyring), 
-                                      name=self._name)
-                cluster.connect()
-                logging.debug("Connected a rados client to cluster")
-            except Exception as e:
-                # Log and re-raise the exception for now
-                logging.error(f'Could not connect to cluster',exc_info=True)
-                raise e
-            self._resources.append(cluster)
+                client = self.add_instance()
+                if client is not None:
+                    logging.info(f"Grew rados pool to {len(self._resources)} clients")
+            except Exception:
+                pass # already logged
+        Thread(target=run, daemon=True).start()
 
     def __enter__(self):
         """Simple context manager"""
@@ -106,19 +353,225 @@ class RadosPool:
     def shutdown_all(self):
         """Call only once, and at shutdown / termination of the server
         """
+        self._stop.set()
+        with self._gen_lock:
+            clients, self._resources = self._resources, []
+        for client in clients:
+            self._retire(client, wait=True)
+
+    def _select(self):
+        """Check out the least loaded healthy client, growing the pool if all are busy"""
         with self._gen_lock:
-            for cluster in self._resources:
-                cluster.shutdown()
-            self._resources = []
+            candidates = [c for c in self._resources if c.healthy]
+            if not candidates:
+                # better a suspect client than none at all
+                candidates = self._resources
+            if not candidates:
+                raise RuntimeError("No rados clients available in the pool")
+            client = min(candidates, key=lambda c: (c.inflight, c.last_used))
+            grow = client.inflight > 0 and len(self._resources) + self._connecting < self._max_size
+            client.checkout()
+        if grow:
+            self._grow()
+        return client
 
     def get(self):
-        """return an instance of rados client from the pool. 
+        """return an instance of rados client from the pool; the least loaded one.
+
+        Use client() instead, where possible, so the operation is tracked until it completes.
+        """
+        client = self._select()
+        with self._gen_lock:
+            client.checkin()
+            close = client.closable()
+        if close:
+            self._close_client(client)
+        return client.cluster
+
+    @contextmanager
+    def client(self):
+        """Context manager giving the least loaded rados client for the duration of an operation"""
+        with self._checkout() as client:
+            yield client.cluster
+
+    @contextmanager
+    def ioctx(self, pool: str):
+        """Context manager giving an open IoCtx on pool, of the least loaded rados client.
+
+        The IoCtx is cached with its client and shared between operations, so must not be closed by the caller.
+        Raises rados.ObjectNotFound if the pool does not exist.
         """
-        tmp_idx = self._index
-        # not 'atomically' safe ... but safe enough
-        self._index = (self._index + 1) % len(self._resources)
-        rs = self._resources[tmp_idx]
-        return rs
+        with self._checkout() as client:
+            with trace.phase('ioctx'):
+                entry = self._open_ioctx(client, pool)
+            try:
+                yield _TimedIoctx(entry.ioctx, client)
+            finally:
+                with self._gen_lock:
+                    entry.users -= 1
+                    entry.last_used = time.monotonic()
+                    close = entry.closing and entry.users == 0
+                    if close and client.ioctxs.get(pool) is entry:
+                        del client.ioctxs[pool]
+                if close:
+                    self._close_ioctx(client, entry)
+
+    def _open_ioctx(self, client, pool: str):
+        """Return the cached IoCtx entry of the client for pool, opening it if needed; marked as in use"""
+        with self._gen_lock:
+            entry = client.ioctxs.get(pool)
+            if entry is not None:
+                entry.users += 1
+                self._ioctx_hits += 1
+                return entry
+        # opening needs a round trip to the cluster; do not hold the lock meanwhile
+        ioctx = client.cluster.open_ioctx(pool)
+        with self._gen_lock:
+            entry = client.ioctxs.get(pool)
+            if entry is None:
+                entry = _CachedIoctx(ioctx)
+                # the client may have been retired meanwhile
+                entry.closing = client.retired
+                client.ioctxs[pool] = entry
+                self._ioctx_opens += 1
+                ioctx = None
+            entry.users += 1
+        if ioctx is not None:
+            # another operation opened the same pool first
+            ioctx.close()
+        return entry
+
+    @contextmanager
+    def _checkout(self):
+        """Context manager giving the least loaded pooled client, tracking the operation until it completes"""
+        client = self._select()
+        failed = False
+        try:
+            yield client
+        except _CLIENT_ERRORS:
+            failed = True
+            raise
+        finally:
+            with self._gen_lock:
+                client.checkin(failed)
+                replace = client.consecutive_errors >= self.MAX_CONSECUTIVE_ERRORS and client.healthy
+                close = client.closable()
+            if replace:
+                logging.warning(f"Rados client {client.id} failed {client.consecutive_errors} times; replacing")
+                self._replace(client)
+            elif close:
+                # the last checkout of a client retired while in use
+                self._close_client(client)
+
+    def _replace(self, client):
+        """Remove a failed client from the pool, and connect a new one in its place"""
+        with self._gen_lock:
+            if client not in self._resources:
+                return
+            client.healthy = False
+            self._resources.remove(client)
+            self._replaced += 1
+            needed = len(self._resources) + self._connecting < self._min_size
+        self._retire(client)
+        if needed:
+            self._grow()
+
+    def _retire(self, client, wait=False):
+        """Close a client removed from the pool; the IoCtx handles, and the client, still used by requests 
+        are only closed once those requests release them"""
+        with self._gen_lock:
+            idle, close = client.retire()
+        for entry in idle:
+            self._close_ioctx(client, entry)
+        if close:
+            self._close_client(client, wait)
+        else:
+            logging.info(f"Rados client {client.id} is still in use; closing it once released")
+
+    def _close_client(self, client, wait=False):
+        if wait:
+            client.close()
+            return
+        # shutdown may hang on a wedged client, so do not wait for it
+        Thread(target=client.close, daemon=True).start()
+
+    @staticmethod
+    def _close_ioctx(client, entry):
+        try:
+            entry.ioctx.close()
+        except Exception as e:
+            logging.debug(f"Failed to close ioctx of rados client {client.id}: {e}")
+
+    def _check(self, client) -> bool:
+        """Return True if the client responds to a cluster request within HEALTH_CHECK_TIMEOUT"""
+        result = []
+        def run():
+            try:
+                client.cluster.get_cluster_stats()
+                result.append(True)
+            except Exception as e:
+                logging.warning(f"Health check failed for rados client {client.id}: {e}")
+        t = Thread(target=run, daemon=True)
+        t.start()
+        t.join(timeout=self.HEALTH_CHECK_TIMEOUT)
+        return len(result) > 0
+
+    def _health_loop(self):
+        while not self._stop.wait(self._health_interval):
+            try:
+                self.health_check()
+            except Exception:
+                logging.error("Exception in rados pool health check", exc_info=True)
+
+    def health_check(self):
+        """Check the clients; replace those failing or stuck, and close those idle above the min size"""
+        now = time.monotonic()
+        with self._gen_lock:
+            clients = list(self._resources)
+        for client in clients:
+            if client.oldest_op() > self._op_timeout:
+                logging.warning(f"Rados client {client.id} has a rados call stuck for {client.oldest_op():.0f}s; replacing")
+                self._replace(client)
+            elif client.inflight == 0 and not self._check(client):
+                self._replace(client)
+        with self._gen_lock:
+            idle = [c for c in self._resources if c.inflight == 0 and now - c.last_used > self._idle_timeout]
+            idle = idle[:max(0, len(self._resources) - self._min_size)]
+            for client in idle:
+                self._resources.remove(client)
+        for client in idle:
+            logging.info(f"Closing idle rados client {client.id}")
+            self._retire(client, wait=True)
+        self._close_idle_ioctxs()
+        with self._gen_lock:
+            needed = self._min_size - len(self._resources) - self._connecting
+        for _ in range(needed):
+            self._grow()
+
+    def _close_idle_ioctxs(self):
+        """Close the cached IoCtx handles not used for ioctx_idle_timeout seconds"""
+        now = time.monotonic()
+        idle = []
+        with self._gen_lock:
+            for client in self._resources:
+                for pool, entry in list(client.ioctxs.items()):
+                    if entry.users == 0 and now - entry.last_used > self._ioctx_idle_timeout:
+                        del client.ioctxs[pool]
+                        idle.append((client.id, pool, entry))
+        for client_id, pool, entry in idle:
+            logging.debug(f"Closing idle ioctx of rados client {client_id} on pool {pool}")
+            entry.ioctx.close()
+
+    def stats(self):
+        """Return dict of the pool size and counters"""
+        with self._gen_lock:
+            return {'size':len(self._resources), 'min':self._min_size, 'max':self._max_size, 
+                    'replaced':self._replaced, 'ioctx_hits':self._ioctx_hits, 'ioctx_opens':self._ioctx_opens}
+
+    def client_stats(self):
+        """Return dict of the counters of each client in the pool, by client id"""
+        with self._gen_lock:
+            return {client.id:client.stats() for client in self._resources}
 
     def parse(self, path: str, remove_cgi: bool =True): 
         """Parse an input path into it's pool an object name, according to the mapping file
@@ -135,9 +588,38 @@ class RadosPool:
         logging.debug(f'Mapped {path} to {pool}, {oid}')
         return pool, oid
 
+    def backend_spec(self, pool: str):
+        """Return the dict of the backend settings of the pool, as set in the lfn2pfn mapping"""
+        if self._lfn2pfn is not None:
+            return self._lfn2pfn.backend(pool)
+        return {'backend':'rados'}
+
+    @contextmanager
+    def backend(self, pool: str):
+        """Context manager giving the storage Backend of pool: a rados pool, on an IoCtx as from ioctx(pool),
+        or as set for the pool in the lfn2pfn mapping"""
+        spec = self.backend_spec(pool)
+        if spec['backend'] != 'rados':
+            yield storage.create(pool, spec)
+            return
+        with self.ioctx(pool) as ioctx:
+            yield RadosBackend(ioctx)
+
     def readsize(self):
         """Readsize in bytes to read chunks"""
         return self._readsize
 
+    def parallel_reads(self):
+        """Max number of concurrent stripe reads when computing a checksum from a file"""
+        return self._parallel_reads
+
+    def readahead(self):
+        """Number of readsize buffers used by the sequential read-ahead; 0 or 1 disables it"""
+        return self._readahead
+
+    def stripe_manifest(self):
+        """If True, store the per-stripe checksum manifest when a checksum is computed from file"""
+        return self._stripe_manifest
+
     def __str__(self):
         return "RadosPool:{}/{} used".format(len(self._resources), self._max_size)
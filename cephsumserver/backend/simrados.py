@@ -0,0 +1,339 @@
+"""Simulated rados backend, to study the latency, throughput and failure behaviour of the server offline.
+
+Stands in for the rados module, as memrados does, with a SimModel applied to each operation:
+a latency drawn from a distribution per kind of operation (connect, stat, read, xattr), a bandwidth
+cap on the reads of each client, stalls on the objects placed on slow OSDs, and injected
+ObjectNotFound, NoData and TimedOut errors. Operations taking longer than the op timeout fail
+with TimedOut, as with rados_osd_op_timeout.
+
+The files of the cluster are those listed in the model, and, if the model has a default file size,
+any other file asked for; they hold synthetic content (see memrados).
+
+Selected with backend = sim in the [CEPH] section of the config; SimModel.from_config lists the options.
+"""
+import logging
+import math
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+
+from . import memrados
+# the exceptions and completions of the module are those of memrados
+from .memrados import (Error, ObjectNotFound, NoData, TimedOut, ConnectionShutdown,  # noqa: F401
+                       RadosStateError, Completion, STORE)
+
+
+_DURATION_UNITS = {'us':1e-6, 'ms':1e-3, 's':1.}
+_SIZE_UNITS = {'K':1024, 'M':1024**2, 'G':1024**3, 'T':1024**4}
+_STRIPE_OID = re.compile(r'^(.*)\.([0-9a-f]{16})$')
+
+
+def parse_duration(text: str) -> float:
+    """Convert e.g. 250us, 2ms, 1.5s or 0.002 into seconds"""
+    text = text.strip().lower()
+    for unit in ('us', 'ms', 's'):
+        if text.endswith(unit):
+            return float(text[:-len(unit)]) * _DURATION_UNITS[unit]
+    return float(text)
+
+def parse_size(text: str) -> int:
+    """Convert e.g. 4K, 64M or 16G into bytes"""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in _SIZE_UNITS:
+        return int(float(text[:-1]) * _SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+class Latency:
+    """A distribution of the latency of an operation, parsed from text such as:
+
+    2ms                  fixed
+    uniform:1ms,5ms      uniform between low and high
+    exp:2ms              exponential, with the mean
+    lognormal:2ms,0.5    log-normal, with the median and sigma
+    pareto:1ms,1.5       pareto, with the minimum and shape (heavy tailed, for smaller shapes)
+    """
+    KINDS = ('fixed', 'uniform', 'exp', 'lognormal', 'pareto')
+
+    def __init__(self, kind: str = 'fixed', *params):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind}; expected one of {', '.join(self.KINDS)}")
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, text: str):
+        text = (text or '0').strip()
+        kind, _, params = text.partition(':') if ':' in text else ('fixed', '', text)
+        kind = kind.strip().lower()
+        values = [x.strip() for x in params.split(',') if x.strip()]
+        # shapes are plain numbers, the other parameters durations
+        shape_index = 1 if kind in ('lognormal', 'pareto') else None
+        return cls(kind, *[float(v) if i == shape_index else parse_duration(v) for i, v in enumerate(values)])
+
+    def sample(self, rng: random.Random) -> float:
+        """Return a latency, in seconds"""
+        if self.kind == 'fixed':
+            return self.params[0] if self.params else 0.
+        if self.kind == 'uniform':
+            return rng.uniform(*self.params)
+        if self.kind == 'exp':
+            return rng.expovariate(1. / self.params[0]) if self.params[0] > 0 else 0.
+        if self.kind == 'lognormal':
+            return rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return self.params[0] * rng.paretovariate(self.params[1])
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+
+class _Throttle:
+    """Bandwidth cap: transfers are queued one after the other at rate bytes/s"""
+
+    def __init__(self, rate: float):
+        self._rate = rate
+        self._next = 0.
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> float:
+        """Reserve the transfer of nbytes; returns the seconds until it completes"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + nbytes / self._rate
+            return self._next - now
+
+
+class SimModel:
+    """The latency, bandwidth and failure model of the simulated cluster, and the files it holds"""
+    OPS = ('connect', 'stat', 'read', 'xattr')
+
+    def __init__(self, latency: dict = None, bandwidth: float = 0, osds: int = 1, slow_osds: int = 0,
+                 stall: float = 0., stall_probability: float = 1., errors: dict = None, op_timeout: float = 0.,
+                 files=(), file_size: int = 0, object_size: int = 64*1024**2, seed=None):
+        """
+        latency:            dict of op name to Latency; ops not given take no time
+        bandwidth:          bytes/s read by each client; 0 for no cap
+        osds, slow_osds:    objects are placed on one of osds by hash; the first slow_osds of them stall
+        stall:              seconds added to an operation on a slow OSD, with stall_probability
+        errors:             dict of probability per operation of 'notfound', 'nodata' (get_xattr) and 'timeout'
+        op_timeout:         seconds after which an operation fails with TimedOut; 0 for none
+        files:              list of (pool, path, size) created in the cluster
+        file_size:          size of any other file asked for; 0 to only have the listed files
+        """
+        self.latency = {op:(latency or {}).get(op, Latency()) for op in self.OPS}
+        self.bandwidth = bandwidth
+        self.osds = max(1, osds)
+        self.slow_osds = min(slow_osds, self.osds)
+        self.stall = stall
+        self.stall_probability = stall_probability
+        self.errors = dict(errors or {})
+        self.op_timeout = op_timeout
+        self.files = list(files)
+        self.file_size = file_size
+        self.object_size = object_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = {'ops':0, 'stalls':0, 'notfound':0, 'nodata':0, 'timeout':0}
+
+    @classmethod
+    def from_config(cls, options):
+        """Create the model from a mapping (e.g. the [CEPH] config section) with the options:
+
+        simlatency<op>   latency distribution of connect, stat, read or xattr (e.g. simlatencyread = lognormal:5ms,0.8)
+        simbandwidth     MB/s read by each rados client; 0 for no cap
+        simosds          number of OSDs the objects are spread over
+        simslowosds      number of those that stall
+        simstall         seconds of each stall
+        simstallprob     probability an operation on a slow OSD stalls
+        simnotfound      probability an operation raises ObjectNotFound
+        simnodata        probability a get_xattr raises NoData
+        simtimeout       probability an operation hangs until the op timeout, and raises TimedOut
+        simoptimeout     seconds before an operation fails with TimedOut; 0 for none
+        simfiles         comma separated list of pool:path:size
+        simfilesize      size of any other file asked for, e.g. 1G; 0 to only have the listed files
+        simobjectsize    size of the rados objects of the files
+        simseed          seed of the random generator, for reproducible runs
+        """
+        get = lambda key, default: options.get(key, default) or default
+        files = []
+        for spec in get('simfiles', '').split(','):
+            if spec.strip():
+                if spec.count(':') < 2:
+                    raise ValueError(f"simfiles entry {spec} is not pool:path:size")
+                pool, rest = spec.strip().split(':', 1)
+                path, size = rest.rsplit(':', 1)
+                files.append((pool, path, parse_size(size)))
+        seed = get('simseed', None)
+        return cls(latency={op:Latency.parse(get(f'simlatency{op}', '0')) for op in cls.OPS},
+                   bandwidth=float(get('simbandwidth', 0)) * 1e6,
+                   osds=int(get('simosds', 1)),
+                   slow_osds=int(get('simslowosds', 0)),
+                   stall=parse_duration(get('simstall', '0')),
+                   stall_probability=float(get('simstallprob', 1)),
+                   errors={'notfound':float(get('simnotfound', 0)),
+                           'nodata':float(get('simnodata', 0)),
+                           'timeout':float(get('simtimeout', 0))},
+                   op_timeout=parse_duration(get('simoptimeout', '0')),
+                   files=files,
+                   file_size=parse_size(get('simfilesize', '0')),
+                   object_size=parse_size(get('simobjectsize', '64M')),
+                   seed=int(seed) if seed is not None else None)
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _happens(self, error):
+        probability = self.errors.get(error, 0)
+        if probability > 0 and self._random() < probability:
+            self._count(error)
+            return True
+        return False
+
+    def is_slow(self, oid: str) -> bool:
+        """Whether the object is placed on a slow OSD"""
+        return self.slow_osds > 0 and zlib.crc32(oid.encode()) % self.osds < self.slow_osds
+
+    def simulate(self, op: str, oid: str = None, throttle: _Throttle = None, nbytes: int = 0):
+        """Wait for the duration of the operation, or raise its injected error"""
+        self._count('ops')
+        if oid is not None and self._happens('notfound'):
+            raise ObjectNotFound(f"Failed to find object {oid} (injected)")
+        if self._happens('timeout'):
+            time.sleep(self.op_timeout)
+            raise TimedOut(f"Operation {op} on {oid} timed out (injected)")
+        with self._lock:
+            seconds = self.latency[op].sample(self._rng)
+        if oid is not None and self.stall > 0 and self.is_slow(oid) and self._random() < self.stall_probability:
+            self._count('stalls')
+            seconds += self.stall
+        if throttle is not None and nbytes > 0:
+            seconds += throttle.reserve(nbytes)
+        if self.op_timeout > 0 and seconds > self.op_timeout:
+            time.sleep(self.op_timeout)
+            self._count('timeout')
+            raise TimedOut(f"Operation {op} on {oid} timed out after {self.op_timeout}s")
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def populate(self, store: memrados.Store):
+        """Create the listed files in the store"""
+        for pool, path, size in self.files:
+            store.write_striped(pool, path, size, object_size=self.object_size)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def __str__(self):
+        latency = ', '.join(f'{op}={self.latency[op]}' for op in self.OPS)
+        return (f"SimModel: latency {latency}; bandwidth {self.bandwidth/1e6:.0f} MB/s per client; "
+                f"{self.slow_osds}/{self.osds} slow OSDs stalling {self.stall}s; errors {self.errors}; "
+                f"op timeout {self.op_timeout}s; {len(self.files)} files, default size {self.file_size}")
+
+
+_model = SimModel()
+
+
+class Ioctx(memrados.Ioctx):
+    """An open pool of the simulated cluster"""
+
+    def _object(self, oid):
+        try:
+            return super()._object(oid)
+        except ObjectNotFound:
+            # create any file asked for, if the model has a default file size
+            model = self._cluster._model
+            match = _STRIPE_OID.match(oid)
+            if model.file_size <= 0 or match is None:
+                raise
+            self._cluster._store.write_striped(self.name, match.group(1), model.file_size,
+                                               object_size=model.object_size)
+            return super()._object(oid)
+
+    def _simulate(self, op, oid, nbytes=0):
+        self._cluster._model.simulate(op, oid, self._cluster._throttle, nbytes)
+
+    def stat(self, oid):
+        self._simulate('stat', oid)
+        return super().stat(oid)
+
+    def read(self, oid, length=8192, offset=0):
+        obj = self._object(oid)
+        self._simulate('read', oid, max(0, min(length, obj.size - offset)))
+        return obj.read(length, offset)
+
+    def get_xattr(self, oid, xattr_name):
+        self._simulate('xattr', oid)
+        if self._cluster._model._happens('nodata'):
+            raise NoData(f"Failed to get xattr {xattr_name} (injected)")
+        return super().get_xattr(oid, xattr_name)
+
+    def get_xattrs(self, oid):
+        self._simulate('xattr', oid)
+        return super().get_xattrs(oid)
+
+    def set_xattr(self, oid, xattr_name, xattr_value):
+        self._simulate('xattr', oid)
+        return super().set_xattr(oid, xattr_name, xattr_value)
+
+    def rm_xattr(self, oid, xattr_name):
+        self._simulate('xattr', oid)
+        return super().rm_xattr(oid, xattr_name)
+
+
+class Rados(memrados.Rados):
+    """A client of the simulated cluster; the arguments are accepted as for rados.Rados, and ignored"""
+
+    def __init__(self, *args, model: SimModel = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._model = model if model is not None else _model
+        self._throttle = _Throttle(self._model.bandwidth) if self._model.bandwidth > 0 else None
+
+    def connect(self, timeout=0):
+        self._model.simulate('connect')
+        super().connect(timeout)
+
+    def get_cluster_stats(self):
+        self._require_connected()
+        self._model.simulate('stat')
+        return super().get_cluster_stats()
+
+    def open_ioctx(self, ioctx_name):
+        self._require_connected()
+        if self._model.file_size > 0:
+            self._store.create_pool(ioctx_name)
+        return Ioctx(self, ioctx_name, self._store.pool(ioctx_name))
+
+
+def model() -> SimModel:
+    """Return the model of the simulated cluster"""
+    return _model
+
+def install(sim_model: SimModel = None):
+    """Register this module as the rados module, with the model (or the default, without delays or errors),
+    creating its files. Must be called before the cephsumserver modules using rados are imported.
+
+    Returns the model.
+    """
+    global _model
+    if sim_model is not None:
+        _model = sim_model
+    _model.populate(STORE)
+    sys.modules['rados'] = sys.modules[__name__]
+    return _model
+
+def init_worker(options: dict, config_pars: dict, loglevel=logging.INFO):
+    """Initializer of the child processes of the ProcessEngine: install the simulated cluster, then
+    connect the rados client of the process. Files written by a child are not seen by the server process."""
+    install(SimModel.from_config(options))
+    from . import procworker
+    procworker.init_worker(config_pars, loglevel)
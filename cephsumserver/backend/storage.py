@@ -0,0 +1,204 @@
+"""Storage backends: the operations the checksum actions need on the files of a pool.
+
+Backend is the interface: the primitive operations stat, read_stream, get_xattr and set_xattr,
+and the checksum operations built on them, which a backend may override with faster versions.
+RadosBackend (radosbackend) implements it over the striped objects of a rados pool, and
+PosixBackend (posixbackend) over the files under a directory, e.g. of a CephFS mount.
+
+The backend of each pool is set in the lfn2pfn mapping; pools not listed there are rados pools.
+"""
+import logging
+import time
+
+from datetime import datetime, timedelta
+
+from ..backend import XrdCks, digests
+from ..common import metrics, trace
+from ..common.membudget import read_buffers
+
+
+class FileMetadata:
+    """Metadata of a file: its xattrs and, if known, its size and mtime (as time.struct_time)"""
+
+    def __init__(self, path, xattrs: dict, size=None, mtime=None):
+        self.path = path
+        self.xattrs = xattrs
+        self.size = size
+        self.mtime = mtime
+
+    def xattr(self, xattr_name):
+        """Return the xattr value as bytes, or None if not set"""
+        return self.xattrs.get(xattr_name)
+
+    def total_size(self):
+        """Return the size of the file in bytes, or None if not known"""
+        return self.size
+
+    def __str__(self):
+        return f'FileMetadata: {self.path}; size: {self.size}; xattrs: {list(self.xattrs.keys())}'
+
+
+def new_file_checksum(cks_hex: str, mtime, total_size=None, alg_name='adler32'):
+    """Return the XrdCks of a checksum just computed from a file last modified at mtime (time.struct_time)"""
+    fmtime = datetime(mtime.tm_year, mtime.tm_mon, mtime.tm_mday ,mtime.tm_hour ,mtime.tm_min ,mtime.tm_sec )
+    if mtime.tm_isdst:
+        fmtime = fmtime - timedelta(hours=1)
+
+    mnow  = time.localtime()
+    now = datetime(mnow.tm_year, mnow.tm_mon, mnow.tm_mday ,mnow.tm_hour ,mnow.tm_min ,mnow.tm_sec )
+    if mtime.tm_isdst:
+        now = now - timedelta(hours=1)
+
+    delta = now - fmtime
+
+    fmtime_asint = int(fmtime.timestamp())
+    cstime_asint = int(delta.total_seconds())
+
+    cks = XrdCks.XrdCks(alg_name, fmtime_asint, cstime_asint, cks_hex)
+    cks.source_type = 'file'
+    cks.total_size_bytes = total_size
+    return cks
+
+
+class Backend:
+    """The files of one pool of a storage backend.
+
+    Paths are those given by the lfn2pfn mapping, within the pool. xattr names are those used by
+    xrootd (e.g. XrdCks.adler32); a backend maps them to its own namespace if needed.
+    """
+    # name of the backend, as set in the lfn2pfn mapping
+    kind = None
+    # exception raised when a file does not exist
+    NotFound = FileNotFoundError
+
+    def __init__(self, name: str):
+        # the pool name
+        self.name = name
+
+    def stat(self, path):
+        """Return tuple of (size in bytes, mtime as time.struct_time); raises NotFound if the file does not exist"""
+        raise NotImplementedError
+
+    def read_stream(self, path, readsize, readahead=0):
+        """Yield the content of the file, in buffers of up to readsize bytes.
+
+        A buffer may be a memoryview, and is only valid until the next one is taken.
+        """
+        raise NotImplementedError
+
+    def get_xattr(self, path, xattr_name):
+        """Return the xattr value as bytes, or None if the file or the xattr does not exist"""
+        raise NotImplementedError
+
+    def set_xattr(self, path, xattr_name, xattr_value, force=False):
+        """Write the xattr; if it already exists, only overwrite if force, else raise ValueError"""
+        raise NotImplementedError
+
+    def metadata(self, path, with_stat=False):
+        """Return the FileMetadata of the file, with its stat if with_stat; raises NotFound if it does not exist"""
+        raise NotImplementedError
+
+    def cks_from_metadata(self, path, xattr_name, metadata=None):
+        """Return the checksum stored in the xattr, as XrdCks, or None if not stored or the file does not exist.
+
+        metadata, if given, is the FileMetadata already resolved for the path.
+        """
+        if metadata is None:
+            try:
+                metadata = self.metadata(path)
+            except self.NotFound:
+                logging.debug("No file found: %s", path)
+                return None
+        val = metadata.xattr(xattr_name)
+        if val is None:
+            logging.debug("No metadata stored for %s %s",xattr_name, path)
+            return None
+        cks = XrdCks.XrdCks.from_binary(val)
+        cks.source_type = 'metadata'
+        cks.total_size_bytes = metadata.total_size()
+        return cks
+
+    def cks_write_metadata(self, path, xattr_name, xattr_value, force_overwrite=False):
+        """Store the checksum in the xattr; only replace an existing value if force_overwrite"""
+        with trace.phase('writeback'):
+            self.set_xattr(path, xattr_name, xattr_value, force_overwrite)
+        return True
+
+    def cks_from_file(self, path, readsize, max_inflight=1, readahead=0, metadata=None):
+        """Compute the checksum by reading the file, as XrdCks; None if the file does not exist.
+
+        metadata, if given, is the FileMetadata already resolved for the path.
+        max_inflight is for backends reading parts of the file in parallel.
+        """
+        checksums = self.cks_from_file_multi(path, ['adler32'], readsize, max_inflight, readahead, metadata)
+        return checksums['adler32'] if checksums is not None else None
+
+    def cks_from_file_multi(self, path, algs, readsize, max_inflight=1, readahead=0, metadata=None):
+        """Compute the checksums of each of algs in a single read of the file.
+
+        Returns dict of XrdCks, by algorithm; None if the file does not exist.
+        Raises IOError if the size of the file is not known, or does not match the bytes read.
+        The file is read in order, so max_inflight, if more than 1, is the number of reads kept 
+        in flight ahead of the checksums, as with readahead.
+        metadata, if given, is the FileMetadata already resolved for the path.
+        """
+        try:
+            if metadata is None or metadata.mtime is None:
+                metadata = self.metadata(path, with_stat=True)
+        except self.NotFound:
+            logging.warning(f"File {path} not found")
+            return None
+        total_size = metadata.total_size()
+        if total_size is None:
+            logging.error(f"No size known for {path}; unable to verify the bytes read")
+            raise IOError(f"No size known for {path}")
+        if max_inflight > 1:
+            readahead = max(readahead, max_inflight)
+
+        started = time.monotonic()
+        current_trace = trace.current()
+        read_before = current_trace.duration('read') if current_trace is not None else 0.
+        multi = digests.MultiDigest(algs)
+        with read_buffers(readsize, max(1, readahead)) as readsize:
+            waited = time.monotonic() - started
+            hexdigests = multi.calc_checksums( trace.timed(self.read_stream(path, readsize, readahead), 'read') )
+        bytes_read = multi.bytes_read
+        elapsed = time.monotonic() - started
+        metrics.checksum_done(bytes_read, elapsed - waited, source=self.kind)
+        if current_trace is not None:
+            current_trace.add('budget', waited)
+            # the time not spent waiting for the budget or reads was spent computing the checksums
+            current_trace.add('+'.join(algs), elapsed - waited - (current_trace.duration('read') - read_before))
+            current_trace.record_read(bytes_read)
+
+        if bytes_read != total_size:
+            logging.error(f"Mismatch in bytes read {bytes_read} and file size {total_size}")
+            raise IOError(f"Mismatch in bytes read: {path}, {bytes_read}, {total_size}")
+        return {alg:new_file_checksum(cks_hex, metadata.mtime, total_size, alg) for alg, cks_hex in hexdigests.items()}
+
+    def cks_write_metadata_multi(self, path, checksums: dict, force_overwrite=False):
+        """Store each XrdCks of checksums, by algorithm, in its XrdCks.<alg> xattr, in a single write-back"""
+        with trace.phase('writeback'):
+            for alg, xrdcks in checksums.items():
+                self.set_xattr(path, f'XrdCks.{alg}', xrdcks.to_binary(), force_overwrite)
+        return True
+
+    def manifest_from_metadata(self, path, metadata=None):
+        """Return the stored per-stripe checksum manifest, as StripeManifest, or None"""
+        return None
+
+    def verify_stripes(self, path, manifest, stripes, readsize, max_inflight=1):
+        """Return the sorted list of the given stripe indices that do not match the manifest"""
+        raise ValueError(f"Stripe verification is not supported for {self.kind} pools")
+
+    def __str__(self):
+        return f'{type(self).__name__}: {self.name}'
+
+
+def create(pool: str, spec: dict):
+    """Return the backend for pool, other than rados, from its settings in the lfn2pfn mapping"""
+    kind = spec.get('backend', 'rados')
+    if kind == 'posix':
+        from .posixbackend import PosixBackend
+        return PosixBackend(pool, spec['root'])
+    raise ValueError(f"Unknown backend {kind} for pool {pool}")
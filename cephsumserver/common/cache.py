@@ -0,0 +1,86 @@
+import logging
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class ChecksumCache:
+    """Bounded LRU cache of checksum results, with a time-to-live on each entry.
+
+    Entries are stored per (pool, path, xattr name), and only returned while the 
+    chunk0 mtime and striper size of the file are unchanged, and the entry has not expired.
+    """
+    _instance = None
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60):
+        if ChecksumCache._instance is not None:
+            raise NotImplementedError('Singleton; use create method to instantiate')
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+        ChecksumCache._instance = self
+
+    @classmethod
+    def create(cls, max_size: int = 1000, ttl: float = 60):
+        if cls._instance is not None:
+            raise NotImplementedError('Error, cache already created')
+        return cls(max_size, ttl)
+
+    @classmethod
+    def cache(cls):
+        """Return the singleton instance, or None if caching is not enabled"""
+        return cls._instance
+
+    def get(self, pool, path, xattr_name, mtime, total_size):
+        """Return the cached checksum for the file in its current state, or None"""
+        key = (pool, path, xattr_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            entry_mtime, entry_size, value, expires = entry
+            if entry_mtime != mtime or entry_size != total_size or expires < time.monotonic():
+                # stale; file changed or entry too old
+                del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, pool, path, xattr_name, mtime, total_size, value):
+        """Store a checksum for the file in its current state"""
+        if value is None:
+            return
+        key = (pool, path, xattr_name)
+        with self._lock:
+            self._entries[key] = (mtime, total_size, value, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, pool, path):
+        """Remove all entries for the given file, e.g. after its metadata is rewritten"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == pool and k[1] == path]:
+                del self._entries[key]
+                self._invalidations += 1
+
+    def stats(self):
+        """Return dict of the cache counters"""
+        with self._lock:
+            return {'size':len(self._entries), 'hits':self._hits, 'misses':self._misses,
+                    'evictions':self._evictions, 'invalidations':self._invalidations}
+
+    def __str__(self):
+        return f'ChecksumCache: {len(self._entries)}/{self._max_size} entries, ttl {self._ttl}s'
@@ -0,0 +1,128 @@
+import logging
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+
+
+class MemoryBudget:
+    """Server-wide limit on the bytes held in read buffers by the requests computing checksums from file.
+
+    A request reserves its buffers (readsize bytes, times the number it may hold at once) before reading.
+    If the full amount is not available, it is given a smaller readsize, down to MIN_READSIZE;
+    if even that is not available, it waits, in turn, until other requests release their buffers.
+    The buffers of a request never exceed the budget, so with many of them the readsize may be 
+    reduced below MIN_READSIZE (and ALIGN, if need be) to fit.
+    """
+    _instance = None
+
+    # smallest readsize a request is reduced to, before it waits instead
+    MIN_READSIZE = 4*1024**2
+    # reduced readsizes are a multiple of this
+    ALIGN = 64*1024
+
+    def __init__(self, max_bytes: int):
+        if MemoryBudget._instance is not None:
+            raise NotImplementedError('Singleton; use create method to instantiate')
+        self._max_bytes = max(self.ALIGN, max_bytes)
+        self._in_use = 0
+        self._peak = 0
+        self._waiting = 0
+        self._reservations = 0
+        self._waits = 0
+        self._reduced = 0
+        # the requests waiting to reserve buffers, in order of arrival
+        self._queue = deque()
+        self._cond = Condition()
+
+        MemoryBudget._instance = self
+
+    @classmethod
+    def create(cls, max_bytes: int):
+        if cls._instance is not None:
+            raise NotImplementedError('Error, memory budget already created')
+        return cls(max_bytes)
+
+    @classmethod
+    def budget(cls):
+        """Return the singleton instance, or None if no budget is set"""
+        return cls._instance
+
+    def acquire(self, readsize: int, depth: int = 1):
+        """Reserve depth buffers, of up to readsize bytes, blocking until they are available.
+
+        Returns the readsize granted, which may be smaller than requested, and is never more than 
+        the budget divided by depth; the caller must release readsize granted * depth bytes when done.
+        Requests are served in order, so a request waiting for buffers is not overtaken by later ones.
+        """
+        depth = max(1, depth)
+        if depth > self._max_bytes:
+            raise ValueError(f"Cannot hold {depth} read buffers in a budget of {self._max_bytes} bytes")
+        # the largest readsize of which depth buffers fit in the budget; aligned, unless smaller than ALIGN
+        ceiling = self._max_bytes // depth
+        if ceiling >= self.ALIGN:
+            ceiling = ceiling // self.ALIGN * self.ALIGN
+        largest = max(1, min(readsize, ceiling))
+        # a smaller readsize is not worth the extra reads below MIN_READSIZE
+        minimum = min(largest, self.MIN_READSIZE)
+        token = object()
+        with self._cond:
+            self._queue.append(token)
+            try:
+                if self._queue[0] is not token or self._max_bytes - self._in_use < minimum * depth:
+                    self._waits += 1
+                    self._waiting += 1
+                    try:
+                        while self._queue[0] is not token or self._max_bytes - self._in_use < minimum * depth:
+                            self._cond.wait()
+                    finally:
+                        self._waiting -= 1
+            finally:
+                self._queue.remove(token)
+                # the next request in the queue may now go ahead
+                self._cond.notify_all()
+            available = self._max_bytes - self._in_use
+            if available >= largest * depth:
+                granted = largest
+            else:
+                granted = max(minimum, min((available // depth) // self.ALIGN * self.ALIGN, largest))
+            if granted < readsize:
+                self._reduced += 1
+            self._in_use += granted * depth
+            self._peak = max(self._peak, self._in_use)
+            self._reservations += 1
+        if granted < readsize:
+            logging.debug(f"Read buffers reduced from {readsize} to {granted} bytes, for {depth} buffers")
+        return granted
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self._in_use -= nbytes
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return dict of the budget use and counters"""
+        with self._cond:
+            return {'max_bytes':self._max_bytes, 'in_use':self._in_use, 'peak':self._peak,
+                    'waiting':self._waiting, 'reservations':self._reservations,
+                    'waits':self._waits, 'reduced':self._reduced}
+
+    def __str__(self):
+        return f'MemoryBudget: {self._in_use}/{self._max_bytes} bytes in use'
+
+
+@contextmanager
+def read_buffers(readsize: int, depth: int = 1):
+    """Reserve read buffers from the MemoryBudget, if one is set, for the duration of the context.
+
+    Yields the readsize to use, which may be smaller than requested.
+    """
+    budget = MemoryBudget.budget()
+    if budget is None:
+        yield readsize
+        return
+    granted = budget.acquire(readsize, depth)
+    try:
+        yield granted
+    finally:
+        budget.release(granted * max(1, depth))
@@ -0,0 +1,294 @@
+import logging
+import os
+import socketserver
+import threading
+import time
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+# upper bounds, in seconds, of the request latency buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# upper bounds, in MB/s, of the checksum throughput buckets
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+
+
+def _label_text(names, values, extra=''):
+    """Return the {name="value",...} label text of a sample"""
+    pairs = ['{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """A monotonically increasing value, per combination of label values"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, *labels):
+        """Add value to the counter for the label values, given in the order of the label names"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        """Return list of (name suffix, label text, value)"""
+        with self._lock:
+            values = list(self._values.items())
+        return [('', _label_text(self.labels, k), v) for k, v in values]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, per combination of label values"""
+    kind = 'gauge'
+
+    def dec(self, value=1, *labels):
+        self.inc(-value, *labels)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, with their sum, per combination of label values"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [count per bucket, with a last +Inf bucket], sum
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Add an observation for the label values, given in the order of the label names"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            return sum(entry[0]) if entry is not None else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(counts), total) for k, (counts, total) in self._values.items()]
+        samples = []
+        for k, counts, total in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                samples.append(('_bucket', _label_text(self.labels, k, f'le="{bound}"'), cumulative))
+            samples.append(('_sum', _label_text(self.labels, k), total))
+            samples.append(('_count', _label_text(self.labels, k), cumulative))
+        return samples
+
+
+class Registry:
+    """The metrics of the server, and callables returning dicts of other values, exported as gauges"""
+
+    def __init__(self, prefix: str = 'cephsum'):
+        self._prefix = prefix
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise RuntimeError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(f'{self._prefix}_{name}', help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(f'{self._prefix}_{name}', help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(f'{self._prefix}_{name}', help, labels, buckets))
+
+    def register_collector(self, name: str, source, label: str = None):
+        """Register a callable returning a dict of numeric values, exported as gauges <prefix>_<name>_<key>.
+
+        With label, the callable returns a dict of such dicts, by label value (e.g. per client), and each 
+        gauge has a sample per label value, rather than a gauge per label value.
+        """
+        with self._lock:
+            self._collectors[name] = (source, label)
+
+    def _collect(self, name, source, label):
+        """Return dict of key: list of (label text, value) of the values of a collector"""
+        try:
+            values = source()
+        except Exception:
+            logging.debug(f"Metrics: failed to collect {name}", exc_info=True)
+            return {}
+        per_label = values.items() if label is not None else [(None, values)]
+        samples = {}
+        for label_value, group in per_label:
+            labels = _label_text((label,), (label_value,)) if label is not None else ''
+            for key, value in group.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                samples.setdefault(key, []).append((labels, value))
+        return samples
+
+    def exposition(self) -> str:
+        """Return all the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{labels} {value}')
+        for name, (source, label) in collectors:
+            for key, samples in self._collect(name, source, label).items():
+                metric_name = f'{self._prefix}_{name}_{key}'
+                lines.append(f'# HELP {metric_name} The {key} value of the {name} stats')
+                lines.append(f'# TYPE {metric_name} gauge')
+                for labels, value in samples:
+                    lines.append(f'{metric_name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# the registry of the server process
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('requests_total', 'Requests completed', ('request', 'action', 'pool', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('request_seconds', 'Time from receiving a request to its response',
+                                     ('request', 'action', 'pool'))
+REQUESTS_INFLIGHT = REGISTRY.gauge('requests_inflight', 'Requests received but not yet responded to')
+REQUEST_ERRORS = REGISTRY.counter('request_errors_total', 'Requests that could not be created or started',
+                                  ('request',))
+RADOS_READ_BYTES = REGISTRY.counter('rados_read_bytes_total', 'Bytes read from rados objects to compute checksums')
+CHECKSUM_BYTES = REGISTRY.counter('checksum_bytes_total', 'Bytes checksummed from file')
+CHECKSUM_SECONDS = REGISTRY.counter('checksum_seconds_total', 'Time spent reading and checksumming files')
+CHECKSUM_THROUGHPUT = REGISTRY.histogram('checksum_throughput_mbps', 'Read and checksum rate of each file, in MB/s',
+                                         buckets=THROUGHPUT_BUCKETS)
+
+
+def request_started():
+    """Return the start time of a request, counting it as in flight"""
+    REQUESTS_INFLIGHT.inc()
+    return time.monotonic()
+
+def request_done(start, request, action='', pool='', status=0):
+    """Record a completed request, started at start"""
+    REQUESTS_INFLIGHT.dec()
+    REQUESTS.inc(1, request, action, pool, status)
+    REQUEST_SECONDS.observe(time.monotonic() - start, request, action, pool)
+
+def checksum_done(nbytes, seconds, source='rados'):
+    """Record a file checksum computed from nbytes read from the source backend, in seconds"""
+    if source == 'rados':
+        RADOS_READ_BYTES.inc(nbytes)
+    CHECKSUM_BYTES.inc(nbytes)
+    CHECKSUM_SECONDS.inc(seconds)
+    if seconds > 0:
+        CHECKSUM_THROUGHPUT.observe(nbytes / seconds / 1e6)
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics: " + format % args)
+
+
+class MetricsExporter:
+    """Export the registry over http, on /metrics, and/or to a textfile (e.g. for the node_exporter textfile collector).
+
+    The textfile is rewritten every interval seconds, atomically by renaming a temporary file.
+    """
+    _instance = None
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = 'localhost', port: int = 0,
+                 textfile: str = None, interval: float = 15):
+        if MetricsExporter._instance is not None:
+            raise NotImplementedError('Singleton; use create method to instantiate')
+        self._registry = registry
+        self._textfile = textfile
+        self._interval = interval
+        self._stop = threading.Event()
+        self._httpd = None
+        if port > 0:
+            self._httpd = _MetricsServer((host, port), _MetricsHandler)
+            self._httpd.registry = registry
+            threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        if textfile:
+            threading.Thread(target=self._write_loop, daemon=True).start()
+        MetricsExporter._instance = self
+
+    @classmethod
+    def create(cls, registry: Registry = REGISTRY, host: str = 'localhost', port: int = 0,
+               textfile: str = None, interval: float = 15):
+        if cls._instance is not None:
+            raise NotImplementedError('Error, metrics exporter already created')
+        return cls(registry, host, port, textfile, interval)
+
+    def write_textfile(self):
+        tmpfile = f'{self._textfile}.{os.getpid()}.tmp'
+        with open(tmpfile, 'w') as f:
+            f.write(self._registry.exposition())
+        os.replace(tmpfile, self._textfile)
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.write_textfile()
+            except Exception:
+                logging.error(f"Failed to write metrics to {self._textfile}", exc_info=True)
+            self._stop.wait(self._interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._httpd is not None:
+            self._httpd.shutdown()
+
+    def __str__(self):
+        where = []
+        if self._httpd is not None:
+            where.append('http://{}:{}/metrics'.format(*self._httpd.server_address[:2]))
+        if self._textfile:
+            where.append(f'{self._textfile} every {self._interval}s')
+        return 'MetricsExporter: ' + ', '.join(where)
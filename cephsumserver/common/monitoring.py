@@ -7,6 +7,8 @@ from time import sleep
 
 import psutil 
 
+from . import metrics
+
 class Monitor:
     _instance = None
 
@@ -24,6 +26,7 @@ class Monitor:
         self._logger = logging.getLogger()
         self._monitorinterval = 300
         self._loginterval = 120
+        self._stats_sources = {}
 
         self._thread = threading.Thread(target=self._monitor)
         self._thread.setDaemon(True)
@@ -86,10 +89,35 @@ class Monitor:
         """Set the interval (in seconds) between monitoring updates"""
         self._monitorinterval = dt_s
 
+    def register_stats(self, name: str, source, label: str = None):
+        """Register a callable returning a dict of counters, to be included in the monitor log and metrics.
+
+        With label, the callable returns a dict of such dicts, by label value (e.g. per client); 
+        these are exported as gauges with the label.
+        """
+        self._stats_sources[name] = (source, label)
+        metrics.REGISTRY.register_collector(name, source, label)
+
+    def stats(self):
+        """Return dict of name: counters dict, for all registered sources; those with a label are flattened"""
+        values = {}
+        for name, (source, label) in list(self._stats_sources.items()):
+            try:
+                if label is None:
+                    values[name] = source()
+                else:
+                    values[name] = {f'{label}{value}_{k}':v for value, group in source().items() for k, v in group.items()}
+            except Exception:
+                self._logger.debug(f"Monitor: failed to get stats for {name}", exc_info=True)
+        return values
+
     def _log(self):
         while not self._stoplog.is_set():
             uptime = (datetime.datetime.utcnow() - self._starttime).total_seconds()
             self._logger.info(f'Monitor: uptime {uptime:.0f}. threads {self._n_threads} max {self._n_maxthreads}')
+            for name, values in self.stats().items():
+                txt = ', '.join(f'{k} {v}' for k,v in values.items())
+                self._logger.info(f'Monitor: {name} {txt}')
             sleep(self._loginterval)
 
     def dump(self):
@@ -1,7 +1,9 @@
 import logging
+import multiprocessing
 import threading
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
  
 Response = namedtuple("Response", "status response error")
 
@@ -12,6 +14,12 @@ class RequestHandler():
         """Start the work"""
         self._response = None
         self._ready = threading.Event()
+        self._callbacks = []
+        self._callback_lock = threading.Lock()
+        # intermediate results, sent before the final response
+        self._results = deque()
+        self._result_callbacks = []
+        self._updated = threading.Event()
         # self._cancel = threading.Event()
     
     def start(self):
@@ -38,19 +46,341 @@ class RequestHandler():
 
     def set_response(self,res):
         self._response = res
-        self._ready.set()
+        with self._callback_lock:
+            first = not self._ready.is_set()
+            self._ready.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._updated.set()
+        if first:
+            for fn in callbacks:
+                self._run_callback(fn)
+
+    def add_done_callback(self, fn):
+        """Call fn(handler) once the response is set; immediately if already set.
+        Callbacks run in the thread that sets the response, so should not block.
+        """
+        with self._callback_lock:
+            if not self._ready.is_set():
+                self._callbacks.append(fn)
+                return
+        self._run_callback(fn)
+
+    def _run_callback(self, fn, *args):
+        try:
+            fn(self, *args)
+        except Exception:
+            logging.error("Exception in response callback", exc_info=True)
+
+    def post_result(self, result: dict):
+        """Post an intermediate result, to be sent to the client ahead of the final response.
+
+        Results are passed to any result callbacks; if there are none, they are queued for pop_results.
+        """
+        with self._callback_lock:
+            callbacks = list(self._result_callbacks)
+            if not callbacks:
+                self._results.append(result)
+        self._updated.set()
+        for fn in callbacks:
+            self._run_callback(fn, result)
+
+    def add_result_callback(self, fn):
+        """Call fn(handler, result) for each intermediate result posted from now on"""
+        with self._callback_lock:
+            self._result_callbacks.append(fn)
+
+    def pop_results(self):
+        """Return, and remove, the queued intermediate results"""
+        with self._callback_lock:
+            results = list(self._results)
+            self._results.clear()
+        return results
+
+    def wait_update(self, timeout=None):
+        """Block until an intermediate result is posted or the response is set, or the timeout.
+        Returns True if there was an update, False on timeout.
+        """
+        updated = self._updated.wait(timeout=timeout)
+        self._updated.clear()
+        return updated
         
 
+class SingleFlight():
+    """Coalesce concurrent identical requests, so that only one does the work.
+
+    The first handler to join with a key is the leader, and performs the request.
+    Handlers joining with the same key while it is in flight are attached to it,
+    and are given the same response when the leader completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def join(self, key, handler) -> bool:
+        """Returns True if handler is the leader for key, else it is attached to the in-flight request"""
+        with self._lock:
+            followers = self._inflight.get(key)
+            if followers is None:
+                self._inflight[key] = []
+                return True
+            followers.append(handler)
+        logging.debug(f"Coalesced request {key} with in-flight request; {len(followers)} waiting")
+        return False
+
+    def complete(self, key, response):
+        """Called by the leader with its response; passes it to all attached handlers"""
+        with self._lock:
+            followers = self._inflight.pop(key, [])
+        for handler in followers:
+            handler.set_response(response)
+
+    def inflight(self):
+        """Number of distinct requests in flight"""
+        with self._lock:
+            return len(self._inflight)
+
+
+class ExecutionEngine():
+    """Shared, bounded pools of threads to run the blocking work of requests.
+
+    Work is submitted to a named lane, each with its own independently sized pool and queue, 
+    so that e.g. quick metadata lookups are not held up behind full file reads.
+    """
+    _instance = None
+
+    FAST = 'fast'
+    SLOW = 'slow'
+
+    def __init__(self, lanes: dict):
+        if ExecutionEngine._instance is not None:
+            raise NotImplementedError('Singleton; use create method to instantiate')
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._queued = {}
+        self._running = {}
+        self._completed = {}
+        for name, max_workers in lanes.items():
+            self._lanes[name] = ThreadPoolExecutor(max_workers=max(1, max_workers))
+            self._queued[name] = 0
+            self._running[name] = 0
+            self._completed[name] = 0
+        logging.info("Created execution lanes: {}".format(', '.join(f'{k}:{v}' for k,v in lanes.items())))
+        ExecutionEngine._instance = self
+
+    @classmethod
+    def create(cls, lanes: dict):
+        if cls._instance is not None:
+            raise NotImplementedError('Error, engine already created')
+        return cls(lanes)
+
+    @classmethod
+    def engine(cls):
+        """Return the singleton instance, or None if not created"""
+        return cls._instance
+
+    def submit(self, lane, fn, *args):
+        """Queue fn(*args) to run in the lane; unknown lanes use the slow lane"""
+        if lane not in self._lanes:
+            lane = self.SLOW
+        with self._lock:
+            self._queued[lane] += 1
+        return self._lanes[lane].submit(self._run, lane, fn, *args)
+
+    def _run(self, lane, fn, *args):
+        with self._lock:
+            self._queued[lane] -= 1
+            self._running[lane] += 1
+        try:
+            return fn(*args)
+        except Exception:
+            logging.error(f"Exception in {lane} lane", exc_info=True)
+        finally:
+            with self._lock:
+                self._running[lane] -= 1
+                self._completed[lane] += 1
+
+    def queue_depth(self, lane):
+        """Number of submitted tasks not yet started in the lane"""
+        with self._lock:
+            return self._queued[lane]
+
+    def stats(self):
+        """Return dict of the queued, running and completed counts per lane"""
+        with self._lock:
+            values = {}
+            for lane in self._lanes:
+                values[f'{lane}_queued'] = self._queued[lane]
+                values[f'{lane}_running'] = self._running[lane]
+                values[f'{lane}_completed'] = self._completed[lane]
+            return values
+
+    def shutdown(self):
+        for executor in self._lanes.values():
+            executor.shutdown(wait=False)
+
+
 class ThreadedRequestHandler(RequestHandler):
+    """Request whose blocking work, in run, is done in a separate thread.
+
+    Subclasses override prepare, for any quick non-blocking checks, and run, for the blocking work.
+    start runs both, with run in the lane of the ExecutionEngine given by lane (or in a new thread
+    if no engine is created); servers with their own executor may instead call prepare, 
+    and then run_guarded in one of their threads, only if prepare returned True.
+    If the work raises before setting the response, a failed response is set, so the client is answered.
+    """
     def __init__(self):
         super().__init__()
 
     def start(self):
-        # self._thread = threading.Thread(target=worker, args=(self.set_response, self._args, self._kwargs))
-        # self._thread.setDaemon(True)
-        # self._thread.start()
+        if not self.prepare():
+            return
+        self.submit(self.lane(), self.run)
+
+    def lane(self):
+        """The ExecutionEngine lane to run in; the fast lane unless overridden"""
+        return ExecutionEngine.FAST
+
+    def submit(self, lane, fn):
+        """Run fn in the given lane of the ExecutionEngine, or a new thread if there is no engine"""
+        engine = ExecutionEngine.engine()
+        if engine is not None:
+            engine.submit(lane, self.run_guarded, fn)
+            return
+        self._thread = threading.Thread(target=self.run_guarded, args=(fn,), daemon=True)
+        self._thread.start()
+
+    def run_guarded(self, fn=None):
+        """Call fn (by default run); if it raises, log it, and set a failed response unless already set"""
+        try:
+            (fn or self.run)()
+        except Exception as e:
+            logging.error(f"Exception in request {type(self).__name__}", exc_info=True)
+            if not self.is_ready():
+                self.set_response(Response(1, {}, {'error':str(e)}))
+
+    def prepare(self) -> bool:
+        """Returns True if run should be called; False if the response is already set, or will be set elsewhere"""
+        return True
+
+    def run(self):
+        """The blocking work of the request, which must set the response"""
         self.set_response({})
 
+class ProcessEngine():
+    """Pool of child processes, to run the heavy work of requests away from the server process.
+
+    Jobs are module level functions and their (small, picklable) arguments; each child runs 
+    initializer(*initargs) once when started, e.g. to connect its own rados client.
+    Only the actions given are run in the processes; others remain in the ExecutionEngine threads.
+    """
+    _instance = None
+
+    def __init__(self, processes: int, actions=(), initializer=None, initargs=()):
+        if ProcessEngine._instance is not None:
+            raise NotImplementedError('Singleton; use create method to instantiate')
+        self._processes = max(1, processes)
+        self._actions = set(actions)
+        # spawn, rather than fork, so children do not inherit the threads and connections of the server
+        context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(self._processes, initializer=initializer, initargs=initargs)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        logging.info(f"Created process engine with {self._processes} processes, for actions: {', '.join(sorted(self._actions))}")
+        ProcessEngine._instance = self
+
+    @classmethod
+    def create(cls, processes: int, actions=(), initializer=None, initargs=()):
+        if cls._instance is not None:
+            raise NotImplementedError('Error, process engine already created')
+        return cls(processes, actions, initializer, initargs)
+
+    @classmethod
+    def engine(cls):
+        """Return the singleton instance, or None if not created"""
+        return cls._instance
+
+    def runs(self, action) -> bool:
+        """True if the action should be run in the process engine"""
+        return action in self._actions
+
+    def submit(self, fn, args, callback, error_callback):
+        """Run fn(*args) in a child process; callback(result) or error_callback(exception) is 
+        called in a thread of the server process when it completes, so should not block.
+        """
+        with self._lock:
+            self._running += 1
+        def done(result):
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+            callback(result)
+        def failed(e):
+            with self._lock:
+                self._running -= 1
+                self._failed += 1
+            error_callback(e)
+        self._pool.apply_async(fn, args, callback=done, error_callback=failed)
+
+    def stats(self):
+        """Return dict of the submitted but unfinished, completed and failed job counts"""
+        with self._lock:
+            return {'processes':self._processes, 'jobs_running':self._running, 
+                    'jobs_completed':self._completed, 'jobs_failed':self._failed}
+
+    def shutdown(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
 class MultiProcessingRequestHandler(RequestHandler):
+    """Request whose heavy work is run in a child process of the ProcessEngine.
+
+    Subclasses override prepare, as for ThreadedRequestHandler, job, to give the work to run,
+    and on_result, to set the response from its result.
+    """
     def __init__(self):
+        super().__init__()
+
+    def start(self):
+        if not self.prepare():
+            return
+        self.submit_job(*self.job())
+
+    def prepare(self) -> bool:
+        """Returns True if the job should be run; False if the response is already set, or will be set elsewhere"""
+        return True
+
+    def job(self):
+        """Return tuple of (function, args) to run in the child process; the function must be module level"""
         raise NotImplementedError()
+
+    def submit_job(self, fn, args):
+        """Run fn(*args) in the ProcessEngine, calling on_result, or on_error, when done"""
+        engine = ProcessEngine.engine()
+        if engine is None:
+            raise RuntimeError('Process engine not created')
+        engine.submit(fn, args, self._job_done, self._job_failed)
+
+    def _job_done(self, result):
+        try:
+            self.on_result(result)
+        except Exception as e:
+            logging.error("Exception handling job result", exc_info=True)
+            self.set_response(Response(1, {}, {'error':str(e)}))
+
+    def _job_failed(self, e):
+        try:
+            self.on_error(e)
+        except Exception:
+            logging.error("Exception handling job error", exc_info=True)
+            self.set_response(Response(1, {}, {'error':str(e)}))
+
+    def on_result(self, result):
+        self.set_response(Response(0, {'response':result}, {}))
+
+    def on_error(self, e):
+        logging.warning(f"Job failed: {e}")
+        self.set_response(Response(1, {}, {'error':str(e)}))
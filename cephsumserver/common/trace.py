@@ -0,0 +1,117 @@
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+class Trace:
+    """Durations of the phases of a request, and the bytes and stripes it read.
+
+    A phase entered more than once accumulates its time. The trace is made current for a thread
+    with activate, while the request runs there; the module level functions then record into it,
+    and do nothing if no trace is current.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.end = None
+        self.phases = {}
+        self.bytes_read = 0
+        self.stripes_read = 0
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.) + seconds
+
+    def duration(self, name: str) -> float:
+        return self.phases.get(name, 0.)
+
+    def record_read(self, nbytes: int, stripes: int = 0):
+        self.bytes_read += nbytes
+        self.stripes_read += stripes
+
+    def finish(self):
+        """Mark the end of the request; returns False if already finished"""
+        if self.end is not None:
+            return False
+        self.end = time.monotonic()
+        return True
+
+    def elapsed(self) -> float:
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    def as_dict(self):
+        """Return dict of the total and per-phase durations, in ms, and the bytes and stripes read"""
+        return {'total_ms':round(1000. * self.elapsed(), 3),
+                'phases_ms':{name:round(1000. * seconds, 3) for name, seconds in self.phases.items()},
+                'bytes_read':self.bytes_read, 'stripes_read':self.stripes_read}
+
+
+_local = threading.local()
+# requests taking longer than this, in seconds, are logged with their trace; None to disable
+_slow_threshold = None
+
+
+def set_slow_threshold(seconds):
+    """Log the trace of requests taking longer than seconds; None or <= 0 disables"""
+    global _slow_threshold
+    _slow_threshold = seconds if seconds is not None and seconds > 0 else None
+
+def current():
+    """Return the trace active in this thread, or None"""
+    return getattr(_local, 'trace', None)
+
+@contextmanager
+def activate(trace: Trace):
+    """Make trace the current one for this thread, for the duration of the block"""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+@contextmanager
+def phase(name: str):
+    """Add the duration of the block to the phase of the current trace"""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        trace.add(name, time.monotonic() - start)
+
+def timed(iterable, name: str):
+    """Yield from iterable, adding the time spent waiting for each item to the phase of the current trace"""
+    trace = current()
+    if trace is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.monotonic()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            trace.add(name, time.monotonic() - start)
+            return
+        trace.add(name, time.monotonic() - start)
+        yield item
+
+def record_read(nbytes: int, stripes: int = 0):
+    """Add to the bytes and stripes read by the current trace"""
+    trace = current()
+    if trace is not None:
+        trace.record_read(nbytes, stripes)
+
+def log_if_slow(trace: Trace, **fields):
+    """Write the trace as a single json log line, with fields, if the request was slower than the threshold"""
+    if _slow_threshold is None or trace.elapsed() < _slow_threshold:
+        return
+    record = dict(fields)
+    record.update(trace.as_dict())
+    logging.warning('Slow request: ' + json.dumps(record, sort_keys=True))
@@ -9,10 +9,13 @@ import time
 
 import cephsumserver
 
-from cephsumserver.common import monitoring
+from cephsumserver.common import monitoring, trace
+from cephsumserver.common.cache import ChecksumCache
+from cephsumserver.common.membudget import MemoryBudget
+from cephsumserver.common.metrics import MetricsExporter
+from cephsumserver.common.requestmanager import ExecutionEngine, ProcessEngine
 
-from cephsumserver.server import reqserver
-from cephsumserver.backend import radospool
+from cephsumserver.server.keepalive import KeepaliveSchedule
 from cephsumserver.backend.lfn2pfn import Lfn2PfnMapper
 
 def timetz(*args):
@@ -52,13 +55,14 @@ def register_actions(actions: str):
     """
     ac = [x.strip() for x in actions.split(',')]
 
-    from cephsumserver.workers import ping, wait, stat, cksum, handler
+    from cephsumserver.workers import ping, wait, stat, cksum, batch, handler
     from cephsumserver.common import requestmanager
 
     available_workers = {'ping':ping.Ping,
                         'wait':wait.Wait,
                         'stat':stat.Stat,
                         'cksum':cksum.Cksum,
+                        'cksumbatch':batch.CksumBatch,
                         }
     handler.register_workers({k:v for k,v in available_workers.items() if k in ac})
 
@@ -75,15 +79,26 @@ def create_parseargs():
                         help='location of the ceph keyring file, if different from default')
     parser.add_argument('--cephuser',default='client.xrootd', 
                         help='ceph user name for the client keyring')
+    parser.add_argument('--backend',default=None,choices=['rados','sim'],
+                        help='rados for the ceph cluster, or sim for a simulated cluster (configured by the sim options of the CEPH config section)')
 
     parser.add_argument('--host',help='host address',dest='host',type=str, default="localhost")
     parser.add_argument('--port',help='host port',dest='port',type=int, default=6000)
 
+    parser.add_argument('--servermode',help='Server implementation: threaded (a thread per connection) or asyncio',
+                        dest='servermode',default=None,choices=['threaded','asyncio'])
+
     parser.add_argument('-s','--secrets',help='File containing the authorisation key',dest='secretsfile',default=None)
 
 
     parser.add_argument('-r','--readsize',help='Set the readsize in MiB for each chunk of data. Should be a power of 2, and near (but not larger than) the stripe size. Smaller values wll use less memory, larger sizes may have benefits in IO performance.',
                         dest='readsize',default=None,type=int)
+    parser.add_argument('-p','--parallel-reads',help='Number of stripe reads kept in flight in parallel when checksumming a file. 1 reads the stripes sequentially. Memory use is up to this value times the readsize.',
+                        dest='parallel_reads',default=None,type=int)
+    parser.add_argument('--readahead',help='Number of readsize buffers used to read ahead when stripes are read sequentially (e.g. 2 for double buffering). 0 disables read-ahead.',
+                        dest='readahead',default=None,type=int)
+    parser.add_argument('--stripe-manifest',help='Store a per-stripe checksum manifest when computing checksums from file, to allow stripe level verification.',
+                        dest='stripe_manifest',action='store_true')
 
     parser.add_argument('--default-checksum',help='If no checksum algorithm requested, what is the default',
                         dest='default_checksum',default='adler32')
@@ -108,6 +123,15 @@ def main():
     host = config['APP'].get('host', args.host)
     port = config['APP'].getint('port', args.port)
     secretsfile = args.secretsfile if args.secretsfile else config['APP'].get('secretsfile')
+    servermode = (args.servermode if args.servermode else config['APP'].get('servermode', 'threaded')).lower()
+    keepalive = KeepaliveSchedule(delay=config['APP'].getfloat('keepalivedelay', 5),
+                                  interval=config['APP'].getfloat('keepaliveinterval', 2),
+                                  backoff=config['APP'].getfloat('keepalivebackoff', 2),
+                                  max_interval=config['APP'].getfloat('keepalivemax', 16))
+    metricsport = max(0, config['APP'].getint('metricsport', 0))
+    metricshost = config['APP'].get('metricshost', 'localhost')
+    metricsfile = config['APP'].get('metricsfile', None)
+    metricsinterval = max(1, config['APP'].getfloat('metricsinterval', 15))
 
     if args.debug:
         loglevel = "DEBUG"
@@ -127,22 +151,85 @@ def main():
 
     lfn2pfn_file = config['CEPHSUM'].get('lfn2pfn', args.lfn2pfn_xmlfile)
     readsize  = max(1, config['CEPHSUM'].getint('readsize', args.readsize) * 1024**2)
+    parallel_reads = max(1, args.parallel_reads if args.parallel_reads else config['CEPHSUM'].getint('parallelreads', 1))
+    readahead = max(0, args.readahead if args.readahead is not None else config['CEPHSUM'].getint('readahead', 0))
+    stripe_manifest = args.stripe_manifest or config['CEPHSUM'].getboolean('stripemanifest', False)
+    readbudget = max(0, config['CEPHSUM'].getint('readbudget', 2048) * 1024**2)
+    cachesize = max(0, config['CEPHSUM'].getint('cachesize', 0))
+    cachettl  = max(0, config['CEPHSUM'].getfloat('cachettl', 60))
+    fastlanethreads = max(1, config['CEPHSUM'].getint('fastlanethreads', 16))
+    slowlanethreads = max(1, config['CEPHSUM'].getint('slowlanethreads', 4))
+    processes = max(0, config['CEPHSUM'].getint('processes', 0))
+    processactions = [x.strip().lower() for x in config['CEPHSUM'].get('processactions', 'fileonly,verify,verifystripes').split(',')
+                      if x.strip()]
     default_cksalg = config['CEPHSUM'].get('default_checksum', args.default_checksum)
+    slowrequest = config['CEPHSUM'].getfloat('slowrequest', 30)
 
 
     cephconf = config['CEPH'].get('cephconf', args.cephconf)
     keyring  = config['CEPH'].get('keyring', args.keyring)
     cephuser = config['CEPH'].get('cephuser', args.cephuser)
+    backend  = (args.backend if args.backend else config['CEPH'].get('backend', 'rados')).lower()
 
     # server start message
     logging.info("="*80)
     logging.info("Starting cephsum server: {hostname}".format(hostname=socket.getfqdn()))
     logging.info("\tVersion: {version}".format(version=cephsumserver.__version__))
 
+    # the simulated cluster stands in for rados; it must be installed before the modules using rados are imported
+    simmodel = None
+    if backend == 'sim':
+        from cephsumserver.backend import simrados
+        simmodel = simrados.install(simrados.SimModel.from_config(config['CEPH']))
+        logging.warning("Running against a simulated rados cluster")
+        logging.info(str(simmodel))
+    from cephsumserver.server import reqserver, aioserver
+    from cephsumserver.backend import radospool, procworker
+
 
 
     # monitoring: begin the monitoring
     m = monitoring.Monitor.create()
+    if simmodel is not None:
+        m.register_stats('sim', simmodel.stats)
+    # log the phase timings of requests slower than this
+    trace.set_slow_threshold(slowrequest)
+
+    # metrics export, over http and/or to a textfile; disabled if neither is set
+    if metricsport > 0 or metricsfile:
+        exporter = MetricsExporter.create(host=metricshost, port=metricsport, 
+                                          textfile=metricsfile, interval=metricsinterval)
+        logging.info(str(exporter))
+
+    # checksum result cache; disabled if the size is 0
+    if cachesize > 0:
+        ckscache = ChecksumCache.create(max_size=cachesize, ttl=cachettl)
+        m.register_stats('cache', ckscache.stats)
+        logging.info(str(ckscache))
+
+    # limit on the memory held in read buffers, over all requests; disabled if 0
+    if readbudget > 0:
+        budget = MemoryBudget.create(readbudget)
+        m.register_stats('readbudget', budget.stats)
+        logging.info(str(budget))
+
+    # bounded execution lanes for the requests: metadata and stat in the fast lane, file reads in the slow lane
+    engine = ExecutionEngine.create({ExecutionEngine.FAST:fastlanethreads, ExecutionEngine.SLOW:slowlanethreads})
+    m.register_stats('lanes', engine.stats)
+
+    # child processes, each with its own rados client, for the heavy checksum actions; disabled if 0
+    procengine = None
+    if processes > 0:
+        config_pars = {'conffile':cephconf, 'keyring':keyring, 'name':cephuser}
+        loglevel = logging.getLogger().getEffectiveLevel()
+        if simmodel is not None:
+            # each child installs its own simulated cluster, from the same options
+            initializer, initargs = simrados.init_worker, (dict(config['CEPH']), config_pars, loglevel)
+        else:
+            initializer, initargs = procworker.init_worker, (config_pars, loglevel)
+        procengine = ProcessEngine.create(processes, actions=processactions,
+                                          initializer=initializer, initargs=initargs)
+        m.register_stats('processes', procengine.stats)
 
     # register actions; default is just the checksum
     register_actions(config['CEPHSUM'].get('actions','cksum'))
@@ -151,29 +238,52 @@ def main():
     # do we have name-to-name mapping to do?
     lfnmapping = None
     if lfn2pfn_file:
-        lfnmapping = Lfn2PfnMapper.from_file(lfn2pfn_file)
+        lfnmapping = Lfn2PfnMapper.from_file(lfn2pfn_file, 
+                                             memo_size=max(0, config['CEPHSUM'].getint('lfn2pfnmemo', 10000)))
 
-    # pool size info; and limit to 5 max
+    # pool size info; the pool grows from min to max clients as needed
     maxpoolsize = max(1, args.maxpoolsize if args.maxpoolsize else config['CEPHSUM'].getint('maxpoolsize', 5))
-    if maxpoolsize > 5:
-        logging.warning("Max poolsize was {}; restricting to 5".format(maxpoolsize))
-        maxpoolsize = 5
+    minpoolsize = min(maxpoolsize, max(1, config['CEPHSUM'].getint('minpoolsize', 1)))
+    healthinterval = max(0, config['CEPHSUM'].getfloat('healthinterval', 30))
+    poolidletimeout = max(0, config['CEPHSUM'].getfloat('poolidletimeout', 300))
+    ioctxidletimeout = max(0, config['CEPHSUM'].getfloat('ioctxidletimeout', 60))
+    # seconds a single rados call (e.g. the read of one object) may take before its client is replaced
+    optimeout = max(0, config['CEPHSUM'].getfloat('optimeout', 300))
 
     # create the singleton rados pool
     p = radospool.RadosPool.create(max_size=maxpoolsize, 
                                    lfn2pfn = lfnmapping,
                                    readsize = readsize,
+                                   parallel_reads = parallel_reads,
+                                   readahead = readahead,
+                                   stripe_manifest = stripe_manifest,
+                                   min_size = minpoolsize,
+                                   health_interval = healthinterval,
+                                   idle_timeout = poolidletimeout,
+                                   op_timeout = optimeout,
+                                   ioctx_idle_timeout = ioctxidletimeout,
                         config_pars={'conffile':cephconf, 'keyring':keyring, 'name':cephuser})
+    m.register_stats('radospool', p.stats)
+    m.register_stats('radosclient', p.client_stats, label='client')
+
+    logging.info(str(keepalive))
 
     # now start up the TCP server that will handle the incomming connections
     # this calls server_forever, until it is killed ... 
     try:
-        reqserver.start_server(address=(host, port), 
-                               authkeyfile=secretsfile)
+        if servermode == 'asyncio':
+            aioserver.start_server(address=(host, port), 
+                                   authkeyfile=secretsfile,
+                                   keepalive=keepalive)
+        else:
+            reqserver.start_server(address=(host, port), 
+                                   authkeyfile=secretsfile,
+                                   keepalive=keepalive)
     except KeyboardInterrupt:
         pass
     finally:
-        pass
+        if procengine is not None:
+            procengine.shutdown()
     logging.info("Server shutdown, terminating")
 
 
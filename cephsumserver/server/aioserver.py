@@ -0,0 +1,230 @@
+import asyncio
+import logging
+
+from collections import deque
+
+from . import auth
+from . import message
+from .keepalive import KeepaliveSchedule
+from .reqserver import SESSION_VERSIONS, MULTIPLEXED_VERSIONS, response_message, result_message
+from ..workers import handler
+from ..backend import radospool
+from ..common.requestmanager import ThreadedRequestHandler, ExecutionEngine
+
+
+def _set_done(future, response, updated):
+    if not future.done():
+        future.set_result(response)
+    updated.set()
+
+
+def _post_result(results, updated, result):
+    results.append(result)
+    updated.set()
+
+
+class AsyncRequestServer:
+    """asyncio based alternative to the ThreadedTCPServer.
+
+    All connections are served from a single event loop, using the same workers and message
+    framing as the threaded server, and supporting the same protocol versions.
+    The blocking part of each request runs in the lanes of the ExecutionEngine, as in the threaded
+    server, so waiting clients do not need a thread each. Without an engine (e.g. in tests), it runs
+    in the default executor of the event loop.
+    """
+    def __init__(self, authkey, wait_timeout=30, keepalive=None):
+        self.authkey = authkey
+        self.wait_timeout = wait_timeout
+        self.keepalive = keepalive if keepalive is not None else KeepaliveSchedule()
+
+    async def handle_client(self, reader, writer):
+        """Authenticate the client, and serve its requests according to the protocol version"""
+        try:
+            await auth.deliver_challenge_async(reader, writer, authkey=self.authkey)
+        except (auth.AuthenticationError, ConnectionError):
+            writer.close()
+            return
+        logging.info(f"Client connected, {writer.get_extra_info('peername')}")
+
+        try:
+            msg = await message.recv_async(reader)
+            logging.debug("{}".format(msg))
+            if not 'msg' in msg:
+                logging.warning("Ill formed client message")
+                return
+            connection = _AsyncConnection(self, reader, writer, msg.get('ver', 'v1'), message.negotiate(msg))
+            await connection.serve(msg)
+        except (ConnectionError, OSError):
+            logging.warning("Connection lost")
+        finally:
+            writer.close()
+
+    def start_request(self, msg):
+        """Create and start the worker for msg.
+
+        Returns tuple of (future, results, updated); the future is completed with the handler 
+        when its response is set, intermediate results are appended to the results deque, 
+        and the updated event is set on either.
+        """
+        loop = asyncio.get_event_loop()
+        response = handler.worker(msg)
+        done = loop.create_future()
+        results = deque()
+        updated = asyncio.Event()
+        response.add_result_callback(lambda r, result: loop.call_soon_threadsafe(_post_result, results, updated, result))
+        response.add_done_callback(lambda r: loop.call_soon_threadsafe(_set_done, done, r, updated))
+        if isinstance(response, ThreadedRequestHandler) and ExecutionEngine.engine() is None:
+            if response.prepare():
+                loop.run_in_executor(None, response.run_guarded)
+        else:
+            response.start()
+        return done, results, updated
+
+
+class _AsyncConnection:
+    """A single authenticated client connection to the AsyncRequestServer"""
+
+    def __init__(self, server, reader, writer, ver, enc=message.JSON):
+        self._server = server
+        self._reader = reader
+        self._writer = writer
+        self._ver = ver
+        self._enc = enc
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, msg):
+        async with self._send_lock:
+            await message.send_async(self._writer, msg, self._enc)
+
+    async def serve(self, msg):
+        if self._ver in MULTIPLEXED_VERSIONS:
+            await self.serve_multiplexed(msg)
+        elif self._ver in SESSION_VERSIONS:
+            await self.serve_session(msg)
+        elif await self.serve_request(msg):
+            # signal end of messages
+            await self.send(None)
+
+    async def serve_session(self, msg):
+        """Serve requests one after the other, until the sentinel is received"""
+        while await self.serve_request(msg):
+            msg = await message.recv_async(self._reader)
+            logging.debug("{}".format(msg))
+            if not msg or not 'msg' in msg:
+                break
+        await self.send(None)
+
+    async def serve_multiplexed(self, msg):
+        """Start each request as it is received, and answer each when it completes, tagged with its id.
+
+        As in the threaded server, a request with the id of a request still in flight is rejected.
+        If the connection is lost, whether receiving or sending, the requests in flight are cancelled.
+        """
+        tasks = {} # request id: task serving it
+        try:
+            while True:
+                request_id = msg.get('id')
+                if request_id is None:
+                    await self.fail_request('Missing request id')
+                elif request_id in tasks:
+                    await self.fail_request('Duplicate request id', request_id)
+                else:
+                    task = asyncio.ensure_future(self.serve_request(msg, request_id))
+                    tasks[request_id] = task
+                    task.add_done_callback(lambda t, request_id=request_id: tasks.pop(request_id, None))
+                msg = await message.recv_async(self._reader)
+                logging.debug("{}".format(msg))
+                if not msg or not 'msg' in msg:
+                    break
+            if tasks:
+                # raises on the first request failing to send, e.g. as the connection was lost
+                await asyncio.gather(*tasks.values())
+            await self.send(None)
+        finally:
+            for task in list(tasks.values()):
+                task.cancel()
+
+    async def serve_request(self, msg, request_id=None):
+        """Run a single request and send its response, with keep-alives while waiting.
+
+        Returns True if the connection can continue to be used, as per ThreadedTCPRequestHandler.
+        """
+        try:
+            done, results, updated = self._server.start_request(msg)
+        except Exception as e:
+            logging.warning(f"Could not run request: {e}")
+            return await self.fail_request('Request not valid', request_id)
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        progress = start
+        keepalive = self._server.keepalive.tracker()
+        while True:
+            timeout_left = self._server.wait_timeout - (loop.time() - progress)
+            try:
+                await asyncio.wait_for(updated.wait(), max(0, min(keepalive.remaining(), timeout_left)))
+                updated.clear()
+                progress = loop.time()
+                has_update = True
+            except asyncio.TimeoutError:
+                has_update = False
+            if results:
+                keepalive.sent()
+            while results:
+                await self.send(result_message(results.popleft(), self._ver, request_id))
+            if done.done():
+                response = done.result()
+                break
+            if has_update:
+                continue
+            dt = loop.time() - start
+            if loop.time() - progress >= self._server.wait_timeout:
+                logging.info("hit looping timeout")
+                return await self.fail_request('timeout', request_id, always_respond=True)
+            if keepalive.is_due():
+                alive = {'msg':'alive', 'dt':dt}
+                if request_id is not None:
+                    alive['id'] = request_id
+                logging.debug("Sending keep-alive message")
+                await self.send(alive)
+                keepalive.sent()
+
+        try:
+            msg = response_message(response.response(), self._ver, request_id)
+        except Exception as e:
+            logging.error(f"Caught exception {e}")
+            return await self.fail_request('Unknown error', request_id, always_respond=True)
+        await self.send(msg)
+        return True
+
+    async def fail_request(self, reason, request_id=None, always_respond=False):
+        """Send a failed response. Returns False if a v1 connection should end, else True"""
+        if self._ver not in SESSION_VERSIONS and not always_respond:
+            await self.send(None)
+            return False
+        msg = {'msg':'response', 'status_message':'failed', 'status':1, 'reason':reason, 'ver':self._ver}
+        if request_id is not None:
+            msg['id'] = request_id
+        await self.send(msg)
+        if self._ver not in SESSION_VERSIONS:
+            await self.send(None)
+            return False
+        return True
+
+
+def start_server(address, authkeyfile, keepalive=None):
+    authkey=auth.get_key(authkeyfile)
+    logging.info(f"Starting asyncio TCP server, listening on {address[0]}:{address[1]}")
+
+    server = AsyncRequestServer(authkey, keepalive=keepalive)
+    loop = asyncio.get_event_loop()
+    tcpserver = loop.run_until_complete(
+        asyncio.start_server(server.handle_client, address[0], address[1], reuse_address=True))
+    try:
+        # keep running until you interrupt the program with Ctrl-C
+        loop.run_forever()
+    finally:
+        logging.info("server_close")
+        tcpserver.close()
+        loop.run_until_complete(tcpserver.wait_closed())
+        radospool.RadosPool.pool().shutdown_all()
@@ -26,6 +26,26 @@ def deliver_challenge(connection, authkey):
         connection.sendall(FAILURE)
         raise AuthenticationError('digest received was wrong')
 
+async def deliver_challenge_async(reader, writer, authkey):
+    """As deliver_challenge, for an asyncio stream connection"""
+    if not isinstance(authkey, bytes):
+        raise ValueError(
+            "Authkey must be bytes, not {0!s}".format(type(authkey)))
+    message = os.urandom(MESSAGE_LENGTH)
+    assert len(message) == MESSAGE_LENGTH
+    writer.write(CHALLENGE + message)
+    await writer.drain()
+    digest = hmac.new(authkey, message, 'md5').digest()
+    response = await reader.read(256)        # reject large message
+    # digest, response
+    if response == digest:
+        writer.write(WELCOME)
+        await writer.drain()
+    else:
+        writer.write(FAILURE)
+        await writer.drain()
+        raise AuthenticationError('digest received was wrong')
+
 def answer_challenge(connection, authkey):
     if not isinstance(authkey, bytes):
         raise ValueError(
@@ -0,0 +1,148 @@
+"""Compact binary encoding of messages, as an alternative to json.
+
+Values are written as a one byte type tag followed by the value; the types are those
+that json supports, plus bytes. Strings in KEYS, the field names and values common to most
+messages, are written as a two byte reference into the table, rather than in full.
+The table is part of the encoding, so may only be appended to.
+"""
+import struct
+
+KEYS = ('msg', 'ver', 'id', 'status', 'status_message', 'details', 'reason', 'response', 'error',
+        'alive', 'dt', 'result', 'path', 'digest', 'action', 'algtype', 'OK', 'ERROR', 'failed',
+        'v1', 'v2', 'v3', 'cksum', 'stat', 'size', 'adler32', 'enc')
+_KEY_INDEX = {k: i for i, k in enumerate(KEYS)}
+assert len(KEYS) <= 256
+
+_INT = struct.Struct('>q')
+_FLOAT = struct.Struct('>d')
+_LEN = struct.Struct('>I')
+_MIN_INT = -(1 << 63)
+_MAX_INT = (1 << 63) - 1
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def dumps_into(buf: bytearray, value):
+    """Append the encoded value to buf"""
+    if value is None:
+        buf += b'N'
+    elif value is True:
+        buf += b'T'
+    elif value is False:
+        buf += b'F'
+    elif isinstance(value, int):
+        if 0 <= value < 256:
+            buf += b'u'
+            buf.append(value)
+        elif _MIN_INT <= value <= _MAX_INT:
+            buf += b'i'
+            buf += _INT.pack(value)
+        else:
+            data = str(value).encode('ascii')
+            buf += b'I'
+            buf += _LEN.pack(len(data))
+            buf += data
+    elif isinstance(value, float):
+        buf += b'd'
+        buf += _FLOAT.pack(value)
+    elif isinstance(value, str):
+        index = _KEY_INDEX.get(value)
+        if index is not None:
+            buf += b'k'
+            buf.append(index)
+        else:
+            data = value.encode('utf8')
+            buf += b's'
+            buf += _LEN.pack(len(data))
+            buf += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        buf += b'y'
+        buf += _LEN.pack(len(value))
+        buf += value
+    elif isinstance(value, dict):
+        buf += b'm'
+        buf += _LEN.pack(len(value))
+        for k, v in value.items():
+            dumps_into(buf, str(k))
+            dumps_into(buf, v)
+    elif isinstance(value, (list, tuple)):
+        buf += b'l'
+        buf += _LEN.pack(len(value))
+        for v in value:
+            dumps_into(buf, v)
+    else:
+        raise TypeError(f"Object of type {type(value).__name__} cannot be encoded")
+
+
+def dumps(value) -> bytearray:
+    buf = bytearray()
+    dumps_into(buf, value)
+    return buf
+
+
+def loads(data):
+    """Decode a value from a bytes-like object, which must contain exactly one encoded value"""
+    view = memoryview(data)
+    try:
+        value, pos = _load(view, 0)
+    except (IndexError, struct.error, RecursionError) as e:
+        raise DecodeError(f"Truncated message: {e}")
+    if pos != len(view):
+        raise DecodeError(f"{len(view) - pos} trailing bytes in message")
+    return value
+
+
+def _load(view, pos):
+    tag = view[pos]
+    pos += 1
+    if tag == 0x6b: # k
+        return KEYS[view[pos]], pos + 1
+    if tag == 0x73: # s
+        n, = _LEN.unpack_from(view, pos)
+        pos += 4
+        if pos + n > len(view):
+            raise DecodeError("String extends beyond message")
+        return str(view[pos:pos+n], 'utf8'), pos + n
+    if tag == 0x75: # u
+        return view[pos], pos + 1
+    if tag == 0x69: # i
+        return _INT.unpack_from(view, pos)[0], pos + 8
+    if tag == 0x64: # d
+        return _FLOAT.unpack_from(view, pos)[0], pos + 8
+    if tag == 0x6d: # m
+        n, = _LEN.unpack_from(view, pos)
+        pos += 4
+        value = {}
+        for _ in range(n):
+            k, pos = _load(view, pos)
+            value[k], pos = _load(view, pos)
+        return value, pos
+    if tag == 0x6c: # l
+        n, = _LEN.unpack_from(view, pos)
+        pos += 4
+        value = []
+        for _ in range(n):
+            v, pos = _load(view, pos)
+            value.append(v)
+        return value, pos
+    if tag == 0x4e: # N
+        return None, pos
+    if tag == 0x54: # T
+        return True, pos
+    if tag == 0x46: # F
+        return False, pos
+    if tag == 0x79: # y
+        n, = _LEN.unpack_from(view, pos)
+        pos += 4
+        if pos + n > len(view):
+            raise DecodeError("Bytes extend beyond message")
+        return bytes(view[pos:pos+n]), pos + n
+    if tag == 0x49: # I
+        n, = _LEN.unpack_from(view, pos)
+        pos += 4
+        if pos + n > len(view):
+            raise DecodeError("Integer extends beyond message")
+        return int(str(view[pos:pos+n], 'ascii')), pos + n
+    raise DecodeError(f"Unknown type tag {tag:#x} at {pos-1}")
@@ -0,0 +1,47 @@
+from time import monotonic
+
+
+class KeepaliveSchedule():
+    """When to send keep-alive messages to a client waiting on a request.
+
+    None are sent for the first delay seconds, so that quick requests are answered without any;
+    after that they are sent every interval seconds, growing by backoff after each, up to max_interval.
+    """
+
+    def __init__(self, delay=5, interval=2, backoff=2.0, max_interval=16):
+        self.delay = max(0., float(delay))
+        self.interval = max(0.1, float(interval))
+        self.backoff = max(1., float(backoff))
+        self.max_interval = max(self.interval, float(max_interval))
+
+    def __str__(self):
+        return (f"KeepaliveSchedule: delay {self.delay}s, interval {self.interval}s, "
+                f"backoff {self.backoff}, max interval {self.max_interval}s")
+
+    def tracker(self):
+        """Return a Keepalive to track the keep-alives of a request starting now"""
+        return Keepalive(self)
+
+
+class Keepalive():
+    """Track when the next keep-alive is due for one request, according to its schedule"""
+
+    def __init__(self, schedule: KeepaliveSchedule):
+        self._schedule = schedule
+        self._interval = None
+        self._due = monotonic() + schedule.delay
+
+    def remaining(self) -> float:
+        """Seconds until the next keep-alive is due; 0 if it is due now"""
+        return max(0., self._due - monotonic())
+
+    def is_due(self) -> bool:
+        return monotonic() >= self._due
+
+    def sent(self):
+        """Record that a message was sent to the client, and schedule the next keep-alive"""
+        if self._interval is None:
+            self._interval = self._schedule.interval
+        else:
+            self._interval = min(self._interval * self._schedule.backoff, self._schedule.max_interval)
+        self._due = monotonic() + self._interval
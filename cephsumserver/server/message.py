@@ -1,51 +1,121 @@
+import asyncio
 import json
 import socket
-from time import perf_counter
+import struct
 
-MAX_READ=4048
+from . import compact
 
-def send(sock, msg: dict):
+# message encodings; a client asks for an encoding other than json with the 'enc' field of its first request
+JSON = 'json'
+BINARY = 'bin'
+ENCODINGS = [JSON, BINARY]
+
+# the top bit of the length marks a frame with a binary encoded payload
+BINARY_FLAG = 0x80000000
+MAX_LENGTH = BINARY_FLAG - 1
+
+_HEADER = struct.Struct('>I')
+
+
+def negotiate(msg: dict) -> str:
+    """Return the encoding requested by the client in msg; json if none, or not supported"""
+    enc = msg.get('enc', JSON)
+    return enc if enc in ENCODINGS else JSON
+
+def send(sock, msg: dict, enc=JSON):
     """Send message via socket.
-    
-    The message sent consists of 4 bytes (big endian) int that corresponds to the 
+
+    The message sent consists of 4 bytes (big endian) int that corresponds to the
     size of the remaing part of the message.
-    The message itself if converted to json (utf8 and sent as bytes).
+    The message itself if converted to json (utf8 and sent as bytes), or for the binary
+    encoding, the compact format, with the top bit of the size set.
     In case no dict is passed in, it is assume a sentinal, and only 4 bytes of 0's is sent.
     """
+    # send the length and the message
+    sock.sendall(encode(msg, enc))
+
+def encode(msg: dict, enc=JSON) -> bytes:
+    """Return the bytes to send for the message, including the 4 byte length; None is the sentinal"""
     if msg is None:
         # sentinal
-        msg_length = int(0).to_bytes(4,'big')
-        sock.send(msg_length)
-    else:
-        msg = (json.dumps(msg)).encode('utf8')
-        msg_length = int(len(msg)).to_bytes(4,'big')
-        # send the length and the message
-        sock.sendall(msg_length+msg)
+        return bytes(4)
+    if enc == BINARY:
+        # encode directly after space reserved for the length, and fill that in afterwards
+        frame = bytearray(4)
+        compact.dumps_into(frame, msg)
+        _HEADER.pack_into(frame, 0, _check_length(len(frame) - 4) | BINARY_FLAG)
+        return frame
+    msg = (json.dumps(msg)).encode('utf8')
+    return b''.join((_HEADER.pack(_check_length(len(msg))), msg))
+
+def _check_length(length):
+    if length > MAX_LENGTH:
+        raise ValueError(f"Message of {length} bytes is too large to send")
+    return length
+
+def decode(data, binary=False) -> dict:
+    """Convert the message payload (without the 4 byte length) into a dict"""
+    if binary:
+        return compact.loads(data)
+    return json.loads(data)
+
+def _recv_into(sock, view, what):
+    """Fill the memoryview from the socket; raises ConnectionError if closed part way"""
+    bytes_read = 0
+    while bytes_read < len(view):
+        n = sock.recv_into(view[bytes_read:])
+        if n == 0:
+            raise ConnectionError(f"Connection closed after {bytes_read} of {len(view)} bytes of {what}")
+        bytes_read += n
 
 def recv(sock) -> dict:
-    """Receive the data via the socket. 
-    
-    First 4 bytes is an int (big endian) representing the size of the message 
-    (not including those 4 bytes). 
-    Data is read in chunks up to the expected size, and converted into a dict
+    """Receive the data via the socket.
 
+    First 4 bytes is an int (big endian) representing the size of the message
+    (not including those 4 bytes), and whether it is binary encoded.
+    The message is read directly into a buffer of the expected size, and converted into a dict.
+    Messages in either encoding are accepted.
     """
-
-    data = sock.recv(4)
-    msg_length = int.from_bytes(data,'big')
+    header = bytearray(4)
+    view = memoryview(header)
+    n = sock.recv_into(view)
+    if n == 0:
+        # connection closed, treated as the sentinal
+        return {}
+    if n < 4:
+        _recv_into(sock, view[n:], 'header')
+    msg_length, = _HEADER.unpack(header)
+    binary = bool(msg_length & BINARY_FLAG)
+    msg_length &= MAX_LENGTH
     if msg_length==0:
         # zero length message, so we are done
         return {}
 
-    data = b''
-    bytes_read=0
-    while bytes_read < msg_length:
-        tmp = sock.recv(min(MAX_READ, msg_length-bytes_read))
-        #tmp = inner_recv(sock, min(MAX_READ, msg_length-bytes_read), 5)
-        data += tmp
-        bytes_read += len(tmp)
-    assert bytes_read == msg_length
-
-    json1 = perf_counter()
-    msg = json.loads(data.decode('utf8'))
-    return msg
\ No newline at end of file
+    data = bytearray(msg_length)
+    _recv_into(sock, memoryview(data), 'message')
+    return decode(data, binary)
+
+async def send_async(writer, msg: dict, enc=JSON):
+    """Send message via an asyncio StreamWriter; as per send"""
+    writer.write(encode(msg, enc))
+    await writer.drain()
+
+async def recv_async(reader) -> dict:
+    """Receive a message via an asyncio StreamReader; as per recv.
+    A closed connection is treated as the sentinal.
+    """
+    try:
+        data = await reader.readexactly(4)
+    except asyncio.IncompleteReadError:
+        return {}
+    msg_length, = _HEADER.unpack(data)
+    binary = bool(msg_length & BINARY_FLAG)
+    msg_length &= MAX_LENGTH
+    if msg_length==0:
+        # zero length message, so we are done
+        return {}
+    try:
+        data = await reader.readexactly(msg_length)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError(f"Connection closed after {len(e.partial)} of {msg_length} bytes")
+    return decode(data, binary)
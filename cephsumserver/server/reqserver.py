@@ -3,6 +3,7 @@ import errno
 import hmac
 import os
 import json
+import queue
 import multiprocessing
 import logging
 import socket
@@ -13,17 +14,30 @@ from time import sleep, perf_counter
 
 from . import auth
 from . import message
+from .keepalive import KeepaliveSchedule
 from ..workers import handler
 from ..backend import radospool
 
 
+# protocol versions: v1 serves a single request per connection, 
+# v2 is a session, serving requests until the client sends the sentinel,
+# v3 is a multiplexed session, where requests carry an id and are served concurrently
+SESSION_VERSIONS = ['v2', 'v3']
+MULTIPLEXED_VERSIONS = ['v3']
+
+
 class ThreadedTCPRequestHandler(socketserver.StreamRequestHandler):
 
+    SESSION_VERSIONS = SESSION_VERSIONS
+    MULTIPLEXED_VERSIONS = MULTIPLEXED_VERSIONS
+
     def handle(self):
         """Primary method that the client communicates with the server. 
 
         This handler passes of work to the Worker, and awaits a respose, 
         or, triggers a timeout.
+        A v1 client sends one request; a v2 client may send a sequence of requests 
+        on the same authenticated connection, ending with the sentinel.
         """
 
         # authenticate the client first 
@@ -44,90 +58,347 @@ class ThreadedTCPRequestHandler(socketserver.StreamRequestHandler):
             self.request.close()
             return
 
+        ver = msg.get('ver', 'v1')
+        # the encoding of messages to the client, for the rest of the connection
+        self.enc = message.negotiate(msg)
+        if ver not in self.SESSION_VERSIONS:
+            if self.serve_request(msg, ver):
+                # send the final response
+                # signal end of messages
+                self.end_connection()
+            return
+
+        if ver in self.MULTIPLEXED_VERSIONS:
+            self.serve_multiplexed(msg, ver)
+            return
+
+        # session; keep serving requests until the sentinel (an empty message) is received
+        n_requests = 0
+        while self.serve_request(msg, ver):
+            n_requests += 1
+            try:
+                msg = message.recv(self.request)
+            except (ConnectionError, OSError):
+                logging.warning("Session connection lost")
+                return
+            logging.debug("{}".format(msg))
+            if not msg:
+                logging.debug(f"Session ended after {n_requests} requests")
+                self.end_connection()
+                return
+            if not 'msg' in msg:
+                logging.warning("Ill formed client message")
+                self.end_connection()
+                return
+
+    def serve_request(self, msg, ver='v1'):
+        """Run a single request and send its response.
+
+        Returns True if a response was sent and the connection can continue to be used.
+        On failure, v1 connections are ended, while for sessions an error response is sent.
+        """
         # depending on the request, generate the appropriate response
 
         try:
             response = handler.worker(msg)
-        except:
-            self.end_connection()
-            return 
+        except Exception as e:
+            logging.warning(f"Could not create worker for request: {e}")
+            return self.fail_request(ver, 'Request not valid')
 
         # start the worker to do whatever
         try:
             response.start()
         except Exception as e:
             logging.error(f"Error in request {e}")
-            self.end_connection()
-            return
+            return self.fail_request(ver, 'Request failed to start')
 
-        # wait for response to complete, and keep-alive the client
-        # abort on timeout
+        # wait for response to complete, passing on any intermediate results, and keep-alive the client
+        # on its schedule; abort on timeout, counted from the last progress of the request
         ct_start = datetime.datetime.utcnow()
-        timeout = datetime.timedelta(seconds=30)
-        while not response.is_ready(timeout=2):
-            dt = (datetime.datetime.utcnow() - ct_start)
-            if dt > self.server.wait_timeout:
+        ct_progress = ct_start
+        keepalive = self.server.keepalive.tracker()
+        while True:
+            timeout_left = (self.server.wait_timeout - (datetime.datetime.utcnow() - ct_progress)).total_seconds()
+            updated = response.wait_update(timeout=max(0, min(keepalive.remaining(), timeout_left)))
+            try:
+                results = response.pop_results()
+                for result in results:
+                    message.send(self.request, result_message(result, ver), self.enc)
+            except BrokenPipeError:
+                logging.warning(f"Broken pipe in looping")
+                return False
+            if response.is_ready():
+                break
+            now = datetime.datetime.utcnow()
+            if updated:
+                ct_progress = now
+                if results:
+                    keepalive.sent()
+                continue
+            dt = (now - ct_start)
+            if (now - ct_progress) >= self.server.wait_timeout:
                 logging.info("hit looping timeout")
                 message.send(self.request, {'msg':'response', 
                                          'status_message':'failed', 
-                             'status':1, 'reason':'timeout', 'ver':'v1'})
-                self.end_connection()
-                return 
+                             'status':1, 'reason':'timeout', 'ver':ver}, self.enc)
+                if ver not in self.SESSION_VERSIONS:
+                    self.end_connection()
+                    return False
+                return True
+            if not keepalive.is_due():
+                continue
             # send a keep-alive message
             try:
                 logging.debug("Sending keep-alive message")
-                message.send(self.request, {'msg':'alive', 'dt':dt.total_seconds()})
+                message.send(self.request, {'msg':'alive', 'dt':dt.total_seconds()}, self.enc)
+                keepalive.sent()
             except BrokenPipeError:
                 logging.warning(f"Broken pipe in looping")
-                return
+                return False
 
-        
         # if not finished but here, there has been a problem ... 
         if not response.is_ready(timeout=None):
             logging.error('How are we here?')
             self.end_connection()
-            return 
+            return False
 
         try: 
             resp = response.response()
         except Exception as e:
-            loggin.error("Caught exception", str(e) )
+            logging.error(f"Caught exception {e}")
             message.send(self.request, {'msg':'response', 
                             'status_message':'failed', 
-                'status':1, 'reason':'Unknown error', 'ver':'v1'})
+                'status':1, 'reason':'Unknown error', 'ver':ver}, self.enc)
             self.end_connection()
             # raise the exception, now the client connection is ended
             raise e  
 
         try:
-            if resp.status == 0:
-                message.send(self.request,{'msg':'response', 'status_message':'OK', 
-                        'status':0, 'details':resp.response, 'ver':'v1'})
-            else:
-                message.send(self.request,{'msg':'response', 'status_message':'ERROR', 
-                        'status':resp.status, 'details':resp.error, 'ver':'v1'})
-            # send the final response
-            # signal end of messages
+            message.send(self.request, response_message(resp, ver), self.enc)
+        except BrokenPipeError:
+            logging.warning(f"Broken pipe")
+            return False
+        return True
+
+    def serve_multiplexed(self, msg, ver):
+        """Serve a multiplexed session, starting with the request in msg.
+
+        Each request carries an 'id', and is started as soon as it is received; its keep-alive
+        and response messages carry the same id, and are sent as each request progresses, 
+        so responses may come back in any order. 
+        On receiving the sentinel, outstanding requests are completed before the session ends.
+        """
+        session = _MultiplexedSession(self.request, ver, self.server.wait_timeout, self.enc, self.server.keepalive)
+        writer = threading.Thread(target=session.run_writer)
+        writer.daemon = True
+        writer.start()
+
+        n_requests = 0
+        while True:
+            if not 'msg' in msg:
+                logging.warning("Ill formed client message")
+                break
+            n_requests += 1
+            session.start_request(msg)
+            try:
+                msg = message.recv(self.request)
+            except (ConnectionError, OSError):
+                logging.warning("Session connection lost")
+                session.close(abort=True)
+                writer.join()
+                return
+            logging.debug("{}".format(msg))
+            if not msg:
+                logging.debug(f"Multiplexed session ended after {n_requests} requests")
+                break
+
+        # wait for the outstanding responses to be sent, then signal the end
+        session.close()
+        writer.join()
+        if session.connected:
             self.end_connection()
 
+    def fail_request(self, ver, reason):
+        """Handle a request that could not be run. 
+        v1 connections are ended; sessions are sent a failed response and continue.
+        """
+        if ver not in self.SESSION_VERSIONS:
+            self.end_connection()
+            return False
+        try:
+            message.send(self.request, {'msg':'response', 'status_message':'failed', 
+                                        'status':1, 'reason':reason, 'ver':ver}, self.enc)
         except BrokenPipeError:
             logging.warning(f"Broken pipe")
-
+            return False
+        return True
 
     def end_connection(self):
         """Send the sentinal message"""
-        message.send(self.request, None)
+        message.send(self.request, None, self.enc)
+
+
+
+def result_message(result, ver, request_id=None):
+    """Build the message sent to the client for an intermediate result of a worker"""
+    msg = {'msg':'result', 'details':result, 'ver':ver}
+    if request_id is not None:
+        msg['id'] = request_id
+    return msg
+
+
+def response_message(resp, ver, request_id=None):
+    """Build the response message sent to the client, for the Response of a worker"""
+    if resp.status == 0:
+        msg = {'msg':'response', 'status_message':'OK', 
+               'status':0, 'details':resp.response, 'ver':ver}
+    else:
+        msg = {'msg':'response', 'status_message':'ERROR', 
+               'status':resp.status, 'details':resp.error, 'ver':ver}
+    if request_id is not None:
+        msg['id'] = request_id
+    return msg
+
+
+class _MultiplexedSession:
+    """State of a multiplexed connection: the requests in flight, and the queue of messages to send.
+
+    Messages are only sent from the writer thread, which also sends the keep-alive messages,
+    on the schedule of each request, and handles timeouts for the requests in flight.
+    """
+
+    def __init__(self, sock, ver, wait_timeout, enc=message.JSON, keepalive=None):
+        self._sock = sock
+        self._ver = ver
+        self._enc = enc
+        self._wait_timeout = wait_timeout
+        self._keepalive = keepalive if keepalive is not None else KeepaliveSchedule()
+        self._outbox = queue.Queue()
+        self._lock = threading.Lock()
+        self._inflight = {} # request id: [start time, last progress, Keepalive]
+        self._closing = False
+        self.connected = True
+
+    def start_request(self, msg):
+        """Create and start the worker for a request; its response is queued when ready"""
+        request_id = msg.get('id')
+        if request_id is None:
+            self._outbox.put({'msg':'response', 'status_message':'failed', 
+                              'status':1, 'reason':'Missing request id', 'ver':self._ver})
+            return
+        with self._lock:
+            if request_id in self._inflight:
+                self._outbox.put({'msg':'response', 'status_message':'failed', 'status':1, 
+                                  'reason':'Duplicate request id', 'ver':self._ver, 'id':request_id})
+                return
+            now = datetime.datetime.utcnow()
+            self._inflight[request_id] = [now, now, self._keepalive.tracker()]
+        # wake the writer, to schedule the keep-alives of the new request
+        self._outbox.put(None)
+
+        try:
+            response = handler.worker(msg)
+            response.add_result_callback(lambda r, result: self._result(request_id, result))
+            response.add_done_callback(lambda r: self._finish(request_id, None, r))
+            response.start()
+        except Exception as e:
+            logging.warning(f"Could not run request {request_id}: {e}")
+            self._finish(request_id, {'msg':'response', 'status_message':'failed', 
+                                      'status':1, 'reason':'Request not valid', 'ver':self._ver})
+            return
+
+    def _result(self, request_id, result):
+        """Queue an intermediate result of a request"""
+        with self._lock:
+            state = self._inflight.get(request_id)
+            if state is None:
+                return
+            state[1] = datetime.datetime.utcnow()
+            state[2].sent()
+            self._outbox.put(result_message(result, self._ver, request_id))
+
+    def _finish(self, request_id, msg, response=None):
+        """Queue the final message for a request, unless it has already been answered (e.g. timed out)"""
+        if msg is None:
+            try:
+                msg = response_message(response.response(), self._ver, request_id)
+            except Exception as e:
+                logging.error(f"Caught exception {e}")
+                msg = {'msg':'response', 'status_message':'failed', 
+                       'status':1, 'reason':'Unknown error', 'ver':self._ver}
+        msg['id'] = request_id
+        # queue under the lock, so the writer cannot see the request finished before its message is queued
+        with self._lock:
+            if self._inflight.pop(request_id, None) is None:
+                return
+            self._outbox.put(msg)
+
+    def close(self, abort=False):
+        """No further requests; the writer stops once all in-flight requests are answered (or at once, if abort)"""
+        with self._lock:
+            self._closing = True
+            if abort:
+                self.connected = False
+        self._outbox.put(None) # wake the writer
+
+    def _done(self):
+        with self._lock:
+            return not self.connected or \
+                (self._closing and len(self._inflight) == 0 and self._outbox.empty())
+
+    def run_writer(self):
+        """Send the queued messages, and the keep-alives for the requests in flight"""
+        while True:
+            try:
+                msg = self._outbox.get(timeout=self._next_wakeup())
+            except queue.Empty:
+                msg = None
+            try:
+                if msg is not None:
+                    message.send(self._sock, msg, self._enc)
+                self._keepalive_due(datetime.datetime.utcnow())
+            except (BrokenPipeError, ConnectionError, OSError):
+                logging.warning(f"Broken pipe in multiplexed session")
+                with self._lock:
+                    self.connected = False
+                return
+            if self._done():
+                return
+
+    def _next_wakeup(self):
+        """Seconds until the next keep-alive or timeout is due; None if no requests are in flight"""
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            if len(self._inflight) == 0:
+                return None
+            return max(0, min(min(keepalive.remaining(), (self._wait_timeout - (now - progress)).total_seconds())
+                              for start, progress, keepalive in self._inflight.values()))
 
+    def _keepalive_due(self, now):
+        """Send the keep-alives that are due, and time out requests that made no progress for too long"""
+        with self._lock:
+            inflight = [(k, v[0], v[1], v[2]) for k, v in self._inflight.items()]
+        for request_id, start, progress, keepalive in inflight:
+            dt = now - start
+            if (now - progress) >= self._wait_timeout:
+                logging.info(f"hit timeout for request {request_id}")
+                self._finish(request_id, {'msg':'response', 'status_message':'failed', 
+                                          'status':1, 'reason':'timeout', 'ver':self._ver})
+            elif keepalive.is_due():
+                logging.debug(f"Sending keep-alive message {request_id}")
+                message.send(self._sock, {'msg':'alive', 'id':request_id, 'dt':dt.total_seconds()}, self._enc)
+                keepalive.sent()
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
 
     def __init__(self, address, streamhandler, 
-                 authkey, wait_timeout=30):
+                 authkey, wait_timeout=30, keepalive=None):
         super().__init__(address, streamhandler)
         self.authkey = authkey
         self.wait_timeout = datetime.timedelta(seconds=wait_timeout)
+        self.keepalive = keepalive if keepalive is not None else KeepaliveSchedule()
 
     def server_close(self):
         """Called to clean-up the server.
@@ -145,12 +416,12 @@ class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
         finally:
             self.socket.close()
 
-def start_server(address, authkeyfile):
+def start_server(address, authkeyfile, keepalive=None):
     authkey=auth.get_key(authkeyfile)
     logging.info(f"Starting TCP server, listening on {address[0]}:{address[1]}")
 
     with ThreadedTCPServer(address, ThreadedTCPRequestHandler,
-                        authkey=authkey) as tcpserver:
+                        authkey=authkey, keepalive=keepalive) as tcpserver:
         # Activate the server; this will keep running until you
         # interrupt the program with Ctrl-C
         tcpserver.serve_forever()
@@ -0,0 +1,104 @@
+import logging
+import threading
+
+from ..common.requestmanager import RequestHandler, Response
+from . import handler
+
+
+class CksumBatch(RequestHandler):
+    """Checksum a list of paths in one request, streaming a result per path as each completes.
+
+    Each path is run as its own cksum request, created through the worker handler as for a
+    single request, with at most concurrency of them in flight at once; their results are
+    posted as intermediate results, in order of completion, and the final response summarises the batch.
+    """
+    DEFAULT_CONCURRENCY = 4
+    MAX_CONCURRENCY = 16
+
+    def __init__(self, msg: dict):
+        super().__init__()
+        self._paths = list(msg['paths'])
+        self._action = msg['action']
+        self._algtype = msg['algtype']
+        self._trace = bool(msg.get('trace', False))
+        self._concurrency = min(max(1, int(msg.get('concurrency', self.DEFAULT_CONCURRENCY))),
+                                self.MAX_CONCURRENCY)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._inflight = 0
+        self._dispatching = False
+        self._finished = 0
+        self._failed = 0
+
+    def start(self):
+        if len(self._paths) == 0:
+            self._complete()
+            return
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start the requests for the next paths, while fewer than concurrency are in flight.
+
+        Paths that complete during the loop (e.g. failing at once) only free their slot, and
+        the loop carries on; so the stack does not grow with the number of paths.
+        """
+        with self._lock:
+            if self._dispatching:
+                return
+            self._dispatching = True
+        while True:
+            with self._lock:
+                if self._next >= len(self._paths) or self._inflight >= self._concurrency:
+                    self._dispatching = False
+                    return
+                path = self._paths[self._next]
+                self._next += 1
+                self._inflight += 1
+            self._start_path(path)
+
+    def _start_path(self, path):
+        """Start the cksum request for path; _path_done is called once it has a response"""
+        msg = {'msg':'cksum', 'path':path, 'action':self._action, 'algtype':self._algtype}
+        if self._trace:
+            msg['trace'] = True
+        try:
+            child = handler.worker(msg)
+        except Exception as e:
+            logging.warning(f"Could not create cksum request for {path}: {e}")
+            self._path_done(path, Response(1, {}, {'error':str(e)}))
+            return
+        child.add_done_callback(lambda r: self._path_done(path, r.response()))
+        try:
+            child.start()
+        except Exception as e:
+            logging.warning(f"Could not start cksum request for {path}: {e}")
+            if not child.is_ready():
+                # the done callback is only called for the first response
+                child.set_response(Response(1, {}, {'error':str(e)}))
+
+    def _path_done(self, path, res):
+        if res.status == 0:
+            result = {'path':path, 'status':0, 'digest':res.response.get('digest')}
+            for key in ('digests', 'trace'):
+                if key in res.response:
+                    result[key] = res.response[key]
+        else:
+            result = {'path':path, 'status':res.status, 'error':res.error.get('error')}
+            if 'trace' in res.error:
+                result['trace'] = res.error['trace']
+        self.post_result(result)
+        with self._lock:
+            self._inflight -= 1
+            self._finished += 1
+            if res.status != 0:
+                self._failed += 1
+            complete = self._finished == len(self._paths)
+        if complete:
+            self._complete()
+        else:
+            self._dispatch()
+
+    def _complete(self):
+        total = len(self._paths)
+        self.set_response(Response(0, {'response':'cksumbatch', 'total':total,
+                                       'ok':total - self._failed, 'failed':self._failed}, {}))
@@ -1,87 +1,228 @@
 import logging 
 import threading
+import time
 
 from time import sleep
-from ..backend import radospool, cephtools, actions, XrdCks
-from ..common.requestmanager import ThreadedRequestHandler, Response
+from ..backend import radospool, cephtools, actions, digests, procworker, XrdCks
+from ..common import trace
+from ..common.requestmanager import ThreadedRequestHandler, MultiProcessingRequestHandler, Response, SingleFlight, \
+                                    ExecutionEngine, ProcessEngine
 # from ..backend.XrdCks import XrdCks
 
 import rados
 
-class Cksum(ThreadedRequestHandler):
+class Cksum(ThreadedRequestHandler, MultiProcessingRequestHandler):
+    """Checksum actions on a file; run in the ExecutionEngine threads, or the ProcessEngine if configured for the action"""
+    # concurrent identical requests share a single computation
+    _singleflight = SingleFlight()
+    # actions that produce the same result, for the purpose of coalescing requests
+    _action_class = {'check':'inget'}
+    # actions only needing metadata, which run in the fast lane
+    _metadata_actions = ['metaonly']
+    # actions tried from metadata in the fast lane, and moved to the slow lane if the file must be read
+    _metadata_first_actions = ['get', 'inget', 'check']
+
     def __init__(self, msg: dict):
         super().__init__()
+        self._coalesce_key = None
+        # timing of the phases of the request; returned in the response if asked for with 'trace'
+        self._trace = trace.Trace()
+        self._want_trace = bool(msg.get('trace', False))
+        self._queued_at = None
         self._rados = radospool.RadosPool.pool()
-        self._pool, self._path = self._rados.parse(msg['path'])
+        with trace.activate(self._trace), trace.phase('lfn2pfn'):
+            self._pool, self._path = self._rados.parse(msg['path'])
         self._oid = f'{self._path}.{0:016x}'
         self._action  = msg['action'].lower()
-        self._algtype = msg['algtype'].lower()
+        # one algorithm name, or several as a list or comma separated
+        self._algtype = msg['algtype']
+        self._algs = None
 
         self._readsize = self._rados.readsize()
+        self._max_inflight = self._rados.parallel_reads()
+        self._readahead = self._rados.readahead()
+        self._write_manifest = self._rados.stripe_manifest()
+        # optional stripe selection, for the verifystripes action
+        self._stripes = self._parse_stripes(msg.get('stripes'))
+        self._sample = int(msg['sample']) if msg.get('sample') is not None else None
         self._xattr_name = 'XrdCks.adler32'
 
-    def start(self):
-        if self._algtype != 'adler32':
-            self.set_response(Response(1, {}, {'error':"Error Only adler32 supported"}))
-            return
-        # self._thread = threading.Thread(target=self._checksum_metadata)
-        # self._thread = threading.Thread(target=self._checksum_fileonly)
+    @staticmethod
+    def _parse_stripes(stripes):
+        """Convert a 'N-M' string, or [N, M] list, into a tuple of first and last stripe index"""
+        if stripes is None:
+            return None
+        if isinstance(stripes, str):
+            stripes = stripes.split('-')
+        if len(stripes) == 1:
+            stripes = [stripes[0], stripes[0]]
+        return int(stripes[0]), int(stripes[1])
+
+    @property
+    def _multi(self):
+        """Whether checksums other than adler32 are asked for; these are computed together, in a single read"""
+        return self._algs != ['adler32']
+
+    def prepare(self):
+        try:
+            self._algs = digests.parse_algorithms(self._algtype)
+        except ValueError as e:
+            self.set_response(Response(1, {}, {'error':f"Error {e}"}))
+            return False
+        # identical requests already in flight are joined, rather than repeated
+        self._coalesce_key = (self._pool, self._path, self._action_class.get(self._action, self._action), 
+                              self._stripes, self._sample, tuple(self._algs))
+        if not self._singleflight.join(self._coalesce_key, self):
+            return False
+        self._queued_at = time.monotonic()
+        return True
+
+    def lane(self):
+        if self._action in self._metadata_actions + self._metadata_first_actions:
+            return ExecutionEngine.FAST
+        return ExecutionEngine.SLOW
+
+    def run(self):
         # for now, we defer to _from_action, rather than anything cleverer
-        self._thread = threading.Thread(target=self._from_action)
-        self._thread.setDaemon(True)
-        self._thread.start()
+        # (e.g. _checksum_metadata or _checksum_fileonly)
+        if self._action in self._metadata_first_actions:
+            self._run_traced(self._from_metadata_first)
+        else:
+            self._run_traced(self._from_action)
+
+    def _run_traced(self, fn):
+        """Run fn with the trace of the request active, after recording the time it was queued"""
+        if self._queued_at is not None:
+            self._trace.add('queue', time.monotonic() - self._queued_at)
+            self._queued_at = None
+        with trace.activate(self._trace):
+            fn()
+
+    def _from_metadata_first(self):
+        """Answer from the stored metadata if possible, else run the full action in the slow lane"""
+        result = None
+        try:
+            with self._rados.backend(self._pool) as backend:
+                if self._multi:
+                    result = actions.get_from_metadata_multi(backend,self._path,self._algs)
+                else:
+                    result = actions.get_from_metatdata(backend,self._path,self._xattr_name)
+        except Exception as e:
+            # let the full action deal with, and report, any error
+            logging.debug(f"Metadata lookup failed for {self._pool} {self._path}: {e}")
+
+        checksums = result if self._multi or result is None else {'adler32':result}
+        if checksums is None or (self._action != 'get' and 
+                                 any(xrdcks.read_format == 'big' for xrdcks in checksums.values())):
+            # needs the file to be read, or the metadata rewritten
+            self._queued_at = time.monotonic()
+            self.submit(ExecutionEngine.SLOW, lambda: self._run_traced(self._from_action))
+            return
+        self.on_result(result)
+
+    def set_response(self, res):
+        if self._trace.finish():
+            trace.log_if_slow(self._trace, action=self._action, pool=self._pool, path=self._path, 
+                              status=getattr(res, 'status', None))
+            if self._want_trace and isinstance(res, Response):
+                details = res.response if res.status == 0 else res.error
+                res = res._replace(**{'response' if res.status == 0 else 'error':
+                                      dict(details, trace=self._trace.as_dict())})
+        super().set_response(res)
+        if self._coalesce_key is not None:
+            # leader; pass the response to any coalesced requests
+            key, self._coalesce_key = self._coalesce_key, None
+            self._singleflight.complete(key, res)
 
     def _checksum_metadata(self):
-        cluster = self._rados.get()
-        with cluster.open_ioctx(self._pool)  as ioctx:
+        with self._rados.backend(self._pool)  as backend:
             try:
-                stat = ioctx.stat(self._oid)
-            except rados.ObjectNotFound as e:
+                stat = backend.stat(self._path)
+            except backend.NotFound as e:
                 self.set_response(Response(1, {}, {'error':"File not found"}))
                 raise e
             
-            try:
-                res = ioctx.get_xattr(self._oid, 'XrdCks.adler32')
-            except rados.NoData as e:
+            res = backend.get_xattr(self._path, 'XrdCks.adler32')
+            if res is None:
                 self.set_response(Response(1, {}, {'error':"Missing sriper metadata"}))
-                raise e
+                raise ValueError(f"No checksum metadata for {self._path}")
 
-            cks = XrdCks.from_binary(res)
+            cks = XrdCks.XrdCks.from_binary(res)
         digest = cks.get_cksum_as_hex()
 
         self.set_response(Response(0, {'response':'cksum', 'digest':digest}, {}))
 
     def _checksum_fileonly(self):
-        cluster = self._rados.get()
-        with cluster.open_ioctx(self._pool)  as ioctx:
-            cks = actions.get_from_file(ioctx, self._path, 64*1024**2)
+        with self._rados.backend(self._pool)  as backend:
+            cks = actions.get_from_file(backend, self._path, 64*1024**2)
 
         digest = cks.get_cksum_as_hex()
 
         self.set_response(Response(0, {'response':'cksum', 'digest':digest}, {}))
 
 
-    def _from_action(self):
+    def _action_call(self):
+        """Return tuple of (function name in actions, args, kwargs) to run the action, after the backend and path"""
         readsize = self._readsize
+        max_inflight = self._max_inflight
+        readahead = self._readahead
         xattr_name = self._xattr_name
-        cluster = self._rados.get()
-        xrdcks = None
+        if self._multi:
+            return self._multi_action_call()
+        if self._action in ['inget','check']:
+            return 'inget', (readsize,xattr_name), dict(max_inflight=max_inflight,readahead=readahead,
+                                                        write_manifest=self._write_manifest)
+        elif self._action == 'verify':
+            return 'verify', (readsize,xattr_name), dict(max_inflight=max_inflight,readahead=readahead)
+        elif self._action == 'verifystripes':
+            return 'verify_stripes', (readsize,self._stripes,self._sample,max_inflight), {}
+        elif self._action == 'get':
+            return 'get_checksum', (readsize,xattr_name,max_inflight,readahead), {}
+        elif self._action == 'metaonly':
+            return 'get_from_metatdata', (xattr_name,), {}
+        elif self._action == 'fileonly':
+            return 'get_from_file', (readsize,max_inflight,readahead), {}
+        logging.warning(f'Action {self._action} is not implemented')
+        raise NotImplementedError(f'Action {self._action} is not implemented')
+
+    def _multi_action_call(self):
+        """Return tuple of (function name in actions, args, kwargs) to run the action for several algorithms"""
+        readsize = self._readsize
+        max_inflight = self._max_inflight
+        readahead = self._readahead
+        algs = self._algs
+        if self._action in ['inget','check']:
+            return 'inget_multi', (algs,readsize), dict(max_inflight=max_inflight,readahead=readahead)
+        elif self._action == 'verify':
+            return 'verify_multi', (algs,readsize), dict(max_inflight=max_inflight,readahead=readahead)
+        elif self._action == 'get':
+            return 'get_checksum_multi', (algs,readsize), dict(max_inflight=max_inflight,readahead=readahead)
+        elif self._action == 'metaonly':
+            return 'get_from_metadata_multi', (algs,), {}
+        elif self._action == 'fileonly':
+            return 'get_from_file_multi', (algs,readsize), dict(max_inflight=max_inflight,readahead=readahead)
+        logging.warning(f'Action {self._action} is not implemented for {", ".join(algs)}')
+        raise NotImplementedError(f'Action {self._action} is only implemented for adler32')
+
+    def _from_action(self):
+        try:
+            action, args, kwargs = self._action_call()
+        except NotImplementedError as e:
+            self.set_response(Response(1, {}, {'error':str(e)}))
+            raise e
+
+        engine = ProcessEngine.engine()
+        if engine is not None and engine.runs(self._action):
+            logging.info(f"Running cksum action {self._action} for file {self._pool} {self._path} in process engine")
+            self._queued_at = time.monotonic()
+            self.submit_job(procworker.run_action, (self._pool, self._path, action, args, kwargs,
+                                                    self._rados.backend_spec(self._pool)))
+            return
+
         logging.info(f"Running cksum action {self._action} for file {self._pool} {self._path}")
         try:
-            with cluster.open_ioctx(self._pool) as ioctx:
-                if self._action in ['inget','check']:
-                    xrdcks = actions.inget(ioctx,self._path,readsize,xattr_name)
-                elif self._action == 'verify':
-                    xrdcks = actions.verify(ioctx,self._path,readsize,xattr_name)
-                elif self._action == 'get':
-                    xrdcks = actions.get_checksum(ioctx,self._path,readsize, xattr_name)
-                elif self._action == 'metaonly':
-                    xrdcks = actions.get_from_metatdata(ioctx,self._path,xattr_name)
-                elif self._action == 'fileonly':
-                    xrdcks = actions.get_from_file(ioctx,self._path, readsize)    
-                else:
-                    logging.warning(f'Action {args.action} is not implemented')
-                    raise NotImplementedError(f'Action {args.action} is not implemented')
+            with self._rados.backend(self._pool) as backend:
+                result = getattr(actions, action)(backend, self._path, *args, **kwargs)
         except rados.ObjectNotFound as e:
             logging.warning("Failed to open pool: {}".format(str(e)))
             self.set_response(Response(1, {}, {'error':'Could not open pool: {}'.format(str(self._pool))}))
@@ -89,10 +230,55 @@ class Cksum(ThreadedRequestHandler):
         except Exception as e:
             self.set_response(Response(1, {}, {'error':str(e)}))
             raise e
+        self.on_result(result)
 
+    def _job_done(self, result):
+        self._trace_job()
+        super()._job_done(result)
+
+    def _job_failed(self, e):
+        self._trace_job()
+        super()._job_failed(e)
+
+    def _trace_job(self):
+        """Record the time the action took in the process engine, where it is not traced by phase"""
+        if self._queued_at is not None:
+            self._trace.add('process', time.monotonic() - self._queued_at)
+            self._queued_at = None
+
+    def on_result(self, result):
+        """Set the response from the result of the action"""
+        if self._action == 'verifystripes':
+            checked, bad_stripes = result
+            if len(bad_stripes) > 0:
+                self.set_response(Response(1, {}, {'error':'Stripe checksum mismatch', 
+                                                   'stripes_checked':len(checked), 'bad_stripes':bad_stripes}))
+            else:
+                self.set_response(Response(0, {'response':'verifystripes', 
+                                               'stripes_checked':len(checked), 'bad_stripes':[]}, {}))
+            return
+
+        if self._multi:
+            if result is not None:
+                hexdigests = {alg:result[alg].get_cksum_as_hex() for alg in self._algs}
+                self.set_response(Response(0, {'response':'cksum', 'digest':hexdigests[self._algs[0]], 
+                                                'digests':hexdigests}, {}))
+            else:
+                self.set_response(Response(1, {}, {'error':"Failed to get checksum"}))
+            return
+
+        xrdcks = result
         if xrdcks is not None:
             digest = xrdcks.get_cksum_as_hex()
             self.set_response(Response(0, {'response':'cksum', 'digest':digest}, {}))
         else:
             self.set_response(Response(1, {}, {'error':"Failed to get checksum"}))
 
+    def on_error(self, e):
+        """Set the response for an action that failed in the process engine"""
+        if isinstance(e, procworker.JobError) and e.kind == 'ObjectNotFound':
+            logging.warning("Failed to open pool: {}".format(str(e)))
+            self.set_response(Response(1, {}, {'error':'Could not open pool: {}'.format(str(self._pool))}))
+            return
+        logging.warning(f"Cksum action {self._action} for {self._pool} {self._path} failed: {e}")
+        self.set_response(Response(1, {}, {'error':str(e)}))
@@ -1,5 +1,7 @@
 import logging
 
+from ..common import metrics
+
 _workers = {}
 
 def register_workers(workers):
@@ -22,7 +24,18 @@ def worker(msg):
 
     if not worker_name in _workers:
         raise NotImplementedError("Worker {} is not registered".format(worker_name))
-    wrkr = _workers[worker_name]
-
-    return wrkr(msg)
+    action = msg.get('action', '')
+    start = metrics.request_started()
+    try:
+        wrkr = _workers[worker_name](msg)
+    except Exception:
+        metrics.REQUESTS_INFLIGHT.dec()
+        metrics.REQUEST_ERRORS.inc(1, worker_name)
+        raise
+    pool = getattr(wrkr, '_pool', '')
+    def done(response):
+        status = getattr(response.response(), 'status', 0)
+        metrics.request_done(start, worker_name, action, pool, 'ok' if status == 0 else 'error')
+    wrkr.add_done_callback(done)
+    return wrkr
 
@@ -1,7 +1,7 @@
 import threading
 
 from time import sleep
-from ..backend import radospool, cephtools
+from ..backend import radospool
 from ..common.requestmanager import ThreadedRequestHandler, Response
 
 import rados
@@ -13,25 +13,19 @@ class Stat(ThreadedRequestHandler):
         self._pool, self._path = self._rados.parse(msg['path'])
         self._oid = f'{self._path}.{0:016x}'
 
-    def start(self):
-        self._thread = threading.Thread(target=self._stat)
-        self._thread.setDaemon(True)
-        self._thread.start()
+    def run(self):
+        self._stat()
 
     def _stat(self):
         try:
-            cluster = radospool.RadosPool.pool().get()
-        except rados.ObjectNotFound:
-            self.set_response(Response(1, {}, {'error':'pool not available'}))
-
-        try:
-            with cluster.open_ioctx(self._pool)  as ioctx:
+            with self._rados.backend(self._pool)  as backend:
                 try:
-                    size, timestamp = cephtools.stat(ioctx, self._path)
-                except rados.ObjectNotFound:
+                    metadata = backend.metadata(self._path, with_stat=True)
+                except backend.NotFound:
                     self.set_response(Response(1, {}, {'error':'pool not available'}))
                     return
-                self.set_response(Response(0, {'response':'stat','stat':timestamp}, {}))
+                self.set_response(Response(0, {'response':'stat','stat':metadata.mtime, 'size':metadata.total_size()}, {}))
+                return
         except rados.ObjectNotFound:
             self.set_response(Response(1, {}, {'error':'pool not available'}))
             return 
@@ -1,7 +1,7 @@
 import threading
 
 from time import sleep
-from ..common.requestmanager import ThreadedRequestHandler, Response
+from ..common.requestmanager import ThreadedRequestHandler, Response, ExecutionEngine
 
 
 class Wait(ThreadedRequestHandler):
@@ -9,10 +9,11 @@ class Wait(ThreadedRequestHandler):
         super().__init__()
         self._delay_time = msg['delay']
 
-    def start(self):
-        self._thread = threading.Thread(target=self._delay)
-        self._thread.setDaemon(True)
-        self._thread.start()
+    def lane(self):
+        return ExecutionEngine.SLOW
+
+    def run(self):
+        self._delay()
 
     def _delay(self):
         sleep(self._delay_time)
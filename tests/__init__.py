@@ -0,0 +1,27 @@
+"""Unit tests, run against the in-memory rados stand-in (memrados), so no Ceph cluster is needed:
+
+    python -m pytest tests
+"""
+from cephsumserver.backend import memrados
+# must be installed before the modules using rados are imported
+memrados.install(force=True)
+
+from cephsumserver.backend import radospool
+
+POOL = 'test'
+
+
+def create_pool(max_size=2, lfn2pfn=None, readsize=1024**2, **kwargs):
+    """(Re)create the RadosPool singleton over the in-memory cluster; without the health check thread, unless given"""
+    if radospool.RadosPool._instance is not None:
+        radospool.RadosPool._instance.shutdown_all()
+        radospool.RadosPool._instance = None
+    memrados.STORE.create_pool(POOL)
+    kwargs.setdefault('health_interval', 0)
+    return radospool.RadosPool.create(max_size, lfn2pfn, readsize, **kwargs)
+
+
+def register_workers(workers: dict):
+    """Register the workers not already registered, as tests share the process wide registry"""
+    from cephsumserver.workers import handler
+    handler.register_workers({k:v for k, v in workers.items() if k not in handler._workers})
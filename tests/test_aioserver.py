@@ -0,0 +1,90 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from cephsumserver.server import aioserver, auth, message
+from cephsumserver.workers import ping, wait
+
+from . import register_workers
+
+AUTHKEY = b'test'
+
+
+class AsyncServerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        register_workers({'ping':ping.Ping, 'wait':wait.Wait})
+        cls.loop = asyncio.new_event_loop()
+        cls.server = aioserver.AsyncRequestServer(AUTHKEY, wait_timeout=30)
+        started = threading.Event()
+        def run():
+            asyncio.set_event_loop(cls.loop)
+            cls.tcpserver = cls.loop.run_until_complete(
+                asyncio.start_server(cls.server.handle_client, 'localhost', 0))
+            started.set()
+            cls.loop.run_forever()
+        cls.thread = threading.Thread(target=run, daemon=True)
+        cls.thread.start()
+        started.wait(5)
+        cls.address = cls.tcpserver.sockets[0].getsockname()[:2]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.call_soon_threadsafe(cls.tcpserver.close)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(5)
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=10)
+        auth.answer_challenge(sock, AUTHKEY)
+        return sock
+
+    def requests_in_flight(self):
+        async def count():
+            return sum(1 for task in asyncio.all_tasks() 
+                       if task.get_coro().__qualname__ == '_AsyncConnection.serve_request')
+        return asyncio.run_coroutine_threadsafe(count(), self.loop).result(5)
+
+    def test_duplicate_id_rejected(self):
+        sock = self.connect()
+        message.send(sock, {'msg':'wait', 'delay':0.5, 'id':1, 'ver':'v3'})
+        message.send(sock, {'msg':'ping', 'id':1})
+        message.send(sock, {'msg':'ping', 'id':2})
+        replies = [message.recv(sock) for _ in range(3)]
+        failed = [r for r in replies if r.get('status') == 1]
+        self.assertEqual(len(failed), 1)
+        self.assertEqual((failed[0]['id'], failed[0]['reason']), (1, 'Duplicate request id'))
+        self.assertEqual(replies[-1], {'msg':'response', 'status_message':'OK', 'status':0,
+                                       'details':{'response':'wait', 'delay':0.5}, 'ver':'v3', 'id':1})
+        # once answered, the id may be used again
+        message.send(sock, {'msg':'ping', 'id':1})
+        self.assertEqual(message.recv(sock)['status'], 0)
+        message.send(sock, None)
+        self.assertEqual(message.recv(sock), {})
+        sock.close()
+
+    def test_dropped_connection_cancels_requests(self):
+        sock = self.connect()
+        message.send(sock, {'msg':'wait', 'delay':20, 'id':'a', 'ver':'v3'})
+        message.send(sock, {'msg':'wait', 'delay':20, 'id':'b'})
+        for _ in range(50):
+            if self.requests_in_flight() == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.requests_in_flight(), 2)
+        # the connection is lost part way through a message
+        sock.sendall(struct.pack('>I', 100) + b'{"msg":')
+        sock.close()
+        for _ in range(50):
+            if self.requests_in_flight() == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.requests_in_flight(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
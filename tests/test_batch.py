@@ -0,0 +1,76 @@
+import threading
+import unittest
+import zlib
+
+from cephsumserver.backend import memrados
+from cephsumserver.common import metrics
+from cephsumserver.workers import batch, cksum, handler
+
+from . import POOL, create_pool, register_workers
+
+
+class CksumBatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        create_pool()
+        register_workers({'cksum':cksum.Cksum, 'cksumbatch':batch.CksumBatch})
+        cls.expected = {}
+        for i in range(5):
+            data = bytes(range(i, 256)) * 100
+            memrados.STORE.write_striped(POOL, f'batch{i}', data=data, object_size=4096)
+            cls.expected[f'{POOL}:batch{i}'] = f'{zlib.adler32(data):08x}'
+
+    def run_batch(self, msg, timeout=60):
+        request = handler.worker(dict(msg, msg='cksumbatch'))
+        results = []
+        lock = threading.Lock()
+        def add(r, result):
+            with lock:
+                results.append(result)
+        request.add_result_callback(add)
+        request.start()
+        self.assertTrue(request.is_ready(timeout=timeout), "batch did not complete")
+        return request.response(), results
+
+    def test_bad_algtype_many_paths(self):
+        # every path fails at once, in prepare; these must not recurse through the dispatch
+        paths = [f'{POOL}:batch{i % 5}' for i in range(2000)]
+        res, results = self.run_batch({'paths':paths, 'action':'inget', 'algtype':'nope', 'concurrency':16})
+        self.assertEqual(res.status, 0)
+        self.assertEqual((res.response['total'], res.response['ok'], res.response['failed']), (2000, 0, 2000))
+        self.assertEqual(len(results), 2000)
+        self.assertTrue(all(r['status'] != 0 for r in results))
+
+    def test_mixed_paths(self):
+        good = list(self.expected)
+        # invalid paths fail when their request is created, missing files once their request has run
+        bad = ['no-pool-separator'] * 500 + [f'{POOL}:missing{i}' for i in range(20)]
+        paths = good + bad + good
+        res, results = self.run_batch({'paths':paths, 'action':'get', 'algtype':'adler32', 'concurrency':4})
+        self.assertEqual(res.response['total'], len(paths))
+        self.assertEqual(res.response['ok'], 2*len(good))
+        self.assertEqual(res.response['failed'], len(bad))
+        self.assertEqual(len(results), len(paths))
+        for result in results:
+            if result['status'] == 0:
+                self.assertEqual(result['digest'], self.expected[result['path']])
+            else:
+                self.assertIn('error', result)
+
+    def test_paths_counted_as_requests(self):
+        path = next(iter(self.expected))
+        before = metrics.REQUESTS.value('cksum', 'get', POOL, 'ok')
+        res, results = self.run_batch({'paths':[path]*3, 'action':'get', 'algtype':'adler32', 'trace':True})
+        self.assertEqual(res.response['ok'], 3)
+        self.assertEqual(metrics.REQUESTS.value('cksum', 'get', POOL, 'ok') - before, 3)
+        self.assertTrue(all('trace' in r for r in results))
+
+    def test_empty(self):
+        res, results = self.run_batch({'paths':[], 'action':'get', 'algtype':'adler32'})
+        self.assertEqual(res.response['total'], 0)
+        self.assertEqual(results, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
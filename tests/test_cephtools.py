@@ -0,0 +1,90 @@
+import errno
+import threading
+import time
+import unittest
+
+from cephsumserver.backend import cephtools, memrados
+from cephsumserver.common import trace
+
+from . import POOL, create_pool
+
+
+class _Completion:
+    def __init__(self, retval):
+        self.retval = retval
+
+    def get_return_value(self):
+        return self.retval
+
+
+class _SlowIoctx:
+    """An ioctx whose aio reads fail at once for the failing oids, and complete after delay otherwise"""
+
+    def __init__(self, failing=(), delay=0.2):
+        self.failing = set(failing)
+        self.delay = delay
+        self.issued = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def aio_read(self, oid, length, offset, oncomplete):
+        with self._lock:
+            self.issued += 1
+        def run():
+            if oid in self.failing:
+                retval, data = -errno.EIO, b''
+            else:
+                time.sleep(self.delay)
+                retval, data = 0, b'x' * length
+            with self._lock:
+                self.completed += 1
+            oncomplete(_Completion(retval), data)
+        threading.Thread(target=run, daemon=True).start()
+
+
+class ReadStripesParallelTest(unittest.TestCase):
+
+    def test_read_all(self):
+        reads = cephtools.plan_stripe_reads('file', 10000, 4096, 1024)
+        ioctx = _SlowIoctx(delay=0)
+        parts = sorted(cephtools.read_stripes_parallel(ioctx, reads, max_inflight=3))
+        self.assertEqual([position for position, buf in parts], list(range(len(reads))))
+        self.assertEqual(sum(len(buf) for position, buf in parts), 10000)
+
+    def test_error_waits_for_reads_in_flight(self):
+        reads = cephtools.plan_stripe_reads('file', 4 * 4096, 4096, 4096)
+        ioctx = _SlowIoctx(failing={reads[0].oid})
+        with self.assertRaises(IOError):
+            list(cephtools.read_stripes_parallel(ioctx, reads, max_inflight=4))
+        self.assertEqual(ioctx.issued, 4)
+        # the other reads had all completed before the error was raised
+        self.assertEqual(ioctx.completed, ioctx.issued)
+
+    def test_close_waits_for_reads_in_flight(self):
+        reads = cephtools.plan_stripe_reads('file', 4 * 4096, 4096, 4096)
+        ioctx = _SlowIoctx(delay=0.1)
+        parts = cephtools.read_stripes_parallel(ioctx, reads, max_inflight=4)
+        next(parts)
+        parts.close()
+        self.assertEqual(ioctx.completed, ioctx.issued)
+
+
+class CksFromFileTest(unittest.TestCase):
+
+    def setUp(self):
+        memrados.STORE.write_striped(POOL, 'short', data=b'y' * 4 * 4096, object_size=4096)
+        memrados.STORE.remove(POOL, f'short.{2:016x}')
+        self.pool = create_pool()
+
+    def test_trace_counts_stripes_read(self):
+        for max_inflight in (1, 4):
+            current = trace.Trace()
+            with trace.activate(current), self.pool.ioctx(POOL) as ioctx:
+                with self.assertRaises(IOError):
+                    cephtools.cks_from_file(ioctx, 'short', 1024, max_inflight=max_inflight)
+            # the sequential read stops at the missing stripe; the parallel read skips it
+            self.assertEqual(current.stripes_read, 2 if max_inflight == 1 else 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import hashlib
+import unittest
+import zlib
+
+from cephsumserver.backend import digests
+
+
+def _buffers(total, size):
+    data = bytes(range(256)) * (total // 256 + 1)
+    return [data[offset:min(total, offset+size)] for offset in range(0, total, size)]
+
+
+class MultiDigestTest(unittest.TestCase):
+
+    def expected(self, algs, data):
+        values = {'adler32':f'{zlib.adler32(data):08x}', 'md5':hashlib.md5(data).hexdigest(),
+                  'sha256':hashlib.sha256(data).hexdigest()}
+        if digests._crc32c is not None:
+            values['crc32c'] = f'{digests._crc32c.crc32c(data):08x}'
+        return {alg:values[alg] for alg in algs}
+
+    def test_against_reference(self):
+        algs = list(digests.available())
+        for total, size in ((0, 1024), (1, 1024), (5000, 1024),
+                            (3 * digests.PARALLEL_MIN_BYTES + 7, digests.PARALLEL_MIN_BYTES),
+                            (2 * digests.PARALLEL_MIN_BYTES, digests.PARALLEL_MIN_BYTES - 1)):
+            buffers = _buffers(total, size)
+            multi = digests.MultiDigest(algs)
+            self.assertEqual(multi.calc_checksums(buffers), self.expected(algs, b''.join(buffers)), (total, size))
+            self.assertEqual(multi.bytes_read, total)
+            self.assertEqual(multi.number_buffers, len(buffers))
+
+    def test_parallel_matches_serial(self):
+        algs = ['adler32', 'md5', 'sha256']
+        buffers = _buffers(4 * digests.PARALLEL_MIN_BYTES + 1, digests.PARALLEL_MIN_BYTES)
+        parallel = digests.MultiDigest(algs).calc_checksums(buffers)
+        serial = digests.MultiDigest(algs, parallel=False).calc_checksums(buffers)
+        self.assertEqual(parallel, serial)
+
+    def test_reused_buffer(self):
+        # a buffer is consumed by all algorithms before update returns, so it can then be refilled
+        algs = ['adler32', 'md5', 'sha256']
+        buffers = _buffers(3 * digests.PARALLEL_MIN_BYTES, digests.PARALLEL_MIN_BYTES)
+        buffer = bytearray(digests.PARALLEL_MIN_BYTES)
+        multi = digests.MultiDigest(algs)
+        for buf in buffers:
+            buffer[:] = buf
+            multi.update(memoryview(buffer))
+        self.assertEqual(multi.hexdigests(), self.expected(algs, b''.join(buffers)))
+
+    def test_single_algorithm(self):
+        multi = digests.MultiDigest(['adler32'])
+        self.assertFalse(multi._parallel)
+        self.assertEqual(multi.calc_checksums([b'abc']), {'adler32':f'{zlib.adler32(b"abc"):08x}'})
+
+    @unittest.skipIf(digests._crc32c is None, "needs the crc32c module")
+    def test_crc32c(self):
+        # the check value of crc32c (Castagnoli)
+        self.assertEqual(digests.MultiDigest(['crc32c']).calc_checksums([b'123456789']), {'crc32c':'e3069283'})
+
+
+class ParseAlgorithmsTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(digests.parse_algorithms('adler32'), ['adler32'])
+        self.assertEqual(digests.parse_algorithms(' MD5, adler32,md5,'), ['md5', 'adler32'])
+        self.assertEqual(digests.parse_algorithms(['sha256', 'adler32']), ['sha256', 'adler32'])
+
+    def test_errors(self):
+        for algtype in ('', ',', [], 'sha1', ['adler32', 'crc64']):
+            with self.assertRaises(ValueError, msg=algtype):
+                digests.parse_algorithms(algtype)
+
+    @unittest.skipIf(digests._crc32c is not None, "crc32c module is installed")
+    def test_crc32c_unavailable(self):
+        self.assertNotIn('crc32c', digests.available())
+        with self.assertRaisesRegex(ValueError, 'crc32c module'):
+            digests.parse_algorithms('crc32c')
+        with self.assertRaises(ValueError):
+            digests.new('crc32c')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from unittest import mock
+
+from cephsumserver.server import keepalive
+from cephsumserver.server.keepalive import KeepaliveSchedule
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class KeepaliveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        patcher = mock.patch.object(keepalive, 'monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def intervals(self, schedule, n):
+        """Return the seconds between the keep-alives, sending each as soon as it is due"""
+        tracker = schedule.tracker()
+        intervals = []
+        for _ in range(n):
+            wait = tracker.remaining()
+            self.clock.now += wait
+            self.assertTrue(tracker.is_due())
+            tracker.sent()
+            intervals.append(wait)
+        return intervals
+
+    def test_schedule(self):
+        self.assertEqual(self.intervals(KeepaliveSchedule(5, 2, 2, 16), 7), [5, 2, 4, 8, 16, 16, 16])
+
+    def test_no_backoff(self):
+        self.assertEqual(self.intervals(KeepaliveSchedule(0, 3, 1, 16), 4), [0, 3, 3, 3])
+
+    def test_not_due_during_delay(self):
+        tracker = KeepaliveSchedule(delay=5).tracker()
+        self.clock.now += 4.9
+        self.assertFalse(tracker.is_due())
+        self.assertAlmostEqual(tracker.remaining(), 0.1)
+        self.clock.now += 10
+        self.assertTrue(tracker.is_due())
+        self.assertEqual(tracker.remaining(), 0.)
+
+    def test_result_resets_due(self):
+        # any message sent to the client, e.g. a result, pushes the next keep-alive back
+        tracker = KeepaliveSchedule(delay=5, interval=2).tracker()
+        self.clock.now += 1
+        tracker.sent()
+        self.assertEqual(tracker.remaining(), 2)
+
+    def test_limits(self):
+        schedule = KeepaliveSchedule(delay=-1, interval=0, backoff=0.5, max_interval=0)
+        self.assertEqual(schedule.delay, 0.)
+        self.assertEqual(schedule.interval, 0.1)
+        self.assertEqual(schedule.backoff, 1.)
+        self.assertEqual(schedule.max_interval, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
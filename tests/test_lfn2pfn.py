@@ -0,0 +1,103 @@
+import random
+import re
+import unittest
+
+from cephsumserver.backend.lfn2pfn import Lfn2PfnMapper, literal_prefix
+
+RULES = [
+    (r'/+atlas/disk/(.*)', 'atlasdisk:$1'),
+    (r'\/atlas/tape/(.*)/(.*)', 'atlastape:$1/$2'),
+    (r'^\/+cms/(.*)', 'cms:$1'),
+    (r'^/eos/lhcb/(.*)', 'lhcb:$1'),
+    (r'/\/dune\.data/(.*)', 'dune:$1'),
+    (r'//?lz/(.*)', 'lz:$1'),
+    (r'/*(store/.*)', 'cms:/$1'),
+    (r'/+(atlas|cms)/scratch/(.*)', 'scratch:$1/$2'),
+    (r'/+at+las/x(.*)', 'atlasx:$1'),
+    (r'/+mic?e/(.*)', 'mice:$1'),
+    (r'/+t2k{1,2}/(.*)', 't2k:$1'),
+    (r'/+\w+/user/(.*)', 'user:$1'),
+    (r'(?i)/+SKAO/(.*)', 'skao:$1'),
+    (r'/+na62\.(.*)', 'na62:$1'),
+    (r'/+ilc-(.*)', 'ilc:$1'),
+    (r'/+pheno\/(.*)', 'pheno:$1'),
+]
+
+SEGMENTS = ['atlas', 'cms', 'lhcb', 'eos', 'dune.data', 'dunexdata', 'lz', 'store', 'scratch', 'attlas', 'atlas',
+            'mie', 'mice', 't2k', 't2kk', 't2kkk', 'skao', 'SKAO', 'na62', 'na62.x', 'ilc-a', 'pheno', 'user',
+            'disk', 'tape', 'x1', 'f']
+
+
+def linear(mappings, pathname):
+    """The result of the first matching rule, trying each in turn"""
+    for pattern, result in mappings:
+        match = pattern.match(pathname)
+        if match is not None:
+            for i in range(pattern.groups, 0, -1):
+                result = result.replace(f'${i}', match.group(i))
+            return result
+    return None
+
+
+class LiteralPrefixTest(unittest.TestCase):
+
+    def test_prefixes(self):
+        cases = {r'/+atlas/disk/(.*)':'atlas/disk/', r'\/atlas/(.*)':'atlas/', r'^\/+cms/(.*)':'cms/',
+                 r'/\/dune\.data/':'dune.data/', r'//?lz/':'lz/', r'/*(store/.*)':'', r'/+(a|b)':'',
+                 r'/+at+las':'at', r'/+mic?e':'mi', r'/+t2k{1,2}':'t2', r'/+\w+':'', r'(?i)/a':'',
+                 r'/+pheno\/(.*)':'pheno/', '':''}
+        for pattern, prefix in cases.items():
+            self.assertEqual(literal_prefix(pattern), prefix, pattern)
+
+
+class MatcherTest(unittest.TestCase):
+
+    def test_agrees_with_linear_scan(self):
+        mapper = Lfn2PfnMapper(memo_size=0)
+        mapper.mappings = [(re.compile(pattern), result) for pattern, result in RULES] + \
+                          [(re.compile(r'/+ATLAS/(.*)', re.I), 'ignorecase:$1')]
+        rng = random.Random(1)
+        paths = set()
+        for _ in range(20000):
+            segments = [rng.choice(SEGMENTS) for _ in range(rng.randint(1, 4))]
+            paths.add('/' * rng.randint(0, 3) + '/'.join(segments))
+        matched = 0
+        for path in sorted(paths):
+            expected = linear(mapper.mappings, path)
+            self.assertEqual(mapper._matcher.map(path), expected, path)
+            matched += expected is not None
+        # the corpus exercises most rules
+        self.assertGreater(matched, len(paths) // 4)
+
+    def test_escaped_slash_rule(self):
+        mapper = Lfn2PfnMapper.from_string('<storage-mapping>'
+            '<lfn-to-pfn protocol="direct" path-match="\\/atlas/(.*)" result="atlas:$1"/>'
+            '</storage-mapping>')
+        self.assertEqual(mapper.parse('/atlas/data/file1'), ('atlas', 'data/file1'))
+
+    def test_first_match_wins_and_nominal(self):
+        mapper = Lfn2PfnMapper.from_string('<storage-mapping>'
+            '<lfn-to-pfn protocol="direct" path-match="/+atlas/(.*)" result="first:$1"/>'
+            '<lfn-to-pfn protocol="direct" path-match="/+atlas/disk/(.*)" result="second:$1"/>'
+            '<lfn-to-pfn protocol="srm" path-match="/+lhcb/(.*)" result="srm:$1"/>'
+            '</storage-mapping>')
+        self.assertEqual(mapper.parse('//atlas/disk/f'), ('first', 'disk/f'))
+        # not mapped, so split as pool:path
+        self.assertEqual(mapper.parse('lhcb:a/b'), ('lhcb', 'a/b'))
+        with self.assertRaises(ValueError):
+            mapper.parse('/lhcb/a/b')
+
+    def test_memo(self):
+        mapper = Lfn2PfnMapper.from_string('<storage-mapping>'
+            '<lfn-to-pfn protocol="direct" path-match="/+atlas/(.*)" result="atlas:$1"/>'
+            '</storage-mapping>', memo_size=2)
+        for path in ['/atlas/a', '/atlas/b', '/atlas/c', '/atlas/a']:
+            self.assertEqual(mapper.parse(path), ('atlas', path[len('/atlas/'):]))
+        self.assertEqual(list(mapper._memo), ['/atlas/c', '/atlas/a'])
+        # changing the mappings forgets the memo
+        mapper.mappings = [(re.compile(r'/+atlas/(.*)'), 'other:$1')]
+        self.assertEqual(mapper.parse('/atlas/a'), ('other', 'a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import threading
+import time
+import unittest
+
+from cephsumserver.common.membudget import MemoryBudget, read_buffers
+
+MB = 1024**2
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        MemoryBudget._instance = None
+        self.addCleanup(setattr, MemoryBudget, '_instance', None)
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("timed out")
+
+    def test_large_depth_within_budget(self):
+        # e.g. readbudget = 1 and parallelreads = 32
+        budget = MemoryBudget.create(1*MB)
+        granted = budget.acquire(64*MB, 32)
+        self.assertEqual(granted, 32*1024)
+        self.assertEqual(budget.stats()['in_use'], 1*MB)
+        self.assertEqual(budget.stats()['reduced'], 1)
+        budget.release(granted * 32)
+        self.assertEqual(budget.stats()['in_use'], 0)
+
+    def test_never_beyond_budget(self):
+        for max_bytes in (MemoryBudget.ALIGN, 1*MB, 3*MB + 5, 100*MB):
+            MemoryBudget._instance = None
+            budget = MemoryBudget.create(max_bytes)
+            for depth in (1, 2, 3, 7, 32, 100, 1000):
+                for readsize in (1, 1000, MemoryBudget.ALIGN, 4*MB, 64*MB):
+                    granted = budget.acquire(readsize, depth)
+                    self.assertTrue(0 < granted <= readsize)
+                    self.assertLessEqual(granted * depth, max_bytes, (max_bytes, depth, readsize))
+                    budget.release(granted * depth)
+        with self.assertRaises(ValueError):
+            budget.acquire(1, budget.stats()['max_bytes'] + 1)
+
+    def test_reduced_when_busy(self):
+        budget = MemoryBudget.create(64*MB)
+        self.assertEqual(budget.acquire(32*MB, 1), 32*MB)
+        # 32MB left for 4 buffers
+        self.assertEqual(budget.acquire(64*MB, 4), 8*MB)
+        self.assertEqual(budget.stats()['in_use'], 64*MB)
+
+    def test_waiting_request_not_overtaken(self):
+        budget = MemoryBudget.create(64*MB)
+        held = budget.acquire(16*MB, 3)
+        order = []
+        def acquire(name, readsize, depth):
+            granted = budget.acquire(readsize, depth)
+            order.append(name)
+            time.sleep(0.05)
+            budget.release(granted * depth)
+        # needs at least 8 buffers of MIN_READSIZE, more than the 16MB left
+        large = threading.Thread(target=acquire, args=('large', 16*MB, 8), daemon=True)
+        large.start()
+        self.wait_for(lambda: budget.stats()['waiting'] == 1)
+        # a small request, which would fit in what is left, waits for the earlier one
+        small = threading.Thread(target=acquire, args=('small', 4*MB, 1), daemon=True)
+        small.start()
+        self.wait_for(lambda: budget.stats()['waiting'] == 2 or order)
+        self.assertEqual(order, [])
+        budget.release(held * 3)
+        large.join(5)
+        small.join(5)
+        self.assertEqual(order, ['large', 'small'])
+        self.assertEqual(budget.stats()['in_use'], 0)
+
+    def test_read_buffers(self):
+        with read_buffers(64*MB, 4) as readsize:
+            self.assertEqual(readsize, 64*MB)
+        budget = MemoryBudget.create(1*MB)
+        with read_buffers(64*MB, 32) as readsize:
+            self.assertEqual(budget.stats()['in_use'], readsize * 32)
+        self.assertEqual(budget.stats()['in_use'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
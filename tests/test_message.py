@@ -0,0 +1,152 @@
+import asyncio
+import json
+import socket
+import struct
+import unittest
+
+from cephsumserver.server import compact, message
+
+
+class CompactTest(unittest.TestCase):
+
+    def roundtrip(self, value):
+        self.assertEqual(compact.loads(compact.dumps(value)), value)
+
+    def test_scalars(self):
+        for value in (None, True, False, 0.5, -1e300, '', 'text', 'ünïcødé', b'', b'\x00\xff'):
+            self.roundtrip(value)
+
+    def test_int_boundaries(self):
+        for value in (0, 1, 255, 256, -1, -256, (1 << 63) - 1, -(1 << 63), 1 << 63, -(1 << 63) - 1, 10**40):
+            self.roundtrip(value)
+        # small non-negative ints take a single byte
+        self.assertEqual(bytes(compact.dumps(255)), b'u\xff')
+        self.assertEqual(len(compact.dumps(256)), 9)
+
+    def test_keys(self):
+        for key in compact.KEYS:
+            self.assertEqual(len(compact.dumps(key)), 2)
+            self.roundtrip(key)
+        self.assertEqual(len(compact.dumps('not a key')), 5 + len('not a key'))
+
+    def test_nested(self):
+        self.roundtrip({'msg':'response', 'status':0, 'details':{'digest':'01234567', 'digests':{'md5':'ab'},
+                        'trace':{'phases_ms':{'read':1.5}}, 'paths':['a', 'b', [1, 2, {}]]}, 'id':17})
+        # tuples are sent as lists, and keys as strings, as with json
+        self.assertEqual(compact.loads(compact.dumps({1:(1, 2)})), {'1':[1, 2]})
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            compact.dumps({'value':object()})
+
+    def test_truncated(self):
+        data = bytes(compact.dumps({'path':'pool:some/file', 'size':1 << 40}))
+        for length in range(len(data)):
+            with self.assertRaises(compact.DecodeError):
+                compact.loads(data[:length])
+
+    def test_truncated_big_int(self):
+        data = bytes(compact.dumps(10**40))
+        self.assertEqual(data[:1], b'I')
+        for length in range(6, len(data)):
+            with self.assertRaisesRegex(compact.DecodeError, 'Integer extends beyond message'):
+                compact.loads(data[:length])
+
+    def test_trailing_bytes(self):
+        with self.assertRaises(compact.DecodeError):
+            compact.loads(bytes(compact.dumps('path')) + b'N')
+
+    def test_unknown_tag(self):
+        with self.assertRaises(compact.DecodeError):
+            compact.loads(b'?')
+
+    def test_string_beyond_message(self):
+        with self.assertRaises(compact.DecodeError):
+            compact.loads(b's' + struct.pack('>I', 100) + b'short')
+
+
+class FramingTest(unittest.TestCase):
+
+    msg = {'msg':'cksum', 'path':'pool:file', 'algtype':'adler32', 'id':3}
+
+    def header(self, frame):
+        return struct.unpack('>I', bytes(frame[:4]))[0]
+
+    def test_json_frame(self):
+        frame = message.encode(self.msg)
+        self.assertEqual(self.header(frame), len(frame) - 4)
+        self.assertEqual(json.loads(frame[4:]), self.msg)
+
+    def test_binary_frame(self):
+        frame = message.encode(self.msg, message.BINARY)
+        length = self.header(frame)
+        # the top bit of the length marks the binary payload
+        self.assertTrue(length & message.BINARY_FLAG)
+        self.assertEqual(length & message.MAX_LENGTH, len(frame) - 4)
+        self.assertEqual(message.decode(frame[4:], binary=True), self.msg)
+
+    def test_sentinel(self):
+        for enc in message.ENCODINGS:
+            self.assertEqual(bytes(message.encode(None, enc)), bytes(4))
+
+    def test_length_limit(self):
+        self.assertEqual(message._check_length(0), 0)
+        self.assertEqual(message._check_length(message.MAX_LENGTH), message.MAX_LENGTH)
+        with self.assertRaises(ValueError):
+            message._check_length(message.MAX_LENGTH + 1)
+        self.assertEqual(message.MAX_LENGTH | message.BINARY_FLAG, 0xffffffff)
+
+    def test_negotiate(self):
+        self.assertEqual(message.negotiate({}), message.JSON)
+        self.assertEqual(message.negotiate({'enc':'bin'}), message.BINARY)
+        self.assertEqual(message.negotiate({'enc':'xml'}), message.JSON)
+
+    def test_socket(self):
+        a, b = socket.socketpair()
+        try:
+            # either encoding is accepted, in any order, then the sentinel
+            message.send(a, self.msg, message.BINARY)
+            message.send(a, self.msg)
+            message.send(a, {}, message.BINARY)
+            message.send(a, None)
+            self.assertEqual(message.recv(b), self.msg)
+            self.assertEqual(message.recv(b), self.msg)
+            self.assertEqual(message.recv(b), {})
+            self.assertEqual(message.recv(b), {})
+            a.close()
+            # a closed connection is treated as the sentinel
+            self.assertEqual(message.recv(b), {})
+        finally:
+            a.close()
+            b.close()
+
+    def test_socket_closed_mid_message(self):
+        a, b = socket.socketpair()
+        try:
+            a.sendall(bytes(message.encode(self.msg, message.BINARY))[:-1])
+            a.close()
+            with self.assertRaises(ConnectionError):
+                message.recv(b)
+        finally:
+            b.close()
+
+    def recv_async(self, data):
+        async def recv():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return [await message.recv_async(reader) for _ in range(3)]
+        return asyncio.run(recv())
+
+    def test_async(self):
+        data = b''.join(bytes(message.encode(m, enc)) for m, enc in
+                        ((self.msg, message.BINARY), (self.msg, message.JSON), (None, message.JSON)))
+        self.assertEqual(self.recv_async(data), [self.msg, self.msg, {}])
+
+    def test_async_closed_mid_message(self):
+        with self.assertRaises(ConnectionError):
+            self.recv_async(bytes(message.encode(self.msg, message.BINARY))[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
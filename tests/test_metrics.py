@@ -0,0 +1,70 @@
+import unittest
+
+from cephsumserver.common import metrics
+
+from . import create_pool
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_collector_gauges(self):
+        registry = metrics.Registry('test')
+        registry.register_collector('lanes', lambda: {'slow_queued':3, 'healthy':True, 'name':'ignored'})
+        lines = registry.exposition().splitlines()
+        self.assertIn('# HELP test_lanes_slow_queued The slow_queued value of the lanes stats', lines)
+        self.assertIn('# TYPE test_lanes_slow_queued gauge', lines)
+        self.assertIn('test_lanes_slow_queued 3', lines)
+        self.assertIn('test_lanes_healthy 1', lines)
+        self.assertFalse(any('name' in line for line in lines))
+
+    def test_labelled_collector(self):
+        registry = metrics.Registry('test')
+        clients = {0:{'inflight':1, 'ops':5}, 7:{'inflight':0, 'ops':2}}
+        registry.register_collector('radosclient', lambda: clients, label='client')
+        lines = registry.exposition().splitlines()
+        # a single gauge per value, with a sample per client
+        self.assertEqual(lines.count('# TYPE test_radosclient_inflight gauge'), 1)
+        self.assertIn('test_radosclient_inflight{client="0"} 1', lines)
+        self.assertIn('test_radosclient_inflight{client="7"} 0', lines)
+        self.assertIn('test_radosclient_ops{client="7"} 2', lines)
+        # replacing clients adds samples, not metric names
+        clients[8] = clients.pop(7)
+        names = {line.split()[2] for line in registry.exposition().splitlines() if line.startswith('# TYPE')}
+        self.assertEqual(names, {'test_radosclient_inflight', 'test_radosclient_ops'})
+
+    def test_failing_collector_skipped(self):
+        registry = metrics.Registry('test')
+        registry.register_collector('broken', lambda: 1/0)
+        registry.register_collector('ok', lambda: {'value':1})
+        self.assertIn('test_ok_value 1', registry.exposition().splitlines())
+
+    def test_counter_and_histogram(self):
+        registry = metrics.Registry('test')
+        counter = registry.counter('requests_total', 'Requests', ('request',))
+        histogram = registry.histogram('seconds', 'Latency', buckets=(1, 2))
+        counter.inc(2, 'cksum')
+        histogram.observe(1.5)
+        histogram.observe(5)
+        lines = registry.exposition().splitlines()
+        self.assertIn('# HELP test_requests_total Requests', lines)
+        self.assertIn('test_requests_total{request="cksum"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="1"} 0', lines)
+        self.assertIn('test_seconds_bucket{le="2"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count 2', lines)
+
+
+class RadosPoolStatsTest(unittest.TestCase):
+
+    def test_client_stats_separate(self):
+        pool = create_pool(max_size=2, min_size=2)
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertFalse(any(k.startswith('client') for k in stats))
+        clients = pool.client_stats()
+        self.assertEqual(sorted(clients), [c.id for c in pool._resources])
+        self.assertTrue(all('inflight' in v for v in clients.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import threading
+import time
+import unittest
+
+from cephsumserver.backend import memrados
+
+from . import POOL, create_pool
+
+
+class RadosPoolHealthTest(unittest.TestCase):
+
+    def setUp(self):
+        memrados.STORE.write_striped(POOL, 'health', data=b'x' * 10000, object_size=4096)
+
+    def clients(self, pool):
+        return list(pool._resources)
+
+    def test_long_checkout_not_stuck(self):
+        # a request holding its client longer than op_timeout, with each rados call quick, is not stuck
+        pool = create_pool(max_size=1, op_timeout=0.2)
+        client = self.clients(pool)[0]
+        with pool.ioctx(POOL) as ioctx:
+            ioctx.stat('health.0000000000000000')
+            time.sleep(0.4)
+            pool.health_check()
+            self.assertEqual(pool.stats()['replaced'], 0)
+            self.assertEqual(ioctx.read('health.0000000000000001', 4096, 0), b'x' * 4096)
+        self.assertEqual(self.clients(pool), [client])
+        self.assertEqual(client.oldest_op(), 0.)
+
+    def test_aio_timed_until_complete(self):
+        pool = create_pool(max_size=1)
+        client = self.clients(pool)[0]
+        done = threading.Event()
+        with pool.ioctx(POOL) as ioctx:
+            completion = ioctx.aio_read('health.0000000000000000', 4096, 0, lambda c, data: done.set())
+            completion.wait_for_complete_and_cb()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(client.oldest_op(), 0.)
+        self.assertEqual(client.stats()['ops'], 1)
+
+    def test_stuck_call_replaced(self):
+        pool = create_pool(max_size=1, op_timeout=0.1)
+        client = self.clients(pool)[0]
+        token = client.op_started()
+        time.sleep(0.2)
+        pool.health_check()
+        self.assertEqual(pool.stats()['replaced'], 1)
+        self.assertNotIn(client, self.clients(pool))
+        client.op_done(token)
+        # a new client is connected in the background, to keep the min size
+        for _ in range(50):
+            if len(self.clients(pool)) == 1:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(self.clients(pool)), 1)
+
+    def test_repeated_client_errors_replaced(self):
+        pool = create_pool(max_size=1)
+        client = self.clients(pool)[0]
+        for _ in range(pool.MAX_CONSECUTIVE_ERRORS):
+            with self.assertRaises(memrados.TimedOut):
+                with pool.ioctx(POOL):
+                    raise memrados.TimedOut("timed out")
+        self.assertFalse(client.healthy)
+        self.assertEqual(pool.stats()['replaced'], 1)
+
+    def test_request_errors_not_counted(self):
+        pool = create_pool(max_size=1)
+        client = self.clients(pool)[0]
+        for _ in range(pool.MAX_CONSECUTIVE_ERRORS + 1):
+            with self.assertRaises(memrados.ObjectNotFound):
+                with pool.ioctx(POOL) as ioctx:
+                    ioctx.stat('missing.0000000000000000')
+        self.assertTrue(client.healthy)
+        self.assertEqual(pool.stats()['replaced'], 0)
+
+
+class RadosPoolRetireTest(unittest.TestCase):
+
+    def setUp(self):
+        memrados.STORE.write_striped(POOL, 'retire', data=b'y' * 100, object_size=4096)
+        memrados.STORE.create_pool('other')
+
+    def wait_shutdown(self, cluster, timeout=5):
+        end = time.monotonic() + timeout
+        while cluster.state != 'shutdown' and time.monotonic() < end:
+            time.sleep(0.01)
+        return cluster.state == 'shutdown'
+
+    def test_replaced_while_in_use(self):
+        pool = create_pool(max_size=1)
+        client = pool._resources[0]
+        # an idle handle, on another pool, is closed at once
+        with pool.ioctx('other') as other:
+            pass
+        with pool.ioctx(POOL) as ioctx:
+            pool._replace(client)
+            self.assertTrue(other._ioctx._closed)
+            # the handle in use, and its client, remain open until released
+            self.assertEqual(ioctx.stat('retire.0000000000000000')[0], 100)
+            self.assertEqual(ioctx.read('retire.0000000000000000', 100, 0), b'y' * 100)
+            self.assertEqual(client.cluster.state, 'connected')
+        self.assertTrue(ioctx._ioctx._closed)
+        self.assertTrue(self.wait_shutdown(client.cluster))
+        self.assertEqual(client.ioctxs, {})
+
+    def test_replaced_when_idle(self):
+        pool = create_pool(max_size=1)
+        client = pool._resources[0]
+        with pool.ioctx(POOL) as ioctx:
+            pass
+        pool._replace(client)
+        self.assertTrue(ioctx._ioctx._closed)
+        self.assertTrue(self.wait_shutdown(client.cluster))
+
+    def test_closed_once(self):
+        pool = create_pool(max_size=1)
+        client = pool._resources[0]
+        closed = []
+        shutdown = client.cluster.shutdown
+        client.cluster.shutdown = lambda: (closed.append(True), shutdown())
+        with pool.ioctx(POOL):
+            with pool.ioctx(POOL):
+                pool._replace(client)
+                pool._replace(client)
+            self.assertEqual(closed, [])
+        self.assertTrue(self.wait_shutdown(client.cluster))
+        self.assertEqual(closed, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import threading
+import unittest
+
+from cephsumserver.common.requestmanager import ThreadedRequestHandler, ExecutionEngine, Response, SingleFlight
+from cephsumserver.workers import stat
+
+from . import POOL, create_pool
+
+
+class _Failing(ThreadedRequestHandler):
+    """Raises in run, before setting any response"""
+    def run(self):
+        raise RuntimeError("rados went away")
+
+
+class _FailingAfterResponse(ThreadedRequestHandler):
+    def run(self):
+        self.set_response(Response(1, {}, {'error':'File not found'}))
+        raise RuntimeError("raised after the response")
+
+
+class ThreadedRequestHandlerTest(unittest.TestCase):
+
+    def check_failures(self):
+        request = _Failing()
+        request.start()
+        self.assertTrue(request.is_ready(timeout=5), "no response set for a failed request")
+        self.assertEqual(request.response(), Response(1, {}, {'error':'rados went away'}))
+
+        request = _FailingAfterResponse()
+        request.start()
+        self.assertTrue(request.is_ready(timeout=5))
+        self.assertEqual(request.response().error, {'error':'File not found'})
+
+    def test_failure_in_thread(self):
+        self.assertIsNone(ExecutionEngine.engine())
+        self.check_failures()
+
+    def test_failure_in_engine(self):
+        engine = ExecutionEngine.create({ExecutionEngine.FAST:2, ExecutionEngine.SLOW:1})
+        try:
+            self.check_failures()
+        finally:
+            engine.shutdown()
+            ExecutionEngine._instance = None
+
+    def test_run_guarded(self):
+        # as called by servers running the request in their own executor
+        request = _Failing()
+        thread = threading.Thread(target=request.run_guarded)
+        thread.start()
+        thread.join()
+        self.assertEqual(request.response().status, 1)
+
+    def test_stat_rados_error(self):
+        # an error other than ObjectNotFound, here from a client already shut down
+        pool = create_pool(max_size=1)
+        pool._resources[0].cluster.shutdown()
+        request = stat.Stat({'msg':'stat', 'path':f'{POOL}:anything'})
+        request.start()
+        self.assertTrue(request.is_ready(timeout=5), "no response set for a failed stat")
+        self.assertEqual(request.response().status, 1)
+        self.assertIn('state shutdown', request.response().error['error'])
+
+
+class _Follower(ThreadedRequestHandler):
+    def run(self):
+        raise AssertionError("a follower does not run")
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_leader_and_followers(self):
+        flight = SingleFlight()
+        followers = [_Follower() for _ in range(3)]
+        self.assertTrue(flight.join('a', None))
+        for follower in followers:
+            self.assertFalse(flight.join('a', follower))
+        # another key has its own leader
+        self.assertTrue(flight.join('b', None))
+        self.assertEqual(flight.inflight(), 2)
+
+        response = Response(0, {'digest':'01234567'}, {})
+        flight.complete('a', response)
+        self.assertEqual(flight.inflight(), 1)
+        for follower in followers:
+            self.assertTrue(follower.is_ready(timeout=0))
+            self.assertEqual(follower.response(), response)
+
+        # once completed, the next request with the key leads again
+        self.assertTrue(flight.join('a', None))
+        flight.complete('a', response)
+        flight.complete('b', Response(1, {}, {'error':'failed'}))
+        self.assertEqual(flight.inflight(), 0)
+
+    def test_complete_unknown_key(self):
+        flight = SingleFlight()
+        flight.complete('a', Response(0, {}, {}))
+        self.assertEqual(flight.inflight(), 0)
+
+    def test_concurrent_joins(self):
+        flight = SingleFlight()
+        leaders = []
+        followers = []
+        barrier = threading.Barrier(8)
+        def join():
+            follower = _Follower()
+            barrier.wait()
+            if flight.join('key', follower):
+                leaders.append(follower)
+            else:
+                followers.append(follower)
+        threads = [threading.Thread(target=join) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(leaders), 1)
+        self.assertEqual(len(followers), 7)
+        flight.complete('key', Response(0, {}, {}))
+        self.assertTrue(all(follower.is_ready(timeout=0) for follower in followers))
+
+
+if __name__ == '__main__':
+    unittest.main()
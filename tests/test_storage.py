@@ -0,0 +1,66 @@
+import time
+import unittest
+import zlib
+
+from cephsumserver.backend import memrados
+from cephsumserver.backend.radosbackend import RadosBackend
+from cephsumserver.backend.storage import Backend, FileMetadata
+
+from . import POOL, create_pool
+
+
+class _Recording(Backend):
+    """A backend of a single file of data, recording the readahead of each read_stream"""
+    kind = 'test'
+
+    def __init__(self, data, size):
+        super().__init__('test')
+        self.data = data
+        self.size = size
+        self.readaheads = []
+
+    def metadata(self, path, with_stat=False):
+        return FileMetadata(path, {}, self.size, time.localtime())
+
+    def read_stream(self, path, readsize, readahead=0):
+        self.readaheads.append(readahead)
+        for offset in range(0, len(self.data), readsize):
+            yield self.data[offset:offset+readsize]
+
+
+class CksFromFileMultiTest(unittest.TestCase):
+
+    def test_max_inflight_reads_ahead(self):
+        backend = _Recording(b'z' * 5000, 5000)
+        checksums = backend.cks_from_file_multi('file', ['adler32'], 1024, max_inflight=4)
+        self.assertEqual(checksums['adler32'].get_cksum_as_hex(), f'{zlib.adler32(b"z" * 5000):08x}')
+        backend.cks_from_file('file', 1024, max_inflight=3, readahead=2)
+        backend.cks_from_file('file', 1024)
+        self.assertEqual(backend.readaheads, [4, 3, 0])
+
+    def test_size_unknown(self):
+        backend = _Recording(b'z' * 5000, None)
+        with self.assertRaises(IOError):
+            backend.cks_from_file_multi('file', ['adler32'], 1024)
+
+    def test_size_mismatch(self):
+        backend = _Recording(b'z' * 5000, 6000)
+        with self.assertRaises(IOError):
+            backend.cks_from_file_multi('file', ['adler32', 'md5'], 1024)
+
+    def test_rados_no_striper_size(self):
+        memrados.STORE.write_striped(POOL, 'nosize', data=b'w' * 5000, object_size=4096)
+        chunk0 = memrados.STORE.pool(POOL)[f'nosize.{0:016x}']
+        del chunk0.xattrs['striper.size']
+        pool = create_pool()
+        with pool.ioctx(POOL) as ioctx:
+            backend = RadosBackend(ioctx)
+            for max_inflight in (1, 4):
+                with self.assertRaises(IOError):
+                    backend.cks_from_file('nosize', 1024, max_inflight=max_inflight)
+            with self.assertRaises(IOError):
+                backend.cks_from_file_multi('nosize', ['adler32', 'md5'], 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()